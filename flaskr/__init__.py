@@ -1,11 +1,16 @@
 """Creates and configures a Flask app for serving a wiki website."""
 
-from flaskr import pages, login
+from flaskr import pages, login, metrics
 from flaskr.backend import Backend
+from flaskr.metrics import MetricsDriver, StorageMetrics
+from flaskr.storage_drivers import DriverClient, create_driver
 from flask import Flask
 from flask_login import LoginManager
 
+import click
+import csv
 import logging
+import os
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -19,7 +24,17 @@ def create_app(test_config=None):
 
     # This is the default secret key used for login sessions
     # By default the dev environment uses the key 'dev'
-    app.config.from_mapping(SECRET_KEY='dev')
+    # STORAGE_DRIVER picks where pages, users and images are kept: "gcs",
+    # "local" (files under STORAGE_ROOT), "memory" (lost on exit) or a
+    # StorageDriver object. STORAGE_REQUEST_LOG logs the storage calls of
+    # every request.
+    # MAX_CONTENT_LENGTH limits the size of uploads.
+    app.config.from_mapping(SECRET_KEY='dev',
+                            MAX_CONTENT_LENGTH=pages.MAX_UPLOAD_BYTES,
+                            STORAGE_DRIVER='gcs',
+                            STORAGE_REQUEST_LOG=False,
+                            STORAGE_ROOT=os.path.join(app.instance_path,
+                                                      'storage'))
 
     if test_config is None:
         # Load the instance config, if it exists, when not testing.
@@ -30,12 +45,55 @@ def create_app(test_config=None):
         app.config.from_mapping(test_config)
 
     # Solution code: modifying the additional endpoints
-    backend = Backend()
+    driver = app.config['STORAGE_DRIVER']
+    if isinstance(driver, str):
+        driver = create_driver(driver, root=app.config['STORAGE_ROOT'])
+    # Every storage call is recorded under the route that made it.
+    storage_metrics = StorageMetrics()
+    backend = Backend(
+        storage_client=DriverClient(MetricsDriver(driver, storage_metrics)))
+    app.extensions['backend'] = backend
+    app.extensions['storage_metrics'] = storage_metrics
+    storage_metrics.add_counter("tag_rewrites_total",
+                                "Full rewrites of the tags file.",
+                                lambda: backend.tag_handler.rewrites)
+    storage_metrics.add_counter(
+        "tag_write_conflicts_total",
+        "Tags file writes that lost a race with another writer.",
+        lambda: backend.tag_handler.write_conflicts)
     login_manager = LoginManager(app)
-    login_manager.login_view = "login"
+    login_manager.login_view = "user_login"
 
+    metrics.make_endpoints(app, storage_metrics)
     pages.make_endpoints(app, backend)
     login.make_endpoints(app, login_manager, backend)
+
+    @app.cli.command("rebuild-manifest")
+    def rebuild_manifest():
+        """Rebuilds the page manifest from a scan of the page bucket."""
+        backend.rebuild_manifest()
+
+    @app.cli.command("resanitize-pages")
+    def resanitize_pages():
+        """Sanitizes every page again after the allowlist changed."""
+        click.echo(f"Sanitized {backend.resanitize_pages()} pages.")
+
+    @app.cli.command("rebuild-search-index")
+    def rebuild_search_index():
+        """Rebuilds the full-text search index from every page."""
+        backend.rebuild_search_index()
+
+    @app.cli.command("load-tree-occurrences")
+    @click.argument("csv_file", type=click.File("r"))
+    def load_tree_occurrences(csv_file):
+        """Replaces the trees on the map with those in a CSV file.
+
+        The file needs species, latitude and longitude columns.
+        """
+        backend.load_tree_occurrences(
+            (row["species"], float(row["latitude"]), float(row["longitude"]))
+            for row in csv.DictReader(csv_file))
+
     return app
 
 
@@ -1,48 +1,305 @@
-from difflib import get_close_matches
+from flaskr.fuzzy_index import TrigramIndex
+from flaskr.manifest import PageManifest, is_page_name
+from flaskr.page_cache import PageCache
+from flaskr.page_index import PageIndex
+from flaskr.sanitizer import sanitize_html, sanitized_name
+from flaskr.text_index import StoredTextIndex, page_snippet
+from flaskr.storage_client import get_storage_client
 from flaskr.tag_handler import TagHandler
-from google.cloud import storage
+from flaskr.thumbnails import DERIVATIVE_PREFIX, Thumbnailer
+from flaskr.tree_occurrences import (TREE_DISTRIBUTIONS, StoredTreeOccurrences,
+                                     TreeOccurrences)
+from flaskr.user_store import UserStore
+from flaskr.worker_pool import WorkerPool
 from flask import abort
-from bleach import Cleaner
+from google.api_core.exceptions import NotFound, PreconditionFailed
+import bisect
 import hashlib
-import folium
-from folium import plugins
+import hmac
 import html.parser
+import mimetypes
+import sys
+
+# Seconds the sidebar's list of page names is reused before listing the
+# page bucket again.
+PAGE_INDEX_TTL = 60
+
+# The most page names returned by one call to list_pages.
+PAGE_LIST_LIMIT = 100
+
+# The memory, in bytes, that cached page contents may use.
+PAGE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# Uploaded files with these endings are stored as images.
+IMAGE_SUFFIXES = ("png", "jpg", "jpeg")
+
+# The content type of pages and their sanitized copies.
+PAGE_CONTENT_TYPE = "text/html; charset=utf-8"
+
+# Bytes of an image downloaded and sent at a time.
+IMAGE_CHUNK_SIZE = 256 * 1024
+
+
+def page_list_key(name):
+    """Returns the key page names are sorted by for list_pages."""
+    return (name.casefold(), name)
 
 
 class Backend:
 
-    def __init__(self, storage_client=storage.Client()):
+    def __init__(self,
+                 storage_client=None,
+                 page_index_ttl=PAGE_INDEX_TTL,
+                 page_cache_max_bytes=PAGE_CACHE_MAX_BYTES,
+                 workers=None):
         # Solution Storage: uses storage client to make buckets that are
         # essentially hidden from the frontend
+        if storage_client is None:
+            storage_client = get_storage_client()
         self.page_bucket = storage_client.bucket("wiki_content_p1")
+        # Runs independent storage calls of a request at the same time.
+        self.workers = workers or WorkerPool()
         self.login_bucket = storage_client.bucket("users_passwords_p1")
+        self.users = UserStore(self.login_bucket)
         self.image_bucket = storage_client.bucket("developer_images")
+        self.manifest = PageManifest(self.page_bucket)
+        self.page_index = PageIndex(self.manifest.page_names,
+                                    ttl=page_index_ttl)
+        self.page_cache = PageCache(self.page_bucket,
+                                    max_bytes=page_cache_max_bytes)
+        self.name_index = TrigramIndex()
+        self._name_index_version = None
+        # (version, sort keys, names) of the page index, sorted for paging.
+        self._page_list = (None, [], [])
+        self.text_index = StoredTextIndex(self.page_bucket)
+        self.thumbnails = Thumbnailer(self.image_bucket)
+        self.tree_occurrences = StoredTreeOccurrences(
+            self.page_bucket,
+            TreeOccurrences.from_distributions(TREE_DISTRIBUTIONS))
+        # Shared by every request so its in-memory tag index is reused.
+        self.tag_handler = TagHandler(storage_client=storage_client)
 
     def get_wiki_page(self, name):  #wiki_content_p1
-        blob_name = name
-        # Solution code: uses page_bucket and checks for None value
-        blob = self.page_bucket.blob(blob_name)
-        if blob is None:
+        """Returns the content of a page, or None if there is no such page.
+
+        Pages are served from the page cache, which only downloads a page
+        again after its blob has changed. Data blobs and sanitized copies
+        kept in the page bucket are not pages, so None is returned for them.
+        """
+        if not is_page_name(name):
+            return None
+        return self.page_cache.get(name)
+
+    def get_page_text(self, name):
+        """Returns the content of a page, even if it is not valid UTF-8.
+
+        Pages are stored as uploaded, so a page need not be UTF-8. Such a
+        page is downloaded and what does not decode is replaced, as upload()
+        does for the sanitized copy and the search text. Other pages are
+        read through the page cache.
+
+        Returns:
+            The page content, or None if there is no such page.
+        """
+        try:
+            return self.get_wiki_page(name)
+        except UnicodeDecodeError:
+            pass
+        try:
+            content = self.page_bucket.blob(name).download_as_bytes()
+        except NotFound:
             return None
-        return blob.download_as_text()
+        return content.decode("utf-8", errors="replace")
+
+    def get_sanitized_page(self, name):
+        """Returns the sanitized HTML of a page, or None if there is no page.
+
+        The sanitized copy stored when the page was uploaded is served from
+        the page cache. A page uploaded before copies were stored is
+        sanitized when it is first viewed, and its copy is stored then.
+        Names that are not pages give None, so no copy is stored for them.
+        """
+        if not is_page_name(name):
+            return None
+        html = self.page_cache.get(sanitized_name(name))
+        if html is not None:
+            return html
+        content = self.get_wiki_page(name)
+        if content is None:
+            return None
+        try:
+            return self._store_sanitized(name, content, if_generation_match=0)
+        except PreconditionFailed:
+            # Another request stored the copy first; it is the same HTML.
+            return sanitize_html(content)
+
+    def _store_sanitized(self, name, content, if_generation_match=None):
+        # Sanitizes a page, stores the copy and returns the sanitized HTML.
+        html = sanitize_html(content)
+        self.page_bucket.blob(sanitized_name(name)).upload_from_string(
+            html,
+            content_type=PAGE_CONTENT_TYPE,
+            if_generation_match=if_generation_match)
+        self.page_cache.invalidate(sanitized_name(name))
+        return html
 
     def get_all_page_names(self):
-        self.pages = []
-        # Solution code: uses page bucket and doesn't list image files
-        for blob in self.page_bucket.list_blobs():
-            if not blob.name.endswith(("png", "jpg", "jpeg", "csv")):
-                self.pages.append(blob.name)
-        return self.pages
+        """Returns the names of all wiki pages.
+
+        The names come from the cached page index, which is refreshed from
+        the page manifest once per TTL or after an upload.
+
+        Returns:
+            A new list of page names.
+        """
+        return list(self.page_index.get())
+
+    def list_pages(self, prefix="", cursor=None, limit=PAGE_LIST_LIMIT):
+        """Returns one batch of page names, sorted ignoring case.
+
+        Args:
+            prefix: Only names starting with this, ignoring case, are listed.
+            cursor: The "next" cursor of the previous batch, to continue
+                after it.
+            limit: The most names to return.
+
+        Returns:
+            A dictionary with the batch's "pages", the "next" cursor or
+            None after the last batch, the "total" number of names with the
+            prefix and the "version" of the page index they were read from.
+        """
+        version, keys, names = self._get_page_list()
+        folded = prefix.casefold()
+        start = bisect.bisect_left(keys, (folded,))
+        if cursor is not None:
+            start = max(start, bisect.bisect_right(keys, page_list_key(cursor)))
+        end = start
+        stop = min(start + limit, len(keys))
+        while end < stop and keys[end][0].startswith(folded):
+            end += 1
+        more = end < len(keys) and keys[end][0].startswith(folded)
+        return {
+            "pages": names[start:end],
+            "next": names[end - 1] if more else None,
+            "total": self._count_prefix(keys, folded),
+            "version": version,
+        }
+
+    @staticmethod
+    def _count_prefix(keys, folded):
+        first = bisect.bisect_left(keys, (folded,))
+        if not folded:
+            return len(keys) - first
+        # Sorts after every name that starts with the prefix.
+        after = (folded + chr(sys.maxunicode),)
+        return bisect.bisect_left(keys, after) - first
+
+    def _get_page_list(self):
+        # Sort the page index for paging once per version.
+        names, version = self.page_index.get_versioned()
+        page_list = self._page_list
+        if page_list[0] != version:
+            keys = sorted(page_list_key(name) for name in names)
+            page_list = (version, keys, [name for _, name in keys])
+            self._page_list = page_list
+        return page_list
 
     def upload(self, file, name, original_filename):
-        bucket = self.page_bucket
-        if (original_filename.endswith(("png", "jpg", "jpeg"))):
-            bucket = self.image_bucket
-        blob = bucket.blob(name)
-        if blob.exists():
-            blob.delete()
-        with blob.open("wb") as f:
-            f.write(file)
+        """Stores an uploaded page or image, replacing any of the same name.
+
+        The object is overwritten by a single write, without checking for or
+        deleting the old object first. Images are streamed from the file to
+        storage; pages are read into memory, since they are also indexed.
+
+        Args:
+            file: The content, as bytes or a binary file.
+            name: The name of the page or image.
+            original_filename: The uploaded file's name. Files ending in png,
+                jpg or jpeg are stored as images.
+
+        Raises:
+            ValueError: If the upload cannot be stored under the name.
+        """
+        self.check_upload_name(name, original_filename)
+        is_bytes = isinstance(file, (bytes, bytearray))
+        if original_filename.endswith(IMAGE_SUFFIXES):
+            content_type, _ = mimetypes.guess_type(original_filename)
+            blob = self.image_bucket.blob(name)
+            if is_bytes:
+                blob.upload_from_string(bytes(file), content_type=content_type)
+            else:
+                blob.upload_from_file(file, content_type=content_type)
+            # Resized copies are named by the image's generation, so the old
+            # ones are simply no longer read.
+            return
+
+        content = bytes(file if is_bytes else file.read())
+        # Files that are not UTF-8, like a PDF, are stored as uploaded; only
+        # their sanitized copy and search text replace what does not decode.
+        text = content.decode("utf-8", errors="replace")
+        blob = self.page_bucket.blob(name)
+        # upload_from_string fills in the blob's size and generation, which
+        # the manifest entry needs.
+        blob.upload_from_string(content, content_type=PAGE_CONTENT_TYPE)
+        # Pages are sanitized once here, so viewing them needs no parsing.
+        self._store_sanitized(name, text)
+        self.manifest.record(blob, tags=[name])
+        self.page_index.invalidate()
+        self.page_cache.invalidate(name)
+        self.name_index.add(name)
+        self.text_index.add_document(name, text)
+
+    def check_upload_name(self, name, original_filename):
+        """Checks that an upload can be stored under a name.
+
+        Pages share their bucket with the wiki's data blobs, like the
+        manifest, so a page may only have a name that is listed as a page.
+        Images may not use the names of resized copies.
+
+        Args:
+            name: The name of the page or image.
+            original_filename: The uploaded file's name.
+
+        Raises:
+            ValueError: If the upload cannot be stored under the name.
+        """
+        if not name:
+            raise ValueError("Please give the page a name.")
+        if original_filename.endswith(IMAGE_SUFFIXES):
+            # Resized copies share the image bucket with the images.
+            if name.startswith(DERIVATIVE_PREFIX):
+                raise ValueError(
+                    f"Sorry! {name} cannot be used as an image name.")
+        elif not is_page_name(name):
+            raise ValueError(f"Sorry! {name} cannot be used as a page name.")
+
+    def rebuild_manifest(self):
+        """Regenerates the page manifest from a scan of the page bucket."""
+        self.manifest.rebuild(self.tag_handler.get_tags_by_filename())
+        self.page_index.invalidate()
+
+    def resanitize_pages(self):
+        """Replaces the sanitized copy of every page.
+
+        Run this after changing the allowlist in flaskr.sanitizer.
+
+        Returns:
+            The number of pages sanitized.
+        """
+        count = 0
+        for name in self.get_all_page_names():
+            content = self.get_page_text(name)
+            if content is not None:
+                self._store_sanitized(name, content)
+                count += 1
+        return count
+
+    def rebuild_search_index(self):
+        """Re-indexes the text of every page from the page bucket."""
+        pages = ((name, self.get_page_text(name))
+                 for name in self.get_all_page_names())
+        self.text_index.rebuild(
+            (name, content) for name, content in pages if content is not None)
 
     def is_valid_html(self, html):
         """Checks if the given HTML string is safe.
@@ -53,163 +310,134 @@ class Backend:
         Returns:
             True if the HTML is safe, False otherwise.
         """
-        cleaner = Cleaner(tags=[
-            'a', 'abbr', 'acronym', 'b', 'blockquote', 'br', 'code', 'title',
-            'div', 'em', 'i', 'li', 'ol', 'p', 'strong', 'u', 'ul', 'img'
-        ],
-                          attributes={
-                              'a': ['href', 'title'],
-                              'abbr': ['title'],
-                              'acronym': ['title'],
-                              'img': ['src', 'alt']
-                          })
+        return sanitize_html(html) == html
 
-        sanitized_html = cleaner.clean(html)
+    def get_tree_occurrences(self):
+        """Returns the trees shown on the tree map.
 
-        if sanitized_html != html:
-            return False
-        return True
-
-    def tree_map(self):
-        tree_distributions = {
-            'Coast Redwood': {
-                'location': (38.9822, -123.3781),
-                'distribution': 'North America',
-                'color': 'green'
-            },
-            'Ginko': {
-                'location': (39.7684, -86.1581),
-                'distribution': 'East Asia',
-                'color': 'red'
-            },
-            'Japanese Magnolia': {
-                'location': (35.8801, -79.0800),
-                'distribution': 'East Asia',
-                'color': 'blue'
-            },
-            'Juniper': {
-                'location': (40.7968, -77.8619),
-                'distribution': 'North America, Eurasia',
-                'color': 'orange'
-            },
-            'Live Oak': {
-                'location': (30.3894, -86.5229),
-                'distribution': 'North America',
-                'color': 'darkgreen'
-            },
-            'Monterey Cypress': {
-                'location': (36.6002, -121.8947),
-                'distribution': 'North America',
-                'color': 'darkblue'
-            },
-            'Palm': {
-                'location': (26.7056, -80.0364),
-                'distribution': 'Africa, Eurasia, Americas',
-                'color': 'pink'
-            },
-            'Palmetto': {
-                'location': (26.7153, -81.0522),
-                'distribution': 'North America',
-                'color': 'darkred'
-            },
-            'Water Oak': {
-                'location': (30.4383, -84.2807),
-                'distribution': 'North America',
-                'color': 'gray'
-            },
-            'White Oak': {
-                'location': (33.9860, -83.7185),
-                'distribution': 'North America',
-                'color': 'purple'
-            }
-        }
+        Species and clusters should be read from the same returned object,
+        so that a cluster's species index refers to the right species.
 
-        tree_names = [
-            'Coast Redwood', 'Ginko', 'Japanese Magnolia', 'Juniper',
-            'Live Oak', 'Monterey Cypress', 'Palm', 'Palmetto', 'Water Oak',
-            'White Oak'
-        ]
+        Returns:
+            A tree_occurrences.TreeOccurrences.
+        """
+        return self.tree_occurrences.get()
 
-        tree_map = folium.Map(location=[39.8283, -98.5795], zoom_start=5)
-
-        for i, tree in enumerate(tree_names):
-            description = "<b style='font-size: 16px;'>Distribution: </b><h style='font-size: 16px;'>{}</h>".format(
-                tree_distributions[tree]['distribution'])
-            popup_html = '<b>{}</b><br>{}<br><a href="#" onclick="window.top.location.href=\'/pages/{}\'; return false;">Learn More</a>'.format(
-                tree, description, tree)
-            folium.Marker(
-                location=tree_distributions[tree]['location'],
-                icon=folium.Icon(color=tree_distributions[tree]['color'],
-                                 icon='leaf',
-                                 prefix='fa'),
-                popup=popup_html,
-                tooltip=tree,
-            ).add_to(tree_map)
-
-        legend_html = '''
-                    <div style="position:fixed; 
-                            bottom: 50px; left: 50px; width: 160px; height: 300px; 
-                            border:2px solid grey; z-index:9999; font-size:14px;
-                            background-color:rgba(255, 255, 255, 0.8);">
-                    <h4 style="text-align:center; margin-top:10px;">Legend:</h4>
-                    <table style="margin-left:auto; margin-right:auto;">
-                        &nbsp; Legend: <br>
-                '''
-        for i in range(len(tree_names)):
-            legend_html += f'<tr><td><i style="background-color:{tree_distributions[tree_names[i]]["color"]}; border-radius:50%; width:10px; height:10px; display:inline-block;"></i></td><td style="padding-left:8px;">{tree_names[i]}</td></tr>'
-
-        legend_html += '''
-                </table>
-            </div>
-            '''
-        tree_map.get_root().html.add_child(folium.Element(legend_html))
-        map_html = tree_map._repr_html_()
-        return map_html
+    def load_tree_occurrences(self, records):
+        """Replaces the trees shown on the tree map.
+
+        Args:
+            records: (species name, lat, lng) tuples, one per tree.
+        """
+        self.tree_occurrences.save(TreeOccurrences.from_records(records))
 
     def sign_up(self, username, password):
-        blob = self.login_bucket.blob(f"users/{username}")
-        # blob = self.bucket.blob(username)
-        if blob.exists():
-            return False
+        """Creates a user.
 
+        Returns:
+            True if the user was created, False if the username is taken.
+        """
         # Hash password
         hash_pword = hashlib.blake2b(password.encode()).hexdigest()
 
-        user_blob = {"username": username, "hash_pword": hash_pword}
-        blob.upload_from_string(str(user_blob))
-
-        return True
+        user_record = {"username": username, "hash_pword": hash_pword}
+        return self.users.create(username, user_record)
 
     def sign_in(self, username, password):
-        blob = self.login_bucket.blob(f"users/{username}")
-        # blob = self.bucket.blob(username)
-        if not blob.exists():
+        """Checks a user's password.
+
+        Returns:
+            True if the user exists and the password is theirs.
+        """
+        user_record = self.users.get(username)
+        if user_record is None:
             return False
 
-        get_pword = blob.download_as_bytes()
-        get_pword = eval(get_pword)
         user_pword = hashlib.blake2b(password.encode()).hexdigest()
+        return hmac.compare_digest(user_record["hash_pword"], user_pword)
 
-        if get_pword["hash_pword"] == user_pword:
-            return True
-        else:
-            return False
+    def get_image_blob(self, image_name, width=None):
+        """Returns the blob of an image with its metadata loaded.
+
+        Only the metadata is fetched; use stream_image to read the bytes.
 
-    def get_image(self, image_name):
+        Args:
+            image_name: The name of the image in the image bucket.
+            width: If given, a copy of the image scaled down to this width is
+                returned instead. It must be one of thumbnails.ALLOWED_WIDTHS.
+
+        Returns:
+            A storage.Blob, or None if there is no such image.
+        """
+        if width is not None:
+            return self.thumbnails.get(image_name, width)
         # Solution code: check for if blob is none
-        blob = self.image_bucket.get_blob(image_name)
-        if blob is None:
-            return bytearray()
+        return self.image_bucket.get_blob(image_name)
+
+    def stream_image(self, blob, start=0, stop=None):
+        """Yields the bytes of an image blob in chunks.
+
+        Each chunk is a separate ranged download pinned to the blob's
+        generation, so only one chunk is held in memory at a time and a
+        concurrent overwrite cannot mix two versions of the image.
 
-        with blob.open("rb") as image:
-            f = image.read()
-            b = bytearray(f)
-            return b
+        Args:
+            blob: A blob returned by get_image_blob.
+            start: The offset of the first byte to send.
+            stop: The offset after the last byte to send; defaults to the
+                size of the blob.
+        """
+        if stop is None:
+            stop = blob.size
+        while start < stop:
+            end = min(start + IMAGE_CHUNK_SIZE, stop)
+            # GCS ranges include the end byte.
+            yield blob.download_as_bytes(start=start,
+                                         end=end - 1,
+                                         if_generation_match=blob.generation,
+                                         checksum=None)
+            start = end
+
+    def _get_name_index(self):
+        # Bring the trigram index up to date with the page index, re-indexing
+        # only the names that were added or removed since the last search.
+        # The names and their version come from the same snapshot, so the
+        # trigram index is never tagged with the version of other names.
+        names, version = self.page_index.get_versioned()
+        if version != self._name_index_version:
+            self.name_index.sync(names)
+            self._name_index_version = version
+        return self.name_index
 
     def search(self, search_input):
-        # Uses the difflib Python library(specifically the “get_close_matches” function)
-        # to return page results that might be spelled incorrectly.
-        tag_handler = TagHandler()
-        return set(
-            get_close_matches(search_input, self.get_all_page_names()) +
-            tag_handler.get_filenames_by_tag(search_input))
+        # Page names are matched through a trigram index that ranks results
+        # like difflib's "get_close_matches", so pages that might be spelled
+        # incorrectly are still found. Names and tags are looked up at the
+        # same time since both may need a round trip to storage.
+        names, tagged = self.workers.gather(
+            lambda: self._get_name_index().search(search_input),
+            lambda: self.tag_handler.get_filenames_by_tag(search_input))
+        return set(names + tagged)
+
+    def search_text(self, search_input, limit=10):
+        """Finds pages whose text matches the search words.
+
+        The index holds no page text, so each hit's snippet is cut from its
+        sanitized page, which is read through the page cache. The pages are
+        read at the same time.
+
+        Args:
+            search_input: The words to search for.
+            limit: The maximum number of results.
+
+        Returns:
+            A list of SearchHit tuples with the page name, BM25 score and a
+            snippet of the page text, best match first.
+        """
+        hits = self.text_index.get().search(search_input, limit)
+        pages = self.workers.gather(
+            *[lambda n=hit.name: self.get_sanitized_page(n) for hit in hits])
+        return [
+            hit._replace(snippet=page_snippet(html or "", search_input))
+            for hit, html in zip(hits, pages)
+        ]
@@ -1,11 +1,15 @@
 """This module contains tests for the Backend class in the flaskr application.
 """
-from unittest.mock import patch, MagicMock
+from unittest.mock import call, patch, MagicMock, PropertyMock
+from flaskr import sanitizer
 from flaskr.backend import Backend
+from flaskr.page_index import PageIndex
+from flaskr.storage_drivers import CountingDriver, DriverClient, MemoryDriver
+from google.api_core.exceptions import NotFound, NotModified
 from google.cloud import storage
 from bleach import Cleaner
+import hashlib
 import pytest
-import folium
 
 
 # Test fixtures
@@ -74,8 +78,39 @@ def mock_page_bucket():
     blobs[0].name = 'Coast Redwood'
     blobs[1].name = 'Not_A_Tree.png'
     blobs[2].name = 'Japanese Magnolia'
+    for blob in blobs:
+        blob.size = 10
+        blob.generation = 1
+        blob.content_type = 'text/html'
 
     mock.list_blobs.return_value = blobs
+
+    # The manifest and search index do not exist until they are first
+    # written; after that only conditional reads are made and nobody else
+    # changes them.
+    def download_data(if_generation_not_match=None):
+        if if_generation_not_match is None:
+            raise NotFound('data blob')
+        raise NotModified('data blob')
+
+    data_blobs = {}
+    for name in ['manifest.json', 'search_index.json.gz']:
+        data_blobs[name] = MagicMock(spec=storage.Blob)
+        data_blobs[name].name = name
+        data_blobs[name].generation = 2
+        data_blobs[name].download_as_bytes.side_effect = download_data
+
+    def blob(name):
+        if name in data_blobs:
+            return data_blobs[name]
+        page_blob = MagicMock(spec=storage.Blob)
+        page_blob.name = name
+        page_blob.size = 10
+        page_blob.generation = 3
+        page_blob.content_type = 'text/html'
+        return page_blob
+
+    mock.blob.side_effect = blob
     return mock
 
 
@@ -100,7 +135,7 @@ def mock_page_backend(mock_page_storage_client):
 
 
 # Test functions
-def test_get_wiki_page(mock_backend):
+def test_get_wiki_page(mock_backend, name):
     """Tests if the get_wiki_page method returns the correct content."""
     assert mock_backend.get_wiki_page(name) == "blob data"
 
@@ -134,60 +169,373 @@ def test_missing_closing_tag(mock_backend):
     assert not mock_backend.is_valid_html(missing_closing_tag)
 
 
-@patch("flaskr.backend.Cleaner")
+@patch("flaskr.sanitizer.Cleaner")
 def test_cleaner_mock(mock_cleaner, mock_backend):
     """
-    Tests if the Cleaner class is called with the correct arguments when using the
-    is_valid_html method.
+    Tests if the Cleaner class is created once, with the allowlist, and reused
+    by later calls to the is_valid_html method.
     """
     mock_cleaner.return_value = MagicMock(spec=Cleaner)
+    sanitizer._local.__dict__.clear()
     valid_html = '<div><p>Hello, world!</p><a href="https://example.com">Visit example.com</a></div>'
 
     mock_backend.is_valid_html(valid_html)
+    mock_backend.is_valid_html(valid_html)
+    sanitizer._local.__dict__.clear()
 
-    mock_cleaner.assert_called_with(tags=[
-        'a', 'abbr', 'acronym', 'b', 'blockquote', 'br', 'code', 'title', 'div',
-        'em', 'i', 'li', 'ol', 'p', 'strong', 'u', 'ul', 'img'
-    ],
-                                    attributes={
-                                        'a': ['href', 'title'],
-                                        'abbr': ['title'],
-                                        'acronym': ['title'],
-                                        'img': ['src', 'alt']
-                                    })
+    mock_cleaner.assert_called_once_with(tags=sanitizer.ALLOWED_TAGS,
+                                         attributes={
+                                             'a': ['href', 'title'],
+                                             'abbr': ['title'],
+                                             'acronym': ['title'],
+                                             'img': ['src', 'alt']
+                                         },
+                                         strip=True)
+    assert mock_cleaner.return_value.clean.call_count == 2
 
 
-def test_tree_map_is_map(mock_backend):
-    map_html = mock_backend.tree_map()
-    assert isinstance(map_html, str)
-    assert map_html.strip() != ""
+def test_tree_species_has_all_tree_names_and_colors(mock_backend, mock_blob):
+    mock_blob.download_as_bytes.side_effect = NotFound("no dataset")
+    expected_colors = [
+        'green', 'red', 'blue', 'orange', 'darkgreen', 'darkblue', 'pink',
+        'darkred', 'gray', 'purple'
+    ]
+    species = mock_backend.get_tree_occurrences().species
+    assert [s.name for s in species] == [
+        'Coast Redwood', 'Ginko', 'Japanese Magnolia', 'Juniper', 'Live Oak',
+        'Monterey Cypress', 'Palm', 'Palmetto', 'Water Oak', 'White Oak'
+    ]
+    assert [s.color for s in species] == expected_colors
 
 
-def test_tree_map_contains_marker_for_each_tree(mock_backend):
-    html = mock_backend.tree_map()
-    for tree_name in [
-            'Coast Redwood', 'Ginko', 'Japanese Magnolia', 'Juniper',
-            'Live Oak', 'Monterey Cypress', 'Palm', 'Palmetto', 'Water Oak',
-            'White Oak'
-    ]:
-        assert tree_name in html
+def test_tree_clusters_has_marker_for_each_tree(mock_backend, mock_blob):
+    mock_blob.download_as_bytes.side_effect = NotFound("no dataset")
+    clusters = mock_backend.get_tree_occurrences().clusters(
+        (-180, -90, 180, 90), zoom=10)
+    assert sorted(c.species for c in clusters) == list(range(10))
 
 
-def test_tree_map_contains_legend(mock_backend):
-    html = mock_backend.tree_map()
-    assert 'Legend:' in html
+def test_get_all_page_names_skips_images(mock_page_backend):
+    """Tests that image files are not listed as pages."""
+    assert mock_page_backend.get_all_page_names() == [
+        'Coast Redwood', 'Japanese Magnolia'
+    ]
 
 
-def test_tree_map_legend_has_all_tree_names_and_colors(mock_backend):
-    html = mock_backend.tree_map()
-    expected_colors = [
-        'green', 'red', 'blue', 'orange', 'darkgreen', 'darkblue', 'pink',
-        'darkred', 'gray', 'purple'
+def test_get_all_page_names_is_cached(mock_page_backend, mock_page_bucket):
+    """Tests that the page bucket is listed once while the index is fresh."""
+    mock_page_backend.get_all_page_names()
+    mock_page_backend.get_all_page_names()
+
+    mock_page_bucket.list_blobs.assert_called_once()
+
+
+def test_upload_adds_page_to_manifest(mock_page_backend, mock_page_bucket):
+    """Tests that an uploaded page is listed without scanning the bucket."""
+    mock_page_backend.get_all_page_names()
+    mock_page_backend.upload(b"<p>Palm</p>", "Palm", "Palm")
+
+    assert "Palm" in mock_page_backend.get_all_page_names()
+    mock_page_bucket.list_blobs.assert_called_once()
+
+
+def test_search_finds_misspelled_page(mock_page_backend):
+    """Tests that search matches page names through the trigram index."""
+    mock_page_backend.tag_handler = MagicMock()
+    mock_page_backend.tag_handler.get_filenames_by_tag.return_value = []
+
+    assert mock_page_backend.search("Japanese Magnolai") == {
+        'Japanese Magnolia'
+    }
+
+
+def test_search_finds_uploaded_page(mock_page_backend):
+    """Tests that an uploaded page is searchable right away."""
+    mock_page_backend.tag_handler = MagicMock()
+    mock_page_backend.tag_handler.get_filenames_by_tag.return_value = []
+    mock_page_backend.search("Palm")
+    mock_page_backend.upload(b"<p>Palm</p>", "Palm", "Palm")
+
+    assert mock_page_backend.search("Palm") == {'Palm'}
+
+
+def test_search_syncs_names_with_their_version(mock_page_backend):
+    """Tests that the trigram index is tagged with its names' version."""
+    mock_page_backend.tag_handler = MagicMock()
+    mock_page_backend.tag_handler.get_filenames_by_tag.return_value = []
+    page_index = MagicMock(spec=PageIndex)
+    page_index.get.return_value = ("Palm",)
+    page_index.get_versioned.return_value = (("Palm",), 1)
+    # A newer snapshot was swapped in after the names were read.
+    type(page_index).version = PropertyMock(return_value=2)
+    mock_page_backend.page_index = page_index
+
+    assert mock_page_backend.search("Palm") == {"Palm"}
+    page_index.get_versioned.return_value = (("Palm", "Oak"), 2)
+    assert mock_page_backend.search("Oak") == {"Oak"}
+
+
+def test_search_text_finds_uploaded_page(memory_backend):
+    """Tests that the text of an uploaded page is searchable."""
+    memory_backend.upload(b"<p>Palms like the tropics</p>", "Palm", "Palm")
+
+    hits = memory_backend.search_text("tropics")
+
+    assert [hit.name for hit in hits] == ["Palm"]
+    assert hits[0].snippet == "Palms like the tropics"
+
+
+def test_search_text_snippets_follow_page_changes(memory_backend):
+    """Tests that snippets are cut from the current page, not the index."""
+    memory_backend.upload(b"<p>Palms like the tropics</p>", "Palm", "Palm")
+    memory_backend.upload(b"<p>Tropics suit palms</p>", "Palm", "Palm")
+
+    assert [hit.snippet for hit in memory_backend.search_text("tropics")
+           ] == ["Tropics suit palms"]
+
+
+@patch("flaskr.backend.IMAGE_CHUNK_SIZE", 4)
+def test_stream_image_downloads_in_chunks(mock_backend):
+    """Tests that an image is read with one ranged download per chunk."""
+    image = MagicMock(spec=storage.Blob)
+    image.size = 10
+    image.generation = 3
+    image.download_as_bytes.side_effect = [b"0123", b"4567", b"89"]
+
+    assert list(mock_backend.stream_image(image)) == [b"0123", b"4567", b"89"]
+    ranges = [(call.kwargs["start"], call.kwargs["end"])
+              for call in image.download_as_bytes.call_args_list]
+    assert ranges == [(0, 3), (4, 7), (8, 9)]
+    assert image.download_as_bytes.call_args.kwargs["if_generation_match"] == 3
+
+
+@patch("flaskr.backend.IMAGE_CHUNK_SIZE", 4)
+def test_stream_image_range(mock_backend):
+    """Tests that only the requested bytes of an image are downloaded."""
+    image = MagicMock(spec=storage.Blob)
+    image.size = 10
+    image.download_as_bytes.return_value = b"23"
+
+    assert list(mock_backend.stream_image(image, 2, 4)) == [b"23"]
+    assert image.download_as_bytes.call_args.kwargs["start"] == 2
+    assert image.download_as_bytes.call_args.kwargs["end"] == 3
+
+
+def test_upload_invalidates_cached_page(mock_page_backend, mock_page_bucket):
+    """Tests that uploading a page drops its cached content."""
+    mock_page_backend.page_cache.invalidate = MagicMock()
+
+    mock_page_backend.upload(b"<p>Ginko</p>", "Ginko", "Ginko")
+
+    mock_page_backend.page_cache.invalidate.assert_any_call("Ginko")
+    mock_page_backend.page_cache.invalidate.assert_any_call("_sanitized/Ginko")
+
+
+def test_search_looks_up_names_and_tags(mock_page_backend):
+    """Tests that search() combines name and tag matches from the pool."""
+    mock_page_backend.tag_handler = MagicMock()
+    mock_page_backend.tag_handler.get_filenames_by_tag.return_value = [
+        "Live Oak"
+    ]
+    mock_page_backend.workers = MagicMock(wraps=mock_page_backend.workers)
+
+    assert "Live Oak" in mock_page_backend.search("evergreen")
+    mock_page_backend.workers.gather.assert_called_once()
+
+
+def test_upload_overwrites_page_with_one_write(mock_page_backend,
+                                               mock_page_bucket):
+    """Tests that uploading a page neither checks for nor deletes the old one."""
+    blobs = {}
+    make_blob = mock_page_bucket.blob.side_effect
+
+    def blob(name):
+        blobs[name] = make_blob(name)
+        return blobs[name]
+
+    mock_page_bucket.blob.side_effect = blob
+
+    mock_page_backend.upload(b"<p>Palm</p>", "Palm", "Palm")
+
+    assert blobs["Palm"].method_calls == [
+        call.upload_from_string(b"<p>Palm</p>",
+                                content_type="text/html; charset=utf-8")
+    ]
+
+
+def test_upload_streams_image_from_file(mock_backend, mock_blob):
+    """Tests that an uploaded image file is streamed, not read into memory."""
+    image = MagicMock()
+
+    mock_backend.upload(image, "tree.png", "tree.png")
+
+    assert mock_blob.method_calls == [
+        call.upload_from_file(image, content_type="image/png")
     ]
-    for i, tree_name in enumerate([
-            'Coast Redwood', 'Ginko', 'Japanese Magnolia', 'Juniper',
-            'Live Oak', 'Monterey Cypress', 'Palm', 'Palmetto', 'Water Oak',
-            'White Oak'
-    ]):
-        assert tree_name in html
-        assert expected_colors[i] in html
+    image.read.assert_not_called()
+    mock_blob.exists.assert_not_called()
+
+
+@pytest.fixture
+def memory_backend():
+    return Backend(storage_client=DriverClient(MemoryDriver()))
+
+
+def test_upload_stores_sanitized_page(memory_backend):
+    """Tests that uploading a page stores its sanitized copy next to it."""
+    memory_backend.upload(b'<h1>Palm</h1><script>steal()</script>', "Palm",
+                          "Palm")
+
+    stored = memory_backend.page_bucket.blob("_sanitized/Palm")
+    assert stored.download_as_text() == "<h1>Palm</h1>steal()"
+    assert memory_backend.get_sanitized_page("Palm") == "<h1>Palm</h1>steal()"
+    assert memory_backend.get_all_page_names() == ["Palm"]
+
+
+def test_get_sanitized_page_serves_stored_copy(memory_backend):
+    """Tests that viewing a page does not sanitize it again."""
+    memory_backend.upload(b"<p>Palm</p>", "Palm", "Palm")
+
+    with patch("flaskr.backend.sanitize_html") as mock_sanitize:
+        assert memory_backend.get_sanitized_page("Palm") == "<p>Palm</p>"
+    mock_sanitize.assert_not_called()
+
+
+def test_get_sanitized_page_sanitizes_older_pages_once(memory_backend):
+    """Tests that a page stored without a copy gets one on its first view."""
+    memory_backend.page_bucket.blob("Oak").upload_from_string(
+        '<p onclick="steal()">Oak</p>')
+
+    assert memory_backend.get_sanitized_page("Oak") == "<p>Oak</p>"
+    assert memory_backend.page_bucket.blob(
+        "_sanitized/Oak").download_as_text() == "<p>Oak</p>"
+    assert memory_backend.get_sanitized_page("Missing") is None
+
+
+def test_resanitize_pages(memory_backend):
+    """Tests that resanitizing replaces every sanitized copy."""
+    memory_backend.upload(b"<h1>Palm</h1>", "Palm", "Palm")
+    memory_backend.upload(b"<p>Oak</p>", "Oak", "Oak")
+
+    with patch.object(sanitizer, "ALLOWED_TAGS", ["p"]):
+        sanitizer._local.__dict__.clear()
+        assert memory_backend.resanitize_pages() == 2
+    sanitizer._local.__dict__.clear()
+
+    assert memory_backend.get_sanitized_page("Palm") == "Palm"
+    assert memory_backend.get_sanitized_page("Oak") == "<p>Oak</p>"
+
+
+def test_bulk_jobs_read_pages_that_are_not_utf8(memory_backend):
+    """Tests that resanitizing and re-indexing decode pages like uploads do."""
+    memory_backend.upload(b"<p>Caf\xe9 latte</p>", "Cafe", "Cafe")
+    memory_backend.upload(b"<p>Oak</p>", "Oak", "Oak")
+
+    assert memory_backend.resanitize_pages() == 2
+    memory_backend.rebuild_search_index()
+
+    assert memory_backend.get_sanitized_page("Cafe") == "<p>Caf\ufffd latte</p>"
+    assert [hit.name for hit in memory_backend.search_text("latte")] == ["Cafe"]
+    assert [hit.name for hit in memory_backend.search_text("oak")] == ["Oak"]
+
+
+def test_sign_up_and_sign_in(memory_backend):
+    """Tests that users are created once and signed in with their password."""
+    assert memory_backend.sign_up("ada", "secret")
+    assert not memory_backend.sign_up("ada", "other")
+
+    assert memory_backend.sign_in("ada", "secret")
+    assert not memory_backend.sign_in("ada", "other")
+    assert not memory_backend.sign_in("bob", "secret")
+
+
+def test_sign_in_reads_legacy_record(memory_backend):
+    """Tests that users stored as the repr of a dict can still sign in."""
+    hash_pword = hashlib.blake2b(b"secret").hexdigest()
+    memory_backend.login_bucket.blob("users/ada").upload_from_string(
+        str({
+            "username": "ada",
+            "hash_pword": hash_pword
+        }))
+
+    assert memory_backend.sign_in("ada", "secret")
+
+
+def test_list_pages_in_batches(memory_backend):
+    """Tests that pages are listed in sorted batches ignoring case."""
+    for name in ["palm", "Ginko", "Palmetto", "Live Oak", "Palm"]:
+        memory_backend.upload(name.encode(), name, name)
+
+    first = memory_backend.list_pages(limit=2)
+    second = memory_backend.list_pages(cursor=first["next"], limit=2)
+    last = memory_backend.list_pages(cursor=second["next"], limit=2)
+
+    assert first["pages"] == ["Ginko", "Live Oak"]
+    assert second["pages"] == ["Palm", "palm"]
+    assert last["pages"] == ["Palmetto"]
+    assert last["next"] is None
+    assert first["total"] == 5
+    assert first["version"] == memory_backend.page_index.version
+
+
+def test_list_pages_with_prefix(memory_backend):
+    """Tests that only names starting with the prefix are listed."""
+    for name in ["Ginko", "Palm", "Palmetto", "Pine", "palm"]:
+        memory_backend.upload(name.encode(), name, name)
+
+    first = memory_backend.list_pages(prefix="PALM", limit=2)
+    rest = memory_backend.list_pages(prefix="PALM", cursor=first["next"])
+
+    assert (first["pages"], first["total"]) == (["Palm", "palm"], 3)
+    assert (rest["pages"], rest["next"]) == (["Palmetto"], None)
+    assert memory_backend.list_pages(prefix="Oak") == {
+        "pages": [],
+        "next": None,
+        "total": 0,
+        "version": first["version"]
+    }
+
+
+def test_list_pages_sorts_once_per_version(memory_backend):
+    """Tests that the sorted names are reused until the index changes."""
+    memory_backend.upload(b"Palm", "Palm", "Palm")
+    memory_backend.list_pages()
+    page_list = memory_backend._page_list
+
+    memory_backend.list_pages(prefix="P")
+    assert memory_backend._page_list is page_list
+
+    memory_backend.upload(b"Oak", "Oak", "Oak")
+    assert memory_backend.list_pages()["pages"] == ["Oak", "Palm"]
+
+
+def test_upload_rejects_reserved_names(memory_backend):
+    """Tests that a page cannot replace one of the wiki's data blobs."""
+    with pytest.raises(ValueError):
+        memory_backend.upload(b"<p>x</p>", "manifest.json", "manifest.json")
+
+    assert memory_backend.page_bucket.get_blob("manifest.json") is None
+    memory_backend.upload(b"png", "tree.png", "tree.png")
+
+
+def test_image_overwrite_is_one_write():
+    """Tests that replacing an image makes no deletes."""
+    driver = CountingDriver(MemoryDriver())
+    backend = Backend(storage_client=DriverClient(driver))
+    backend.upload(b"one", "tree.png", "tree.png")
+    driver.reset()
+
+    backend.upload(b"two", "tree.png", "tree.png")
+
+    assert driver.stats()["calls"] == {"put": 1}
+
+
+def test_data_blobs_are_not_pages(memory_backend):
+    """Tests that reserved and sanitized blobs are not read as pages."""
+    memory_backend.upload(b"<p>Palm</p>", "Palm", "Palm")
+
+    assert memory_backend.get_wiki_page("manifest.json") is None
+    assert memory_backend.get_sanitized_page("manifest.json") is None
+    assert memory_backend.get_wiki_page("_sanitized/Palm") is None
+    assert not memory_backend.page_bucket.blob(
+        "_sanitized/manifest.json").exists()
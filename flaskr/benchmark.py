@@ -0,0 +1,370 @@
+"""Benchmarks of the wiki's hot paths against a local stand-in for storage.
+
+The benchmark seeds a MemoryDriver, or a LocalDriver directory, with a given
+number of pages, tags, images and mapped trees, and creates the app on top
+of it. It then runs every operation a number of times and reports its wall
+time, the storage round trips it made and the bytes it read and wrote.
+
+The first run of an operation is reported on its own as the cold run, since
+it fills the caches that later runs use. Storage round trips can be given a
+simulated latency, so that the cost of a round trip shows in the wall times.
+
+Run it with:
+    python -m flaskr.benchmark --pages 1000 --tags 50 --images 20
+    python -m flaskr.benchmark --latency 20 --json > results.json
+
+Example:
+    results = run_benchmarks(pages=100, repeat=10)
+    print(format_results(results))
+"""
+from collections import namedtuple
+from flaskr import create_app
+from flaskr.storage_drivers import (CountingDriver, LocalDriver, MemoryDriver,
+                                    WrappedDriver)
+from flaskr.tag_handler import TAGS_FILENAME
+from flaskr.tree_occurrences import TREE_DISTRIBUTIONS
+from io import BytesIO
+from PIL import Image
+from urllib.parse import quote
+import argparse
+import json
+import logging
+import random
+import statistics
+import time
+
+# Words the seeded pages are made of.
+WORDS = ("oak", "leaf", "bark", "root", "canopy", "acorn", "pine", "needle",
+         "seed", "branch", "forest", "grove", "evergreen", "deciduous",
+         "sapling", "trunk", "resin", "cone", "blossom", "shade")
+
+# Words in a seeded page.
+PAGE_WORDS = 300
+
+# Tags given to each seeded page, besides its own name.
+TAGS_PER_PAGE = 3
+
+# Width and height of the seeded images.
+IMAGE_SIZE = (1024, 768)
+
+# The box the seeded trees are spread over: west, south, east and north.
+TREE_BBOX = (-125.0, 25.0, -67.0, 49.0)
+
+# The map view requested by the clusters benchmark.
+MAP_VIEW = "bbox=-130,20,-60,50&zoom=5"
+
+# How a benchmark did. Times are in seconds; the warm figures are means over
+# every run after the first.
+Result = namedtuple("Result", [
+    "operation", "runs", "cold_seconds", "cold_round_trips", "warm_seconds",
+    "warm_p95_seconds", "warm_round_trips", "warm_bytes_read",
+    "warm_bytes_written", "calls"
+])
+
+
+class DelayedDriver(WrappedDriver):
+    """Waits before every operation, as a stand-in for network latency."""
+
+    def __init__(self, driver, latency):
+        """Creates a driver.
+
+        Args:
+            driver (StorageDriver): The driver that stores the objects.
+            latency (float): Seconds to wait before each operation.
+        """
+        super().__init__(driver)
+        self.latency = latency
+
+    def _call(self, operation, *args, **kwargs):
+        time.sleep(self.latency)
+        return super()._call(operation, *args, **kwargs)
+
+
+def make_image(size=IMAGE_SIZE, color="green"):
+    """Returns a PNG image of the given size."""
+    output = BytesIO()
+    Image.new("RGB", size, color).save(output, format="PNG")
+    return output.getvalue()
+
+
+def seed(driver, backend, pages, tags, images, trees, rng):
+    """Fills the buckets with generated pages, tags, images and trees.
+
+    The objects are written straight to the driver, so seeding is neither
+    delayed nor counted, and the manifest and search index are then rebuilt
+    from them.
+
+    Args:
+        driver (StorageDriver): The driver under the app's counting driver.
+        backend (Backend): The app's backend.
+        pages (int): The number of pages.
+        tags (int): The number of distinct tags shared by the pages.
+        images (int): The number of images.
+        trees (int): The number of trees on the map.
+        rng (random.Random): Makes the generated data repeatable.
+
+    Returns:
+        tuple: The page names, tags and image names.
+    """
+    page_bucket = backend.page_bucket.name
+    page_names = [f"Tree {i:05d}" for i in range(pages)]
+    for name in page_names:
+        text = " ".join(rng.choice(WORDS) for _ in range(PAGE_WORDS))
+        driver.put(page_bucket,
+                   name,
+                   f"<h1>{name}</h1><p>{text}</p>".encode(),
+                   content_type="text/html; charset=utf-8")
+
+    tag_names = [f"tag{i:03d}" for i in range(tags)]
+    lines = []
+    for name in page_names:
+        page_tags = {name, *rng.sample(tag_names, min(TAGS_PER_PAGE, tags))}
+        lines.append(
+            json.dumps({
+                "filename": name,
+                "tags": sorted(page_tags)
+            },
+                       separators=(",", ":")))
+    driver.put(page_bucket,
+               TAGS_FILENAME, ("\n".join(lines) + "\n").encode(),
+               content_type="application/x-ndjson")
+
+    image_names = [f"tree{i:04d}.png" for i in range(images)]
+    image = make_image()
+    for name in image_names:
+        driver.put(backend.image_bucket.name,
+                   name,
+                   image,
+                   content_type="image/png")
+
+    species = list(TREE_DISTRIBUTIONS)
+    west, south, east, north = TREE_BBOX
+    backend.load_tree_occurrences(
+        (rng.choice(species), rng.uniform(south, north),
+         rng.uniform(west, east)) for _ in range(trees))
+    backend.rebuild_manifest()
+    backend.rebuild_search_index()
+    return page_names, tag_names, image_names
+
+
+def _get(client, path):
+    response = client.get(path)
+    # Streamed bodies are only read from storage when they are consumed.
+    response.get_data()
+    response.close()
+    if response.status_code != 200:
+        raise RuntimeError(f"GET {path} returned {response.status_code}")
+
+
+def operations(app, backend, page_names, tag_names, image_names):
+    """Returns the benchmarked operations.
+
+    Returns:
+        dict: Operation names mapped to callables taking the run number.
+    """
+    client = app.test_client()
+    tag_handler = backend.tag_handler
+
+    def page_name(run):
+        return page_names[run % len(page_names)]
+
+    def tag(run):
+        return tag_names[run % len(tag_names)] if tag_names else page_name(run)
+
+    def add_tag_to_csv(run):
+        tag_handler.add_tag_to_csv(page_name(run), f"benchmark{run}")
+        # Tags are written by the next flush, which is part of the cost.
+        tag_handler.flush()
+
+    def upload(run):
+        name = f"Benchmark {run:05d}"
+        backend.upload(f"<p>Uploaded page {run}</p>".encode(), name, name)
+
+    benchmarks = {
+        "get_all_page_names":
+            lambda run: backend.get_all_page_names(),
+        "search":
+            lambda run: backend.search(page_name(run)),
+        "get_filenames_by_tag":
+            lambda run: tag_handler.get_filenames_by_tag(tag(run)),
+        "add_tag_to_csv":
+            add_tag_to_csv,
+        "upload":
+            upload,
+        "/pages/<filename>":
+            lambda run: _get(client, "/pages/" + quote(page_name(run))),
+        "/map/species":
+            lambda run: _get(client, "/map/species"),
+        "/map/clusters":
+            lambda run: _get(client, "/map/clusters?" + MAP_VIEW),
+    }
+    if image_names:
+        benchmarks["/images/<filename>"] = lambda run: _get(
+            client, "/images/" + image_names[run % len(image_names)])
+        benchmarks["/images/<filename>?size=thumb"] = lambda run: _get(
+            client, "/images/" + image_names[run % len(image_names)] +
+            "?size=thumb")
+    return benchmarks
+
+
+def measure(name, operation, counter, repeat):
+    """Runs an operation and measures every run.
+
+    Args:
+        name (str): The operation name.
+        operation (callable): Takes the run number.
+        counter (CountingDriver): Counts the storage operations.
+        repeat (int): How many times to run the operation.
+
+    Returns:
+        Result: The measurements.
+    """
+    runs = []
+    calls = {}
+    for run in range(repeat):
+        counter.reset()
+        start = time.perf_counter()
+        operation(run)
+        elapsed = time.perf_counter() - start
+        stats = counter.stats()
+        runs.append((elapsed, stats))
+        if run:
+            for call, count in stats["calls"].items():
+                calls[call] = calls.get(call, 0) + count
+
+    cold_seconds, cold = runs[0]
+    warm = runs[1:] or runs
+    warm_times = sorted(elapsed for elapsed, _ in warm)
+    return Result(
+        operation=name,
+        runs=repeat,
+        cold_seconds=cold_seconds,
+        cold_round_trips=cold["round_trips"],
+        warm_seconds=statistics.mean(warm_times),
+        warm_p95_seconds=warm_times[min(
+            len(warm_times) - 1, int(len(warm_times) * 0.95))],
+        warm_round_trips=statistics.mean(s["round_trips"] for _, s in warm),
+        warm_bytes_read=statistics.mean(s["bytes_read"] for _, s in warm),
+        warm_bytes_written=statistics.mean(s["bytes_written"] for _, s in warm),
+        calls={call: count / len(warm) for call, count in calls.items()})
+
+
+def run_benchmarks(pages=200,
+                   tags=20,
+                   images=5,
+                   trees=10000,
+                   repeat=20,
+                   latency=0.0,
+                   root=None,
+                   only=None,
+                   random_seed=0):
+    """Seeds the storage, creates the app and benchmarks every operation.
+
+    Args:
+        pages (int): The number of pages to seed; at least 1.
+        tags (int): The number of distinct tags.
+        images (int): The number of images.
+        trees (int): The number of trees on the map.
+        repeat (int): How many times to run each operation; at least 1.
+        latency (float): Seconds each storage round trip is delayed by.
+        root (str): A directory to keep the objects in with a LocalDriver;
+            by default they are kept in memory.
+        only (list): The names of the operations to run; defaults to all.
+        random_seed (int): Makes the generated data repeatable.
+
+    Returns:
+        list: A Result for every operation.
+    """
+    if pages < 1 or repeat < 1:
+        raise ValueError("pages and repeat must be at least 1")
+    driver = LocalDriver(root) if root else MemoryDriver()
+    counter = CountingDriver(DelayedDriver(driver, latency))
+    app = create_app({
+        "TESTING": True,
+        "SECRET_KEY": "benchmark",
+        "STORAGE_DRIVER": counter
+    })
+    backend = app.extensions["backend"]
+    try:
+        page_names, tag_names, image_names = seed(driver, backend, pages, tags,
+                                                  images, trees,
+                                                  random.Random(random_seed))
+        benchmarks = operations(app, backend, page_names, tag_names,
+                                image_names)
+        unknown = set(only or ()) - set(benchmarks)
+        if unknown:
+            raise ValueError(f"Unknown operations: {', '.join(unknown)}")
+        return [
+            measure(name, operation, counter, repeat)
+            for name, operation in benchmarks.items()
+            if not only or name in only
+        ]
+    finally:
+        backend.workers.shutdown()
+
+
+def format_results(results):
+    """Formats results as a table with one row per operation."""
+    header = ("operation", "cold ms", "cold trips", "warm ms", "p95 ms",
+              "warm trips", "read B", "written B")
+    rows = [header]
+    for result in results:
+        rows.append(
+            (result.operation, f"{result.cold_seconds * 1000:.2f}",
+             str(result.cold_round_trips), f"{result.warm_seconds * 1000:.2f}",
+             f"{result.warm_p95_seconds * 1000:.2f}",
+             f"{result.warm_round_trips:.1f}", f"{result.warm_bytes_read:.0f}",
+             f"{result.warm_bytes_written:.0f}"))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    return "\n".join("  ".join(
+        cell.ljust(width) if i == 0 else cell.rjust(width)
+        for i, (cell, width) in enumerate(zip(row, widths)))
+                     for row in rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m flaskr.benchmark",
+        description="Benchmarks the wiki against a local stand-in for "
+        "Cloud Storage.")
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--tags", type=int, default=20)
+    parser.add_argument("--images", type=int, default=5)
+    parser.add_argument("--trees", type=int, default=10000)
+    parser.add_argument("--repeat",
+                        type=int,
+                        default=20,
+                        help="runs of each operation")
+    parser.add_argument("--latency",
+                        type=float,
+                        default=0.0,
+                        help="milliseconds added to every storage round trip")
+    parser.add_argument("--root",
+                        help="keep the objects in this directory instead of "
+                        "in memory")
+    parser.add_argument("--only",
+                        action="append",
+                        help="run only this operation; may be repeated")
+    parser.add_argument("--json",
+                        action="store_true",
+                        help="print the results as JSON")
+    args = parser.parse_args(argv)
+
+    # The app logs at DEBUG level, which would drown the results.
+    logging.getLogger().setLevel(logging.WARNING)
+    results = run_benchmarks(pages=args.pages,
+                             tags=args.tags,
+                             images=args.images,
+                             trees=args.trees,
+                             repeat=args.repeat,
+                             latency=args.latency / 1000,
+                             root=args.root,
+                             only=args.only)
+    if args.json:
+        print(json.dumps([result._asdict() for result in results], indent=2))
+    else:
+        print(format_results(results))
+
+
+if __name__ == "__main__":
+    main()
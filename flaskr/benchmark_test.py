@@ -0,0 +1,48 @@
+"""Tests for the benchmark suite in the flaskr application."""
+from flaskr.benchmark import format_results, run_benchmarks
+import pytest
+
+
+def test_run_benchmarks():
+    results = run_benchmarks(pages=5, tags=2, images=1, trees=50, repeat=2)
+
+    by_operation = {result.operation: result for result in results}
+    assert set(by_operation) == {
+        "get_all_page_names", "search", "get_filenames_by_tag",
+        "add_tag_to_csv", "upload", "/pages/<filename>", "/map/species",
+        "/map/clusters", "/images/<filename>", "/images/<filename>?size=thumb"
+    }
+    assert by_operation["upload"].warm_round_trips > 0
+    assert by_operation["upload"].warm_bytes_written > 0
+    assert by_operation["/images/<filename>"].warm_bytes_read > 0
+    assert all(result.runs == 2 for result in results)
+
+
+def test_run_benchmarks_on_local_directory(tmp_path):
+    results = run_benchmarks(pages=3,
+                             images=0,
+                             trees=10,
+                             repeat=1,
+                             root=str(tmp_path),
+                             only=["/pages/<filename>"])
+
+    assert [result.operation for result in results] == ["/pages/<filename>"]
+    assert results[0].cold_round_trips > 0
+
+
+def test_run_benchmarks_unknown_operation():
+    with pytest.raises(ValueError):
+        run_benchmarks(pages=1, images=0, trees=0, repeat=1, only=["tree_map"])
+
+
+def test_format_results():
+    results = run_benchmarks(pages=1,
+                             images=0,
+                             trees=0,
+                             repeat=1,
+                             only=["get_all_page_names"])
+
+    lines = format_results(results).splitlines()
+
+    assert lines[0].startswith("operation")
+    assert lines[1].startswith("get_all_page_names")
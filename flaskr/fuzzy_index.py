@@ -0,0 +1,137 @@
+"""Trigram index for fuzzy page name search.
+
+difflib.get_close_matches compares the query against every page name. The
+TrigramIndex instead keeps, for every three-letter sequence, the set of names
+that contain it. A query only looks at names that share trigrams with it,
+keeps the most promising of those, and ranks them with the same
+SequenceMatcher ratio that get_close_matches uses.
+
+Example:
+    index = TrigramIndex(["Coast Redwood", "Live Oak", "White Oak"])
+    index.add("Water Oak")
+    matches = index.search("wite oak")
+"""
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+import heapq
+import threading
+
+# The defaults of difflib.get_close_matches.
+DEFAULT_LIMIT = 3
+DEFAULT_CUTOFF = 0.6
+
+# How many names sharing the most trigrams with the query are scored.
+MAX_CANDIDATES = 50
+
+
+def trigrams(text):
+    """Returns the set of lowercase trigrams of a string.
+
+    The string is padded so that short strings and word boundaries still
+    produce trigrams.
+
+    Args:
+        text (str): The string to split.
+    """
+    padded = "  " + text.lower() + " "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class TrigramIndex:
+    """An incrementally updated trigram index over page names."""
+
+    def __init__(self, names=()):
+        self._postings = defaultdict(set)
+        self._grams_by_name = {}
+        self._lock = threading.Lock()
+        for name in names:
+            self.add(name)
+
+    def __contains__(self, name):
+        return name in self._grams_by_name
+
+    def __len__(self):
+        return len(self._grams_by_name)
+
+    def add(self, name):
+        """Adds a name to the index. Adding a known name does nothing.
+
+        Args:
+            name (str): The page name to add.
+        """
+        with self._lock:
+            if name in self._grams_by_name:
+                return
+            grams = trigrams(name)
+            self._grams_by_name[name] = grams
+            for gram in grams:
+                self._postings[gram].add(name)
+
+    def remove(self, name):
+        """Removes a name from the index if it is present.
+
+        Args:
+            name (str): The page name to remove.
+        """
+        with self._lock:
+            grams = self._grams_by_name.pop(name, ())
+            for gram in grams:
+                self._postings[gram].discard(name)
+                if not self._postings[gram]:
+                    del self._postings[gram]
+
+    def sync(self, names):
+        """Adds and removes names so the index holds exactly the given names.
+
+        Only the names that changed are re-indexed.
+
+        Args:
+            names (iterable): The page names that should be indexed.
+        """
+        names = set(names)
+        with self._lock:
+            indexed = set(self._grams_by_name)
+        for name in indexed - names:
+            self.remove(name)
+        for name in names - indexed:
+            self.add(name)
+
+    def search(self, query, limit=DEFAULT_LIMIT, cutoff=DEFAULT_CUTOFF):
+        """Returns the names most similar to the query.
+
+        Like difflib.get_close_matches, names are ranked by
+        SequenceMatcher.ratio() and only names scoring at least the cutoff
+        are returned. Case is ignored.
+
+        Args:
+            query (str): The text to search for.
+            limit (int): The maximum number of names to return.
+            cutoff (float): The minimum similarity between 0 and 1.
+
+        Returns:
+            list: Matching names, best match first.
+        """
+        query_grams = trigrams(query)
+        shared = Counter()
+        with self._lock:
+            for gram in query_grams:
+                shared.update(self._postings.get(gram, ()))
+            # Dice coefficient of the trigram sets, a cheap similarity
+            # estimate used to pick which names are worth scoring exactly.
+            candidates = heapq.nlargest(
+                MAX_CANDIDATES,
+                shared,
+                key=lambda name: 2 * shared[name] /
+                (len(query_grams) + len(self._grams_by_name[name])))
+
+        matcher = SequenceMatcher()
+        matcher.set_seq2(query.lower())
+        scored = []
+        for name in candidates:
+            matcher.set_seq1(name.lower())
+            if (matcher.real_quick_ratio() >= cutoff and
+                    matcher.quick_ratio() >= cutoff):
+                score = matcher.ratio()
+                if score >= cutoff:
+                    scored.append((score, name))
+        return [name for _, name in heapq.nlargest(limit, scored)]
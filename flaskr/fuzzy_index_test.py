@@ -0,0 +1,74 @@
+"""Tests for the TrigramIndex class in the flaskr application."""
+from flaskr.fuzzy_index import TrigramIndex, trigrams
+from difflib import get_close_matches
+import pytest
+
+TREES = [
+    'Coast Redwood', 'Ginko', 'Japanese Magnolia', 'Juniper', 'Live Oak',
+    'Monterey Cypress', 'Palm', 'Palmetto', 'Water Oak', 'White Oak'
+]
+
+
+@pytest.fixture
+def index():
+    return TrigramIndex(TREES)
+
+
+def test_trigrams_are_padded_and_lowercase():
+    """Tests that trigrams include the padded word boundaries."""
+    assert trigrams("Oak") == {"  o", " oa", "oak", "ak "}
+
+
+def test_search_exact_name(index):
+    """Tests that an exact name is the best match."""
+    assert index.search("Juniper")[0] == "Juniper"
+
+
+def test_search_misspelled_name(index):
+    """Tests that a misspelled name still finds the page."""
+    assert index.search("Gingko") == ["Ginko"]
+
+
+def test_search_ignores_case(index):
+    """Tests that matching ignores case."""
+    assert index.search("coast redwood") == ["Coast Redwood"]
+
+
+def test_search_respects_cutoff(index):
+    """Tests that names below the similarity cutoff are not returned."""
+    assert index.search("Sequoia") == []
+
+
+def test_search_respects_limit(index):
+    """Tests that no more than the limit of names are returned."""
+    assert len(index.search("Oak", limit=2, cutoff=0.1)) == 2
+
+
+def test_search_matches_get_close_matches(index):
+    """Tests that results agree with difflib for same-case queries."""
+    for query in ["Palm", "White Oak", "Japanese Magnolia", "Live Oaks"]:
+        assert index.search(query) == get_close_matches(query, TREES)
+
+
+def test_add_makes_name_searchable(index):
+    """Tests that an added name is found by later searches."""
+    index.add("Sugar Maple")
+
+    assert index.search("Sugar Mapel") == ["Sugar Maple"]
+
+
+def test_remove_drops_name(index):
+    """Tests that a removed name is no longer found."""
+    index.remove("Ginko")
+
+    assert "Ginko" not in index
+    assert index.search("Ginko") == []
+
+
+def test_sync_adds_and_removes(index):
+    """Tests that sync() leaves exactly the given names in the index."""
+    index.sync(["Ginko", "Sugar Maple"])
+
+    assert len(index) == 2
+    assert "Sugar Maple" in index
+    assert "Palm" not in index
@@ -0,0 +1,175 @@
+"""Single-object manifest describing every wiki page in the page bucket.
+
+Listing a bucket costs one round trip per thousand objects, so instead of
+scanning the page bucket the PageManifest keeps a JSON document next to the
+pages that records each page's name, size, generation, content type and tags.
+Readers fetch it with a conditional GET, which costs a single 304 response
+when nothing has changed. Writers update it with a generation precondition so
+concurrent uploads from several instances never overwrite each other.
+
+Example:
+    manifest = PageManifest(storage_client.bucket("wiki_content_p1"))
+    names = manifest.page_names()
+    manifest.record(blob, tags=["Palm"])
+    manifest.rebuild()
+"""
+from flaskr.sanitizer import SANITIZED_PREFIX
+from flaskr.tag_handler import TAGS_FILENAME
+from flaskr.tree_occurrences import TREE_OCCURRENCES_NAME
+from google.api_core.exceptions import NotFound, NotModified, PreconditionFailed
+import json
+import threading
+
+MANIFEST_NAME = "manifest.json"
+SEARCH_INDEX_NAME = "search_index.json.gz"
+
+# Blobs in the page bucket that store wiki data rather than pages.
+RESERVED_NAMES = frozenset(
+    [MANIFEST_NAME, SEARCH_INDEX_NAME, TAGS_FILENAME, TREE_OCCURRENCES_NAME])
+
+# Image and data files that are uploaded next to the pages.
+NON_PAGE_SUFFIXES = ("png", "jpg", "jpeg", "csv")
+
+# How many times an update is retried after losing a write race.
+MAX_WRITE_ATTEMPTS = 5
+
+
+def is_page_name(name):
+    """Returns True if the blob name is a wiki page.
+
+    Args:
+        name (str): The name of a blob in the page bucket.
+    """
+    return (name not in RESERVED_NAMES and
+            not name.endswith(NON_PAGE_SUFFIXES) and
+            not name.startswith(SANITIZED_PREFIX))
+
+
+def entry_for_blob(blob, tags):
+    """Builds the manifest entry for an uploaded page blob.
+
+    Args:
+        blob (google.cloud.storage.Blob): A blob with loaded properties.
+        tags (list): The tags of the page.
+
+    Returns:
+        dict: The JSON-serializable manifest entry.
+    """
+    return {
+        "size": blob.size,
+        "generation": blob.generation,
+        "content_type": blob.content_type,
+        "tags": sorted(set(tags)),
+    }
+
+
+class PageManifest:
+    """Reads and maintains the manifest blob of a page bucket.
+
+    Attributes:
+        bucket (google.cloud.storage.Bucket): The bucket holding the pages.
+        blob (google.cloud.storage.Blob): The manifest blob.
+    """
+
+    def __init__(self, bucket, manifest_name=MANIFEST_NAME):
+        self.bucket = bucket
+        self.blob = bucket.blob(manifest_name)
+        self._entries = {}
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Returns the manifest entries, downloading them only if changed.
+
+        Rebuilds the manifest from a bucket scan if it does not exist yet.
+
+        Returns:
+            dict: Page names mapped to their manifest entries.
+        """
+        with self._lock:
+            self._load()
+            return self._entries
+
+    def page_names(self):
+        """Returns the sorted names of all pages in the manifest."""
+        return sorted(self.load())
+
+    def _load(self):
+        try:
+            if self._generation is None:
+                data = self.blob.download_as_bytes()
+            else:
+                data = self.blob.download_as_bytes(
+                    if_generation_not_match=self._generation)
+        except NotModified:
+            return
+        except NotFound:
+            self._rebuild()
+            return
+        self._entries = json.loads(data)["pages"]
+        self._generation = self.blob.generation
+
+    def _save(self, entries, if_generation_match):
+        data = json.dumps({"pages": entries},
+                          separators=(",", ":"),
+                          sort_keys=True)
+        self.blob.upload_from_string(data,
+                                     content_type="application/json",
+                                     if_generation_match=if_generation_match)
+        self._entries = entries
+        self._generation = self.blob.generation
+
+    def _update(self, mutate):
+        # Optimistic concurrency: apply the change to the latest manifest and
+        # only write it if nobody else wrote in between.
+        for _ in range(MAX_WRITE_ATTEMPTS):
+            self._load()
+            entries = dict(self._entries)
+            mutate(entries)
+            try:
+                self._save(entries, if_generation_match=self._generation or 0)
+                return
+            except PreconditionFailed:
+                self._generation = None
+        raise PreconditionFailed(f"Could not update {self.blob.name} after "
+                                 f"{MAX_WRITE_ATTEMPTS} attempts")
+
+    def record(self, blob, tags=()):
+        """Adds or refreshes the entry of an uploaded page.
+
+        Tags that the page already has in the manifest are kept.
+
+        Args:
+            blob (google.cloud.storage.Blob): The uploaded page blob.
+            tags (iterable): Tags to add to the page.
+        """
+
+        def mutate(entries):
+            old_tags = entries.get(blob.name, {}).get("tags", [])
+            entries[blob.name] = entry_for_blob(blob,
+                                                list(old_tags) + list(tags))
+
+        with self._lock:
+            self._update(mutate)
+
+    def rebuild(self, tags_by_name=None):
+        """Regenerates the manifest from a full scan of the page bucket.
+
+        Use this when the manifest has drifted from the bucket contents.
+
+        Args:
+            tags_by_name (dict): Optional page names mapped to their tags.
+                Pages without an entry keep the tags they had before.
+        """
+        with self._lock:
+            self._rebuild(tags_by_name)
+
+    def _rebuild(self, tags_by_name=None):
+        tags_by_name = tags_by_name or {}
+        entries = {}
+        for blob in self.bucket.list_blobs():
+            if is_page_name(blob.name):
+                old_tags = self._entries.get(blob.name, {}).get("tags", [])
+                tags = tags_by_name.get(blob.name, old_tags)
+                entries[blob.name] = entry_for_blob(blob, tags)
+        self._save(entries, if_generation_match=None)
@@ -0,0 +1,147 @@
+"""Tests for the PageManifest class in the flaskr application."""
+from flaskr.manifest import PageManifest, is_page_name
+from google.api_core.exceptions import NotFound, NotModified, PreconditionFailed
+from google.cloud import storage
+from unittest.mock import MagicMock
+import json
+import pytest
+
+
+def make_blob(name, size=10, generation=1, content_type="text/html"):
+    """Returns a MagicMock storage.Blob with the given properties."""
+    blob = MagicMock(spec=storage.Blob)
+    blob.name = name
+    blob.size = size
+    blob.generation = generation
+    blob.content_type = content_type
+    return blob
+
+
+@pytest.fixture
+def manifest_blob():
+    """A manifest blob holding a single page."""
+    mock = make_blob("manifest.json", generation=5)
+    mock.download_as_bytes.return_value = json.dumps({
+        "pages": {
+            "Palm": {
+                "size": 10,
+                "generation": 1,
+                "content_type": "text/html",
+                "tags": ["Palm"]
+            }
+        }
+    }).encode()
+    return mock
+
+
+@pytest.fixture
+def mock_bucket(manifest_blob):
+    mock = MagicMock(spec=storage.Bucket)
+    mock.blob.return_value = manifest_blob
+    mock.list_blobs.return_value = [
+        make_blob("Coast Redwood"),
+        make_blob("Not_A_Tree.png"),
+        make_blob("tags.csv"),
+        make_blob("manifest.json"),
+    ]
+    return mock
+
+
+@pytest.fixture
+def manifest(mock_bucket):
+    return PageManifest(mock_bucket)
+
+
+def saved_pages(blob):
+    """Returns the pages written by the last upload to the blob."""
+    data = blob.upload_from_string.call_args.args[0]
+    return json.loads(data)["pages"]
+
+
+def test_is_page_name():
+    """Tests that images, data files and the manifest are not pages."""
+    assert is_page_name("Coast Redwood")
+    assert not is_page_name("Not_A_Tree.png")
+    assert not is_page_name("tags.csv")
+    assert not is_page_name("manifest.json")
+
+
+def test_page_names(manifest):
+    """Tests that page names are read from the manifest blob."""
+    assert manifest.page_names() == ["Palm"]
+
+
+def test_load_is_conditional(manifest, manifest_blob):
+    """Tests that a reload only downloads the manifest if it changed."""
+    manifest.load()
+    manifest_blob.download_as_bytes.side_effect = NotModified("unchanged")
+
+    assert manifest.page_names() == ["Palm"]
+    manifest_blob.download_as_bytes.assert_called_with(
+        if_generation_not_match=5)
+
+
+def test_missing_manifest_is_rebuilt(manifest, manifest_blob, mock_bucket):
+    """Tests that a missing manifest is rebuilt from a bucket scan."""
+    manifest_blob.download_as_bytes.side_effect = NotFound("missing")
+
+    assert manifest.page_names() == ["Coast Redwood"]
+    mock_bucket.list_blobs.assert_called_once()
+    assert list(saved_pages(manifest_blob)) == ["Coast Redwood"]
+
+
+def test_rebuild_uses_given_tags(manifest, manifest_blob):
+    """Tests that rebuild() records the tags it is given."""
+    manifest.rebuild({"Coast Redwood": ["Redwood", "Coast Redwood"]})
+
+    assert saved_pages(manifest_blob)["Coast Redwood"] == {
+        "size": 10,
+        "generation": 1,
+        "content_type": "text/html",
+        "tags": ["Coast Redwood", "Redwood"]
+    }
+
+
+def test_record_adds_page(manifest, manifest_blob):
+    """Tests that record() writes the new page with a precondition."""
+    manifest.record(make_blob("Ginko", size=20, generation=7), tags=["Ginko"])
+
+    assert saved_pages(manifest_blob)["Ginko"] == {
+        "size": 20,
+        "generation": 7,
+        "content_type": "text/html",
+        "tags": ["Ginko"]
+    }
+    assert manifest_blob.upload_from_string.call_args.kwargs[
+        "if_generation_match"] == 5
+
+
+def test_record_keeps_existing_tags(manifest, manifest_blob):
+    """Tests that re-uploading a page keeps the tags it already had."""
+    manifest.record(make_blob("Palm", size=20, generation=7), tags=["Tropical"])
+    manifest_blob.download_as_bytes.side_effect = NotModified("unchanged")
+    manifest.record(make_blob("Palm", size=30, generation=8), tags=["Palm"])
+
+    assert saved_pages(manifest_blob)["Palm"]["tags"] == ["Palm", "Tropical"]
+
+
+def test_record_retries_on_conflict(manifest, manifest_blob):
+    """Tests that a lost write race reloads the manifest and tries again."""
+    manifest_blob.upload_from_string.side_effect = [
+        PreconditionFailed("conflict"), None
+    ]
+
+    manifest.record(make_blob("Ginko"))
+
+    assert manifest_blob.upload_from_string.call_count == 2
+    assert manifest_blob.download_as_bytes.call_count == 2
+    assert "Ginko" in saved_pages(manifest_blob)
+
+
+def test_record_gives_up_after_repeated_conflicts(manifest, manifest_blob):
+    """Tests that record() raises if every write attempt conflicts."""
+    manifest_blob.upload_from_string.side_effect = PreconditionFailed(
+        "conflict")
+
+    with pytest.raises(PreconditionFailed):
+        manifest.record(make_blob("Ginko"))
@@ -0,0 +1,364 @@
+"""Storage metrics per route, served in the Prometheus text format.
+
+MetricsDriver wraps the app's storage driver and records every storage call
+under the route of the request that made it: how long the call took, the
+bytes it read or wrote, and whether it failed. Calls that the backend runs
+on its worker pool are recorded under the right route too, since the pool
+runs them in a copy of the request's context. Calls made outside of a
+request, such as tag changes flushed in the background, are recorded under
+BACKGROUND_ROUTE.
+
+A conditional download is how the caches check that what they hold is still
+current. One that finds the object unchanged counts as a cache hit, and one
+that has to download the object counts as a cache miss.
+
+Other parts of the app keep their own counters, such as the number of times
+the tags file was rewritten. add_counter() exports one of them next to the
+storage metrics; its value is read each time the metrics are rendered.
+
+make_endpoints() serves the metrics at "/metrics" and, if the app's
+STORAGE_REQUEST_LOG setting is true, logs one line per request with the
+storage calls it made.
+
+Example:
+    storage_metrics = StorageMetrics()
+    driver = MetricsDriver(MemoryDriver(), storage_metrics)
+    storage_metrics.add_counter("tag_rewrites_total", "Tags file rewrites.",
+                                lambda: tag_handler.rewrites)
+    make_endpoints(app, storage_metrics)
+"""
+from flask import Response, request
+from flaskr.storage_drivers import WrappedDriver
+from google.api_core.exceptions import NotModified
+import bisect
+import contextvars
+import logging
+import threading
+import time
+
+# Upper bounds, in seconds, of the buckets of the storage latency histogram.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+
+# The route of storage calls made outside of a request.
+BACKGROUND_ROUTE = "background"
+
+# The route of requests that matched no URL rule.
+UNMATCHED_ROUTE = "unmatched"
+
+# Prefix of every metric name.
+METRIC_PREFIX = "wiki_"
+
+logger = logging.getLogger(__name__)
+
+_request_stats = contextvars.ContextVar("request_stats", default=None)
+
+
+class RequestStats:
+    """Totals of the storage calls made by one request.
+
+    Attributes:
+        route (str): The URL rule of the request.
+        calls (int): Storage calls made.
+        seconds (float): Time spent in storage calls. Calls made at the same
+            time are added up.
+        bytes_read (int): Bytes downloaded.
+        bytes_written (int): Bytes uploaded.
+        cache_hits (int): Conditional downloads that found the object
+            unchanged.
+        cache_misses (int): Conditional downloads that downloaded the object.
+    """
+
+    def __init__(self, route):
+        self.route = route
+        self.calls = 0
+        self.seconds = 0.0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._lock = threading.Lock()
+
+    def add(self,
+            calls=0,
+            seconds=0.0,
+            bytes_read=0,
+            bytes_written=0,
+            cache=None):
+        with self._lock:
+            self.calls += calls
+            self.seconds += seconds
+            self.bytes_read += bytes_read
+            self.bytes_written += bytes_written
+            if cache == "hit":
+                self.cache_hits += 1
+            elif cache == "miss":
+                self.cache_misses += 1
+
+
+def current_request_stats():
+    """Returns the RequestStats of the current request, or None."""
+    return _request_stats.get()
+
+
+def _current_route():
+    stats = _request_stats.get()
+    return BACKGROUND_ROUTE if stats is None else stats.route
+
+
+def _escape(value):
+    return (str(value).replace("\\",
+                               "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value):
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+class StorageMetrics:
+    """Counters and latency histograms of storage calls, by route.
+
+    Attributes:
+        buckets (tuple): Upper bounds of the latency histogram buckets.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # route -> requests
+        self._requests = {}
+        # (route, operation) -> [calls per bucket (+Inf last), sum of seconds]
+        self._latency = {}
+        # (route, operation, error) -> calls
+        self._errors = {}
+        # (route, direction) -> bytes
+        self._bytes = {}
+        # (route, result) -> conditional downloads
+        self._cache = {}
+        # name -> (help text, function returning the value)
+        self._counters = {}
+
+    def add_counter(self, name, help_text, read):
+        """Exports a counter kept elsewhere in the app.
+
+        Args:
+            name (str): The metric name, without METRIC_PREFIX.
+            help_text (str): What the counter counts.
+            read (callable): Returns the counter's current value.
+        """
+        with self._lock:
+            self._counters[name] = (help_text, read)
+
+    def start_request(self, route):
+        """Counts a request and makes it the current one.
+
+        Args:
+            route (str): The URL rule of the request.
+
+        Returns:
+            RequestStats: The totals of the request's storage calls.
+        """
+        stats = RequestStats(route)
+        _request_stats.set(stats)
+        with self._lock:
+            self._requests[route] = self._requests.get(route, 0) + 1
+        return stats
+
+    def end_request(self):
+        """Stops recording storage calls for the current request."""
+        _request_stats.set(None)
+
+    def record_call(self, operation, seconds, error=None, cache=None):
+        """Records a storage call under the current route.
+
+        Args:
+            operation (str): The driver operation, like "get".
+            seconds (float): How long the call took.
+            error (str): The name of the exception the call raised, if any.
+            cache (str): "hit" or "miss" for conditional downloads.
+        """
+        route = _current_route()
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            latency = self._latency.get((route, operation))
+            if latency is None:
+                latency = self._latency[(route, operation)] = [
+                    [0] * (len(self.buckets) + 1), 0.0
+                ]
+            latency[0][index] += 1
+            latency[1] += seconds
+            if error is not None:
+                key = (route, operation, error)
+                self._errors[key] = self._errors.get(key, 0) + 1
+            if cache is not None:
+                self._cache[(route, cache)] = self._cache.get(
+                    (route, cache), 0) + 1
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.add(calls=1, seconds=seconds, cache=cache)
+
+    def record_bytes(self, read=0, written=0):
+        """Records bytes moved by a storage call under the current route."""
+        route = _current_route()
+        with self._lock:
+            for direction, count in (("read", read), ("written", written)):
+                if count:
+                    self._bytes[(route, direction)] = self._bytes.get(
+                        (route, direction), 0) + count
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.add(bytes_read=read, bytes_written=written)
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        with self._lock:
+            requests = dict(self._requests)
+            latency = {
+                key: (list(counts), total)
+                for key, (counts, total) in self._latency.items()
+            }
+            errors = dict(self._errors)
+            moved = dict(self._bytes)
+            cache = dict(self._cache)
+            counters = dict(self._counters)
+
+        lines = []
+
+        def counter(name, help_text, label_names, values):
+            name = METRIC_PREFIX + name
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for key, value in sorted(values.items()):
+                key = key if isinstance(key, tuple) else (key,)
+                lines.append(f"{name}{_labels(label_names, key)} "
+                             f"{_format_number(value)}")
+
+        counter("requests_total", "Requests served, by route.", ["route"],
+                requests)
+
+        name = METRIC_PREFIX + "storage_call_seconds"
+        lines.append(f"# HELP {name} Latency of storage calls, by route and "
+                     "operation.")
+        lines.append(f"# TYPE {name} histogram")
+        label_names = ["route", "operation"]
+        for key, (counts, total) in sorted(latency.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (None,), counts):
+                cumulative += count
+                le = "+Inf" if bound is None else repr(float(bound))
+                labels = _labels(label_names, key, f'le="{le}"')
+                lines.append(f"{name}_bucket{labels} {cumulative}")
+            lines.append(f"{name}_sum{_labels(label_names, key)} "
+                         f"{_format_number(total)}")
+            lines.append(f"{name}_count{_labels(label_names, key)} "
+                         f"{cumulative}")
+
+        counter(
+            "storage_errors_total",
+            "Storage calls that raised an error, by route, operation "
+            "and error.", ["route", "operation", "error"], errors)
+        counter("storage_bytes_total",
+                "Bytes read from and written to storage, by route.",
+                ["route", "direction"], moved)
+        counter(
+            "storage_cache_total",
+            "Conditional downloads that found the object unchanged (hit) "
+            "or downloaded it (miss), by route.", ["route", "result"], cache)
+        for name, (help_text, read) in sorted(counters.items()):
+            counter(name, help_text, [], {(): read()})
+        return "\n".join(lines) + "\n"
+
+
+class MetricsDriver(WrappedDriver):
+    """Records every operation of another driver in StorageMetrics."""
+
+    def __init__(self, driver, metrics):
+        """Creates a driver.
+
+        Args:
+            driver (StorageDriver): The driver that stores the objects.
+            metrics (StorageMetrics): Where the operations are recorded.
+        """
+        super().__init__(driver)
+        self.metrics = metrics
+
+    def _call(self, operation, *args, **kwargs):
+        conditional = (operation == "get" and
+                       kwargs.get("if_generation_not_match") is not None)
+        start = time.perf_counter()
+        try:
+            result = super()._call(operation, *args, **kwargs)
+        except NotModified:
+            self.metrics.record_call(operation,
+                                     time.perf_counter() - start,
+                                     cache="hit")
+            raise
+        except Exception as error:
+            self.metrics.record_call(operation,
+                                     time.perf_counter() - start,
+                                     error=type(error).__name__)
+            raise
+        self.metrics.record_call(operation,
+                                 time.perf_counter() - start,
+                                 cache="miss" if conditional else None)
+        if operation == "get":
+            self.metrics.record_bytes(read=len(result[0]))
+        elif operation == "put":
+            self.metrics.record_bytes(written=result.size or 0)
+        elif operation == "open_stream":
+            chunks, info = result
+            result = (self._record_chunks(chunks), info)
+        return result
+
+    def _record_chunks(self, chunks):
+        for chunk in chunks:
+            self.metrics.record_bytes(read=len(chunk))
+            yield chunk
+
+
+def make_endpoints(app, metrics):
+    """Records the storage calls of every request and serves "/metrics".
+
+    Args:
+        app (flask.Flask): The app.
+        metrics (StorageMetrics): The metrics of the app's storage driver.
+    """
+
+    @app.before_request
+    def start_storage_metrics():
+        rule = request.url_rule
+        metrics.start_request(UNMATCHED_ROUTE if rule is None else rule.rule)
+
+    @app.after_request
+    def end_storage_metrics(response):
+        stats = current_request_stats()
+        method, path = request.method, request.full_path.rstrip("?")
+
+        # Streamed responses read storage until they are closed.
+        def finish():
+            metrics.end_request()
+            if stats is not None and app.config.get("STORAGE_REQUEST_LOG"):
+                logger.info(
+                    "%s %s %s route=%s storage_calls=%d storage_ms=%.1f "
+                    "bytes_read=%d bytes_written=%d cache_hits=%d "
+                    "cache_misses=%d", method, path, response.status_code,
+                    stats.route, stats.calls, stats.seconds * 1000,
+                    stats.bytes_read, stats.bytes_written, stats.cache_hits,
+                    stats.cache_misses)
+
+        response.call_on_close(finish)
+        return response
+
+    @app.route("/metrics")
+    def storage_metrics():
+        return Response(metrics.render(),
+                        content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,168 @@
+"""Tests for the storage metrics in the flaskr application."""
+from flaskr import create_app
+from flaskr.metrics import (BACKGROUND_ROUTE, MetricsDriver, StorageMetrics,
+                            current_request_stats)
+from flaskr.storage_drivers import MemoryDriver
+from google.api_core.exceptions import NotFound, NotModified
+import logging
+import pytest
+
+
+@pytest.fixture
+def metrics():
+    return StorageMetrics(buckets=(0.5, 1.0))
+
+
+@pytest.fixture
+def driver(metrics):
+    return MetricsDriver(MemoryDriver(), metrics)
+
+
+@pytest.fixture
+def app():
+    app = create_app({
+        'TESTING': True,
+        'SECRET_KEY': 'test',
+        'STORAGE_DRIVER': 'memory'
+    })
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def test_records_calls_by_route(metrics, driver):
+    metrics.start_request("/pages/<filename>")
+    driver.put("pages", "Palm", b"palm")
+    driver.get("pages", "Palm")
+    metrics.end_request()
+    driver.stat("pages", "Palm")
+
+    text = metrics.render()
+
+    assert ('wiki_storage_call_seconds_count{route="/pages/<filename>",'
+            'operation="get"} 1') in text
+    assert ('wiki_storage_call_seconds_count{route="/pages/<filename>",'
+            'operation="put"} 1') in text
+    assert (f'wiki_storage_call_seconds_count{{route="{BACKGROUND_ROUTE}",'
+            'operation="stat"} 1') in text
+    assert ('wiki_storage_bytes_total{route="/pages/<filename>",'
+            'direction="read"} 4') in text
+    assert ('wiki_storage_bytes_total{route="/pages/<filename>",'
+            'direction="written"} 4') in text
+    assert 'wiki_requests_total{route="/pages/<filename>"} 1' in text
+
+
+def test_latency_histogram_is_cumulative(metrics, driver):
+    metrics.record_call("get", 0.1)
+    metrics.record_call("get", 0.7)
+    metrics.record_call("get", 3.0)
+
+    text = metrics.render()
+
+    prefix = 'wiki_storage_call_seconds_bucket{route="background",operation="get"'
+    assert f'{prefix},le="0.5"}} 1' in text
+    assert f'{prefix},le="1.0"}} 2' in text
+    assert f'{prefix},le="+Inf"}} 3' in text
+    assert ('wiki_storage_call_seconds_sum{route="background",'
+            'operation="get"} 3.8') in text
+
+
+def test_records_cache_hits_and_errors(metrics, driver):
+    info = driver.put("pages", "Palm", b"palm")
+    stats = metrics.start_request("/pages/<filename>")
+
+    with pytest.raises(NotModified):
+        driver.get("pages", "Palm", if_generation_not_match=info.generation)
+    driver.get("pages", "Palm", if_generation_not_match=info.generation + 1)
+    with pytest.raises(NotFound):
+        driver.get("pages", "Oak")
+
+    text = metrics.render()
+    assert ('wiki_storage_cache_total{route="/pages/<filename>",'
+            'result="hit"} 1') in text
+    assert ('wiki_storage_cache_total{route="/pages/<filename>",'
+            'result="miss"} 1') in text
+    assert ('wiki_storage_errors_total{route="/pages/<filename>",'
+            'operation="get",error="NotFound"} 1') in text
+    assert (stats.calls, stats.cache_hits, stats.cache_misses,
+            stats.bytes_read) == (3, 1, 1, 4)
+
+
+def test_records_streamed_bytes_as_they_are_read(metrics, driver):
+    driver.put("images", "tree.png", b"0123456789")
+    stats = metrics.start_request("/images/<filename>")
+
+    chunks, _ = driver.open_stream("images", "tree.png", chunk_size=4)
+    assert stats.bytes_read == 0
+    list(chunks)
+
+    assert stats.bytes_read == 10
+
+
+def test_labels_are_escaped(metrics):
+    metrics.start_request('/a"b\\c')
+    metrics.end_request()
+
+    assert 'wiki_requests_total{route="/a\\"b\\\\c"} 1' in metrics.render()
+
+
+def test_metrics_endpoint(client):
+    client.get("/pages/Palm")
+
+    resp = client.get("/metrics")
+
+    assert resp.status_code == 200
+    assert resp.content_type.startswith("text/plain; version=0.0.4")
+    text = resp.get_data(as_text=True)
+    assert 'wiki_requests_total{route="/pages/<filename>"} 1' in text
+    assert ('wiki_storage_call_seconds_count{route="/pages/<filename>",'
+            'operation="get"}') in text
+
+
+def test_request_ends_when_response_closes(client):
+    resp = client.get("/pages/Palm")
+    resp.close()
+
+    assert current_request_stats() is None
+
+
+def test_request_log_line(app, client, caplog):
+    app.config["STORAGE_REQUEST_LOG"] = True
+
+    with caplog.at_level(logging.INFO, logger="flaskr.metrics"):
+        client.get("/pages/Palm").close()
+
+    assert any("GET /pages/Palm 404 route=/pages/<filename> storage_calls=" in
+               record.getMessage() for record in caplog.records)
+
+
+def test_no_request_log_line_by_default(client, caplog):
+    with caplog.at_level(logging.INFO, logger="flaskr.metrics"):
+        client.get("/pages/Palm").close()
+
+    assert not any(record.name == "flaskr.metrics" for record in caplog.records)
+
+
+def test_added_counter(metrics):
+    rewrites = [3]
+    metrics.add_counter("tag_rewrites_total", "Tags file rewrites.",
+                        lambda: rewrites[0])
+    rewrites[0] = 4
+
+    assert "# TYPE wiki_tag_rewrites_total counter" in metrics.render()
+    assert "wiki_tag_rewrites_total 4" in metrics.render()
+
+
+def test_metrics_endpoint_counts_tag_rewrites(app, client):
+    tag_handler = app.extensions['backend'].tag_handler
+    tag_handler.add_file_to_csv("Palm")
+    tag_handler.flush()
+
+    text = client.get("/metrics").get_data(as_text=True)
+
+    assert f"wiki_tag_rewrites_total {tag_handler.rewrites}" in text
+    assert tag_handler.rewrites >= 1
+    assert "wiki_tag_write_conflicts_total 0" in text
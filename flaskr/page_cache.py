@@ -0,0 +1,125 @@
+"""In-process cache of wiki page contents.
+
+Pages are read far more often than they change, so the PageCache keeps the
+most recently read pages in memory together with the generation of the blob
+they came from. A cached page is revalidated with a conditional download
+that only transfers the page if its generation changed, so an unchanged page
+costs one small request instead of a full download.
+
+The cache is bounded by the memory its pages use. When it is full the least
+recently read pages are evicted first.
+
+Example:
+    page_cache = PageCache(page_bucket, max_bytes=32 * 1024 * 1024)
+    content = page_cache.get("Live Oak")
+    page_cache.invalidate("Live Oak")
+    print(page_cache.stats())
+"""
+from collections import OrderedDict, namedtuple
+from google.api_core.exceptions import NotFound, NotModified
+import sys
+import threading
+
+# The memory, in bytes, the cached pages of one process may use.
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+_Entry = namedtuple("_Entry", ["content", "generation", "size"])
+
+
+class PageCache:
+    """A least recently used cache of page contents keyed by page name.
+
+    Attributes:
+        bucket (google.cloud.storage.Bucket): The bucket holding the pages.
+        max_bytes (int): The most memory the cached pages may use.
+        hits (int): Reads answered from the cache after revalidation.
+        misses (int): Reads that downloaded the page.
+        evictions (int): Pages dropped to stay within max_bytes.
+    """
+
+    def __init__(self, bucket, max_bytes=DEFAULT_MAX_BYTES):
+        self.bucket = bucket
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, name):
+        """Returns the content of a page.
+
+        Args:
+            name (str): The page name.
+
+        Returns:
+            str: The page content, or None if there is no such page.
+        """
+        with self._lock:
+            entry = self._entries.get(name)
+        blob = self.bucket.blob(name)
+        try:
+            if entry is None:
+                content = blob.download_as_text()
+            else:
+                content = blob.download_as_text(
+                    if_generation_not_match=entry.generation)
+        except NotModified:
+            with self._lock:
+                self.hits += 1
+                if name in self._entries:
+                    self._entries.move_to_end(name)
+            return entry.content
+        except NotFound:
+            self.invalidate(name)
+            return None
+        with self._lock:
+            self.misses += 1
+        if content is not None:
+            self._store(
+                name, _Entry(content, blob.generation, sys.getsizeof(content)))
+        return content
+
+    def _store(self, name, entry):
+        with self._lock:
+            self._remove(name)
+            if entry.size > self.max_bytes:
+                return
+            self._entries[name] = entry
+            self._bytes += entry.size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self.evictions += 1
+
+    def _remove(self, name):
+        # Must be called with the lock held.
+        entry = self._entries.pop(name, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def invalidate(self, name):
+        """Drops a page from the cache so the next read downloads it.
+
+        Args:
+            name (str): The page name.
+        """
+        with self._lock:
+            self._remove(name)
+
+    def stats(self):
+        """Returns counters describing how well the cache is working.
+
+        Returns:
+            dict: Hits, misses and evictions, and the number of cached pages
+                and the memory they use.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "pages": len(self._entries),
+                "bytes": self._bytes,
+            }
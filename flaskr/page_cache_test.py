@@ -0,0 +1,110 @@
+"""Tests for the PageCache class in the flaskr application."""
+from flaskr.page_cache import PageCache
+from google.api_core.exceptions import NotFound, NotModified
+from google.cloud import storage
+from unittest.mock import MagicMock
+import pytest
+import sys
+
+
+def make_blob(content, generation=1):
+    """Returns a MagicMock page blob holding the given content."""
+    blob = MagicMock(spec=storage.Blob)
+    blob.generation = generation
+    blob.download_as_text.return_value = content
+    return blob
+
+
+@pytest.fixture
+def blobs():
+    return {
+        "Palm": make_blob("<p>Palm</p>"),
+        "Ginko": make_blob("<p>Ginko</p>"),
+        "Juniper": make_blob("<p>Juniper</p>"),
+    }
+
+
+@pytest.fixture
+def mock_bucket(blobs):
+    mock = MagicMock(spec=storage.Bucket)
+    mock.blob.side_effect = lambda name: blobs[name]
+    return mock
+
+
+@pytest.fixture
+def page_cache(mock_bucket):
+    return PageCache(mock_bucket)
+
+
+def test_first_read_downloads_page(page_cache, blobs):
+    """Tests that an uncached page is downloaded unconditionally."""
+    assert page_cache.get("Palm") == "<p>Palm</p>"
+
+    blobs["Palm"].download_as_text.assert_called_once_with()
+    assert page_cache.stats()["misses"] == 1
+
+
+def test_unchanged_page_is_not_downloaded_again(page_cache, blobs):
+    """Tests that a cached page is revalidated by its generation."""
+    page_cache.get("Palm")
+    blobs["Palm"].download_as_text.side_effect = NotModified("unchanged")
+
+    assert page_cache.get("Palm") == "<p>Palm</p>"
+    blobs["Palm"].download_as_text.assert_called_with(if_generation_not_match=1)
+    assert page_cache.stats()["hits"] == 1
+
+
+def test_changed_page_is_downloaded(page_cache, blobs):
+    """Tests that a page whose generation changed is replaced."""
+    page_cache.get("Palm")
+    blobs["Palm"].download_as_text.return_value = "<p>Palm tree</p>"
+    blobs["Palm"].generation = 2
+
+    assert page_cache.get("Palm") == "<p>Palm tree</p>"
+    blobs["Palm"].download_as_text.side_effect = NotModified("unchanged")
+    page_cache.get("Palm")
+    blobs["Palm"].download_as_text.assert_called_with(if_generation_not_match=2)
+
+
+def test_missing_page(page_cache, blobs):
+    """Tests that a deleted page is dropped from the cache."""
+    page_cache.get("Palm")
+    blobs["Palm"].download_as_text.side_effect = NotFound("deleted")
+
+    assert page_cache.get("Palm") is None
+    assert page_cache.stats()["pages"] == 0
+
+
+def test_invalidate_forces_download(page_cache, blobs):
+    """Tests that an invalidated page is downloaded unconditionally."""
+    page_cache.get("Palm")
+    page_cache.invalidate("Palm")
+    page_cache.get("Palm")
+
+    assert blobs["Palm"].download_as_text.call_args.kwargs == {}
+
+
+def test_least_recently_used_page_is_evicted(mock_bucket, blobs):
+    """Tests that the cache stays within its memory ceiling."""
+    page_cache = PageCache(mock_bucket,
+                           max_bytes=2 * sys.getsizeof("<p>Juniper</p>"))
+    page_cache.get("Palm")
+    page_cache.get("Ginko")
+    blobs["Palm"].download_as_text.side_effect = NotModified("unchanged")
+    page_cache.get("Palm")
+    page_cache.get("Juniper")
+
+    stats = page_cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["pages"] == 2
+    assert stats["bytes"] <= page_cache.max_bytes
+    page_cache.get("Ginko")
+    assert blobs["Ginko"].download_as_text.call_args.kwargs == {}
+
+
+def test_page_larger_than_ceiling_is_not_cached(mock_bucket):
+    """Tests that a page that could never fit is served but not cached."""
+    page_cache = PageCache(mock_bucket, max_bytes=10)
+
+    assert page_cache.get("Palm") == "<p>Palm</p>"
+    assert page_cache.stats()["pages"] == 0
@@ -0,0 +1,102 @@
+"""In-process cache of the wiki's page names.
+
+Listing the page bucket is the most expensive part of rendering the sidebar,
+so the PageIndex keeps the last listing in memory for a configurable
+time-to-live. Every rebuild produces a brand new immutable snapshot that is
+swapped in with a single assignment, so concurrent requests always read a
+complete list and never one that is still being built.
+
+Example:
+    page_index = PageIndex(loader=list_page_names, ttl=60)
+    names = page_index.get()
+    names, version = page_index.get_versioned()
+    page_index.invalidate()
+"""
+from collections import namedtuple
+import threading
+import time
+
+# An immutable view of the index. "expires_at" is None once the snapshot
+# has been invalidated.
+_Snapshot = namedtuple("_Snapshot", ["names", "expires_at", "version"])
+
+
+class PageIndex:
+    """Caches page names returned by a loader function for a limited time.
+
+    Attributes:
+        ttl (float): Seconds a snapshot stays fresh before it is rebuilt.
+    """
+
+    def __init__(self, loader, ttl=60, clock=time.monotonic):
+        """Creates an empty index.
+
+        Args:
+            loader (callable): Returns an iterable of page names.
+            ttl (float): Seconds a snapshot stays fresh.
+            clock (callable): Returns the current time in seconds.
+        """
+        self._loader = loader
+        self.ttl = ttl
+        self._clock = clock
+        self._snapshot = _Snapshot((), None, 0)
+        self._invalidations = 0
+        self._rebuild_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+
+    @property
+    def version(self):
+        """int: Increases every time a new snapshot is swapped in."""
+        return self._snapshot.version
+
+    def _is_fresh(self, snapshot):
+        return (snapshot.expires_at is not None and
+                self._clock() < snapshot.expires_at)
+
+    def get(self):
+        """Returns the current page names, rebuilding them if stale.
+
+        Only one thread rebuilds at a time; the others wait for it and then
+        read the new snapshot.
+
+        Returns:
+            tuple: The page names in the order the loader returned them.
+        """
+        return self.get_versioned()[0]
+
+    def get_versioned(self):
+        """Returns the current page names together with their version.
+
+        Like get(), but also returns the version of the snapshot the names
+        were read from, so that things derived from the names can be cached
+        by version.
+
+        Returns:
+            tuple: The page names and the snapshot's version.
+        """
+        snapshot = self._snapshot
+        if self._is_fresh(snapshot):
+            return snapshot.names, snapshot.version
+
+        with self._rebuild_lock:
+            snapshot = self._snapshot
+            if self._is_fresh(snapshot):
+                return snapshot.names, snapshot.version
+
+            invalidations = self._invalidations
+            names = tuple(self._loader())
+            with self._state_lock:
+                expires_at = self._clock() + self.ttl
+                # An upload that finished while we were listing may be
+                # missing from this result, so keep it but leave it stale.
+                if invalidations != self._invalidations:
+                    expires_at = None
+                self._snapshot = _Snapshot(names, expires_at,
+                                           snapshot.version + 1)
+            return names, snapshot.version + 1
+
+    def invalidate(self):
+        """Marks the current snapshot as stale so the next get() rebuilds."""
+        with self._state_lock:
+            self._invalidations += 1
+            self._snapshot = self._snapshot._replace(expires_at=None)
@@ -0,0 +1,99 @@
+"""Tests for the PageIndex class in the flaskr application."""
+from flaskr.page_index import PageIndex
+from unittest.mock import MagicMock
+import pytest
+
+
+class FakeClock:
+    """A clock that only moves when the test advances it."""
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def loader():
+    mock = MagicMock()
+    mock.return_value = ["Coast Redwood", "Ginko"]
+    return mock
+
+
+@pytest.fixture
+def page_index(loader, clock):
+    return PageIndex(loader, ttl=60, clock=clock)
+
+
+def test_get_loads_names(page_index, loader):
+    """Tests that the first get() calls the loader."""
+    assert page_index.get() == ("Coast Redwood", "Ginko")
+    loader.assert_called_once()
+
+
+def test_get_reuses_fresh_snapshot(page_index, loader, clock):
+    """Tests that get() does not reload within the TTL."""
+    page_index.get()
+    clock.now = 59
+    page_index.get()
+
+    loader.assert_called_once()
+
+
+def test_get_reloads_after_ttl(page_index, loader, clock):
+    """Tests that get() reloads once the TTL has passed."""
+    page_index.get()
+    clock.now = 60
+    loader.return_value = ["Coast Redwood", "Ginko", "Palm"]
+
+    assert page_index.get() == ("Coast Redwood", "Ginko", "Palm")
+    assert loader.call_count == 2
+
+
+def test_invalidate_forces_reload(page_index, loader):
+    """Tests that invalidate() makes the next get() reload."""
+    page_index.get()
+    page_index.invalidate()
+    page_index.get()
+
+    assert loader.call_count == 2
+
+
+def test_version_increases_on_rebuild(page_index):
+    """Tests that the version changes only when a new snapshot is built."""
+    assert page_index.version == 0
+    page_index.get()
+    page_index.get()
+    assert page_index.version == 1
+    page_index.invalidate()
+    page_index.get()
+    assert page_index.version == 2
+
+
+def test_invalidate_during_load_keeps_snapshot_stale(page_index, loader):
+    """Tests that a listing started before an upload is not cached as fresh."""
+
+    def load():
+        page_index.invalidate()
+        return ["Coast Redwood"]
+
+    loader.side_effect = load
+    page_index.get()
+    loader.side_effect = None
+    page_index.get()
+
+    assert loader.call_count == 2
+
+
+def test_get_versioned_returns_names_with_their_version(page_index):
+    """Tests that get_versioned() pairs the names with their snapshot."""
+    assert page_index.get_versioned() == (("Coast Redwood", "Ginko"), 1)
+    assert page_index.get_versioned() == (("Coast Redwood", "Ginko"), 1)
+    page_index.invalidate()
+    assert page_index.get_versioned()[1] == 2
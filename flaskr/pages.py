@@ -10,14 +10,239 @@ The module also defines two additional routes for user authentication:
     The signup route ("/signup") displays a form for new users to create an account.
     The login route ("/login") displays a form for existing users to log in to their account.
 
+Tags are added one at a time through "/tags/<filename>/", or to many pages at once through the bulk tags route ("/tags").
+
 All routes use templates rendered with Flask's "render_template" function, and interact with a Google Cloud Storage bucket to retrieve and store data.
 """
-from flask import render_template, session, request, redirect, url_for, make_response, send_file, send_from_directory, Response, g
+from flask import render_template, session, request, redirect, url_for, make_response, send_file, send_from_directory, Response, g, jsonify
+from flask_login import login_required
 from flaskr.tag_handler import TagHandler
 from flaskr.backend import *
+from flaskr.sidebar import PageDrawer
+from flaskr.thumbnails import ALLOWED_WIDTHS, IMAGE_SIZE_PRESETS
+from flaskr.tree_occurrences import MAX_ZOOM
+from concurrent.futures import TimeoutError
 from io import BytesIO
+from werkzeug.datastructures import ContentRange
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import is_resource_modified, unquote_etag
 import bleach
 import html.parser
+import math
+import mimetypes
+
+# Seconds browsers may reuse an image before revalidating it.
+IMAGE_MAX_AGE = 300
+
+# Seconds browsers may reuse the clusters of a map tile, and the clusters of
+# a map tile requested for a specific version of the tree dataset.
+MAP_CLUSTERS_MAX_AGE = 60
+VERSIONED_MAP_CLUSTERS_MAX_AGE = 24 * 60 * 60
+
+# The largest request body, and so the largest upload, accepted by default.
+MAX_UPLOAD_BYTES = 16 * 1024 * 1024
+
+# The most page names one request to the page list API may ask for.
+MAX_PAGE_LIST_LIMIT = 500
+
+# Limits on a single bulk tagging request.
+MAX_BULK_TAG_PAGES = 1000
+MAX_TAG_LENGTH = 100
+
+
+def parse_bulk_tags(data):
+    """Validates the pages and tags of a bulk tagging request.
+
+    Args:
+        data: A list of {"filename": str, "tags": [str, ...]} dictionaries.
+
+    Returns:
+        A dictionary mapping each filename to the set of tags to add.
+
+    Raises:
+        ValueError: If the request is malformed.
+    """
+    if not isinstance(data, list) or not data:
+        raise ValueError("Expected a non-empty list of pages.")
+    if len(data) > MAX_BULK_TAG_PAGES:
+        raise ValueError(
+            f"At most {MAX_BULK_TAG_PAGES} pages can be tagged at once.")
+
+    tags_by_filename = {}
+    for item in data:
+        if not isinstance(item, dict):
+            raise ValueError("Each page must be an object.")
+        filename = item.get("filename")
+        tags = item.get("tags")
+        if not isinstance(filename, str) or not filename.strip():
+            raise ValueError("Each page needs a filename.")
+        if not isinstance(tags, list) or not tags:
+            raise ValueError(f"Page {filename!r} needs a list of tags.")
+        for tag in tags:
+            if not isinstance(tag, str) or not tag.strip():
+                raise ValueError(f"Page {filename!r} has an empty tag.")
+            if len(tag) > MAX_TAG_LENGTH:
+                raise ValueError(f"Page {filename!r} has a tag longer than "
+                                 f"{MAX_TAG_LENGTH} characters.")
+        tags_by_filename.setdefault(filename,
+                                    set()).update(tag.strip() for tag in tags)
+    return tags_by_filename
+
+
+def bulk_tags_from_form(form):
+    """Converts bulk tagging form fields to the JSON request format.
+
+    The form repeats a "filename" field and a matching "tags" field holding
+    comma-separated tags.
+
+    Raises:
+        ValueError: If the filename and tags fields are not paired.
+    """
+    filenames = form.getlist("filename")
+    tags_fields = form.getlist("tags")
+    if len(filenames) != len(tags_fields):
+        raise ValueError("Each filename needs exactly one tags field.")
+    return [{
+        "filename": filename,
+        "tags": [tag for tag in tags.split(",") if tag.strip()]
+    } for filename, tags in zip(filenames, tags_fields)]
+
+
+def map_query_from_args(args):
+    """Returns the bounding box and zoom level of a map clusters request.
+
+    Args:
+        args: The query arguments, with "bbox" as "west,south,east,north" in
+            degrees and "zoom" as a map zoom level.
+
+    Returns:
+        A (bbox, zoom) tuple.
+
+    Raises:
+        ValueError: If either argument is missing or malformed.
+    """
+    try:
+        bbox = tuple(float(edge) for edge in args["bbox"].split(","))
+        zoom = int(args["zoom"])
+    except (KeyError, ValueError):
+        raise ValueError("Expected bbox=west,south,east,north and zoom.")
+    if len(bbox) != 4 or not all(math.isfinite(edge) for edge in bbox):
+        raise ValueError("bbox must have four edges.")
+    west, south, east, north = bbox
+    if south > north:
+        raise ValueError("The south edge of bbox is north of its north edge.")
+    if not 0 <= zoom <= MAX_ZOOM:
+        raise ValueError(f"zoom must be between 0 and {MAX_ZOOM}.")
+    return bbox, zoom
+
+
+def page_list_query_from_args(args):
+    """Returns the prefix, cursor and limit of a page list request.
+
+    Args:
+        args: The query arguments, with optional "prefix", "cursor" and
+            "limit".
+
+    Returns:
+        A (prefix, cursor, limit) tuple. The cursor is None for the first
+        batch.
+
+    Raises:
+        ValueError: If the limit is malformed or out of range.
+    """
+    try:
+        limit = int(args.get("limit", PAGE_LIST_LIMIT))
+    except ValueError:
+        raise ValueError("limit must be a number.")
+    if not 1 <= limit <= MAX_PAGE_LIST_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_LIST_LIMIT}.")
+    return args.get("prefix", ""), args.get("cursor") or None, limit
+
+
+def image_width_from_args(args):
+    """Returns the width an image was requested at.
+
+    Args:
+        args: The query arguments, which may name a size preset with "size"
+            or give one of the allowed widths with "width".
+
+    Returns:
+        The width in pixels, or None for the original image.
+
+    Raises:
+        ValueError: If the size or width is not allowed.
+    """
+    size = args.get("size")
+    width = args.get("width")
+    if size is not None:
+        if size not in IMAGE_SIZE_PRESETS:
+            raise ValueError(f"Unknown image size: {size}")
+        return IMAGE_SIZE_PRESETS[size]
+    if width is not None:
+        if not width.isdigit() or int(width) not in ALLOWED_WIDTHS:
+            allowed = ", ".join(str(w) for w in sorted(ALLOWED_WIDTHS))
+            raise ValueError(f"Image width must be one of {allowed}")
+        return int(width)
+    return None
+
+
+def image_response(backend, blob):
+    """Builds a streamed response for an image blob.
+
+    The response carries the blob's ETag, modification time and content
+    type. Conditional requests for an unchanged image get a 304, and a
+    single byte range is answered with a 206 containing only that range.
+
+    Args:
+        backend: The Backend that streams the image bytes.
+        blob: The image blob with its metadata loaded.
+    """
+    content_type = (blob.content_type or mimetypes.guess_type(blob.name)[0] or
+                    "application/octet-stream")
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Cache-Control": f"public, max-age={IMAGE_MAX_AGE}",
+    }
+    response = Response(headers=headers, content_type=content_type)
+    response.set_etag(blob.etag)
+    response.last_modified = blob.updated
+    if not is_resource_modified(
+            request.environ, etag=blob.etag, last_modified=blob.updated):
+        response.status_code = 304
+        return response
+
+    start, stop = 0, blob.size
+    if request.range is not None and _if_range_matches(blob):
+        byte_range = request.range.range_for_length(blob.size)
+        if byte_range is None and len(request.range.ranges) == 1:
+            response.status_code = 416
+            response.headers["Content-Range"] = f"bytes */{blob.size}"
+            return response
+        if byte_range is not None:
+            start, stop = byte_range
+            response.status_code = 206
+            response.content_range = ContentRange("bytes", start, stop,
+                                                  blob.size)
+
+    response.response = backend.stream_image(blob, start, stop)
+    response.direct_passthrough = True
+    response.content_length = stop - start
+    return response
+
+
+def _if_range_matches(blob):
+    """Returns True if a Range request applies to the current image.
+
+    Without an If-Range header the range always applies. Otherwise it only
+    applies if the image still has the ETag or date the client sent.
+    """
+    if_range = request.if_range
+    if if_range.etag is not None:
+        return unquote_etag(if_range.etag)[0] == blob.etag
+    if if_range.date is not None and blob.updated is not None:
+        # HTTP dates have no fractions of a second.
+        return if_range.date == blob.updated.replace(microsecond=0)
+    return if_range.date is None
 
 
 #Solution code: backend is an endpoint
@@ -28,23 +253,51 @@ def make_endpoints(app, backend):
     def serve_js(filename):
         return send_from_directory("../src", filename)
 
+    # Every template extends main.html, whose drawer shows the first batch
+    # of pages; main.js loads the rest from the page list API as needed.
+    page_drawer = PageDrawer(
+        backend.page_index, lambda names: render_template(
+            "page_drawer.html", **backend.list_pages()))
+    app.extensions['page_drawer'] = page_drawer
+
+    @app.context_processor
+    def inject_page_drawer():
+        return {"page_drawer": page_drawer.get}
+
+    @app.errorhandler(TimeoutError)
+    def storage_timeout(error):
+        # A call run on the backend's worker pool took too long.
+        error_message = "Sorry! The wiki is taking too long to respond :("
+        return Response(error_message, status=504, content_type="text/plain")
+
+    @app.errorhandler(RequestEntityTooLarge)
+    def upload_too_large(error):
+        # Requests declaring a larger body are refused before it is read.
+        limit = app.config["MAX_CONTENT_LENGTH"]
+        error_message = (f"Sorry! Uploads can be at most "
+                         f"{limit / (1024 * 1024):g} MB.")
+        return Response(error_message, status=413, content_type="text/plain")
+
     @app.route("/", methods=['GET', 'POST'])
     def home():
         if request.method == "POST":
-            search_input = request.form["search_input"]
-
-            results = backend.search(search_input)
-            return render_template("search_results.html",
-                                   search_input=search_input,
-                                   results=results)
+            return render_search_results(request.form["search_input"])
         else:
-            pages = backend.get_all_page_names()
-            return render_template("main.html", pages=pages)
+            return render_template("main.html")
+
+    def render_search_results(search_input):
+        # Page names and tags, and page text, are searched at the same time.
+        results, text_results = backend.workers.gather(
+            lambda: backend.search(search_input),
+            lambda: backend.search_text(search_input))
+        return render_template("search_results.html",
+                               search_input=search_input,
+                               results=results,
+                               text_results=text_results)
 
     @app.route("/pages/<filename>")
     def page(filename):
-        page_content = backend.get_wiki_page(filename)
-        pages = backend.get_all_page_names()
+        page_content = backend.get_sanitized_page(filename)
         if not page_content:
             error_message = "Sorry! The page could not be found :("
             response = Response(error_message,
@@ -54,45 +307,83 @@ def make_endpoints(app, backend):
 
         return render_template("page_template.html",
                                filename=filename,
-                               page_content=page_content,
-                               pages=pages)
+                               page_content=page_content)
+
+    @app.route("/pages/<filename>/source")
+    @login_required
+    def page_source(filename):
+        # The page's HTML as uploaded, which the editor fetches when it is
+        # opened. It is served as text so a browser never renders it. Bytes
+        # of a page that is not UTF-8 are replaced, as in its sanitized copy.
+        source = backend.get_page_text(filename)
+        if source is None:
+            error_message = "Sorry! The page could not be found :("
+            return Response(error_message,
+                            status=404,
+                            content_type="text/plain")
+        response = Response(source, content_type="text/plain; charset=utf-8")
+        response.headers["X-Content-Type-Options"] = "nosniff"
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.add_etag()
+        return response.make_conditional(request)
 
     @app.route("/about")
     def about():
-        pages = backend.get_all_page_names()
         authors = [("Pierre Johnson", "bulbasaur.jpeg"),
                    ("Ericka James", "charmander.jpeg"),
                    ("Jalen Richburg", "squirtle.jpeg")]
-        return render_template("about.html", authors=authors, pages=pages)
+        return render_template("about.html", authors=authors)
+
+    @app.route("/api/pages")
+    def page_list():
+        # Returns {"pages": [...], "next": cursor or null, "total": ...,
+        # "version": ...}. Pass "next" back as "cursor" for the next batch.
+        try:
+            prefix, cursor, limit = page_list_query_from_args(request.args)
+        except ValueError as error:
+            return jsonify(error=str(error)), 400
+        response = jsonify(backend.list_pages(prefix, cursor, limit))
+        response.cache_control.no_cache = True
+        response.add_etag()
+        return response.make_conditional(request)
 
     @app.route("/images/<filename>")
     def get_image(filename):
-        image_data = backend.get_image(filename)
-        if not image_data:
+        try:
+            width = image_width_from_args(request.args)
+        except ValueError as error:
+            return Response(str(error), status=400, content_type="text/plain")
+        blob = backend.get_image_blob(filename, width)
+        if blob is None:
             error_message = "Sorry! The page could not be found :("
             response = Response(error_message,
                                 status=404,
                                 content_type="text/plain")
             return response
-
-        response = make_response(image_data)
-        response.headers.set("Content-Type", "image/jpeg")
-        return response
+        return image_response(backend, blob)
 
     @app.route("/upload", methods=["GET", "POST"])
     def upload():
-        pages = backend.get_all_page_names()
         if request.method != 'POST':
-            return render_template("upload.html", pages=pages)
+            return render_template("upload.html")
 
         name = request.form['name']
         content_str = request.form['content']
+        file = None if content_str else request.files.get('file')
+        try:
+            # Checked before anything is written, since a page may not
+            # replace one of the wiki's data blobs.
+            backend.check_upload_name(name, file.filename if file else name)
+        except ValueError as error:
+            return Response(str(error), status=400, content_type="text/plain")
         if not content_str:
-            file = request.files.get('file')
-            backend.upload(file.stream.read(), name, file.filename)
-            TagHandler().add_file_to_csv(name)
+            # Werkzeug spools large files to disk, and the backend streams
+            # them to storage from there.
+            backend.upload(file.stream, name, file.filename)
+            backend.tag_handler.add_file_to_csv(name)
             return "<script>alert('Invalid HTML!');</script>" + render_template(
-                "upload.html", pages=pages)
+                "upload.html")
         else:
             content_bstr = content_str.encode()
             content = bytearray(content_bstr)
@@ -101,35 +392,98 @@ def make_endpoints(app, backend):
         try:
             parser.feed(content.decode())
             backend.upload(content, name, name)
-            TagHandler().add_file_to_csv(name)
+            backend.tag_handler.add_file_to_csv(name)
             return redirect(url_for('page', filename=name))
         except ValueError:
             return "<script>alert('Invalid HTML!');</script>" + render_template(
-                "upload.html", pages=pages)
+                "upload.html")
 
     @app.route("/map")
     def tree_distribution_map():
-        pages = backend.get_all_page_names()
-        map_html = backend.tree_map()
-        return render_template("tree_map.html",
-                               map_html=map_html,
-                               header="Tree Distribution Map",
-                               pages=pages)
+        # The map is drawn in the browser from the species and clusters
+        # feeds, so the page itself only changes with the sidebar.
+        response = make_response(
+            render_template("tree_map.html", header="Tree Distribution Map"))
+        response.cache_control.no_cache = True
+        response.add_etag()
+        return response.make_conditional(request)
+
+    @app.route("/map/species")
+    def tree_species():
+        # Returns {"version": ..., "species": [[name, distribution, color]]}.
+        # Clusters refer to species by their index in this list.
+        occurrences = backend.get_tree_occurrences()
+        response = jsonify(version=occurrences.version,
+                           species=[list(s) for s in occurrences.species])
+        response.cache_control.no_cache = True
+        response.add_etag()
+        return response.make_conditional(request)
+
+    @app.route("/map/clusters")
+    def tree_clusters():
+        # Returns {"version": ..., "clusters": [[lat, lng, count, species]]}
+        # for a bounding box, which the map requests tile by tile as it is
+        # panned and zoomed. "species" is an index into the species feed, or
+        # null for a cluster of several species.
+        try:
+            bbox, zoom = map_query_from_args(request.args)
+        except ValueError as error:
+            return jsonify(error=str(error)), 400
+        occurrences = backend.get_tree_occurrences()
+        version = request.args.get("v")
+        if version is not None and version != occurrences.version:
+            return jsonify(error="The tree dataset has changed.",
+                           version=occurrences.version), 409
+
+        clusters = [[
+            round(cluster.lat, 5),
+            round(cluster.lng, 5), cluster.count, cluster.species
+        ] for cluster in occurrences.clusters(bbox, zoom)]
+        response = jsonify(version=occurrences.version, clusters=clusters)
+        response.cache_control.public = True
+        if version is None:
+            response.cache_control.max_age = MAP_CLUSTERS_MAX_AGE
+        else:
+            # A versioned request always gets the same clusters.
+            response.cache_control.max_age = VERSIONED_MAP_CLUSTERS_MAX_AGE
+            response.cache_control.immutable = True
+        response.add_etag()
+        return response.make_conditional(request)
 
     @app.route('/search-results', methods=["POST"])
     def search():
-        pages = pages = backend.get_all_page_names()
-        search_input = request.form['search_input']
-        results = backend.search(search_input)
-        return render_template("search_results.html",
-                               search_input=search_input,
-                               results=results,
-                               pages=pages)
+        return render_search_results(request.form['search_input'])
 
     @app.route("/tags/<filename>/", methods=["POST"])
     def add_tag(filename):
-        tag_handler = g.get("tag_handler", TagHandler())
+        tag_handler = g.get("tag_handler", backend.tag_handler)
         filename = filename.replace("%20", " ")
         tag = request.form['tag']
         tag_handler.add_tag_to_csv(filename, tag)
         return redirect(url_for("page", filename=filename))
+
+    @app.route("/tags", methods=["POST"])
+    @login_required
+    def add_tags_in_bulk():
+        # Accepts {"pages": [{"filename": ..., "tags": [...]}, ...]} as JSON
+        # or repeated "filename"/"tags" form fields, and applies every tag
+        # with one rewrite of the tags file.
+        try:
+            if request.is_json:
+                body = request.get_json(silent=True)
+                # parse_bulk_tags rejects anything that is not {"pages": [...]}.
+                data = body.get("pages") if isinstance(body, dict) else None
+            else:
+                data = bulk_tags_from_form(request.form)
+            tags_by_filename = parse_bulk_tags(data)
+        except ValueError as error:
+            return jsonify(error=str(error)), 400
+
+        pages = set(backend.get_all_page_names())
+        unknown = sorted(set(tags_by_filename) - pages)
+        if unknown:
+            return jsonify(error="Unknown pages.", pages=unknown), 400
+
+        tag_handler = g.get("tag_handler", backend.tag_handler)
+        tag_handler.add_tags(tags_by_filename)
+        return jsonify(updated=len(tags_by_filename))
@@ -3,8 +3,11 @@ from flask import url_for, g
 from unittest.mock import patch, MagicMock
 from google.cloud.storage.blob import Blob
 from flaskr.backend import Backend
+from flaskr.text_index import SearchHit
+from flaskr.tree_occurrences import Cluster, Species, TreeOccurrences
 from werkzeug.datastructures import FileStorage
 from flaskr.pages import *
+import datetime
 import io
 import pytest
 import os
@@ -13,7 +16,11 @@ import warnings
 
 @pytest.fixture
 def app():
-    app = create_app({'TESTING': True, 'SECRET_KEY': 'test'})
+    app = create_app({
+        'TESTING': True,
+        'SECRET_KEY': 'test',
+        'STORAGE_DRIVER': 'memory'
+    })
     return app
 
 
@@ -44,6 +51,36 @@ def test_home_post(mock_backend, client):
     assert b'Evergreen' not in resp.data
 
 
+@patch("flaskr.backend.Backend.search_text", return_value=[])
+@patch("flaskr.backend.Backend.search", return_value=set())
+@patch("flaskr.worker_pool.WorkerPool.gather")
+def test_search_runs_both_searches_together(mock_gather, mock_search,
+                                            mock_search_text, client):
+    mock_gather.side_effect = lambda *calls: [call() for call in calls]
+
+    resp = client.post("/", data={"search_input": "Palm"})
+
+    assert resp.status_code == 200
+    assert mock_gather.call_count == 1
+    mock_search.assert_called_once_with("Palm")
+    mock_search_text.assert_called_once_with("Palm")
+
+
+@patch("flaskr.backend.Backend.search_text")
+@patch("flaskr.backend.Backend.search")
+def test_search_shows_text_results(mock_search, mock_search_text, client):
+    mock_search.return_value = set()
+    mock_search_text.return_value = [
+        SearchHit("Palm", 1.5, "Palms grow in the tropics")
+    ]
+
+    resp = client.post("/search-results", data={"search_input": "tropics"})
+
+    assert resp.status_code == 200
+    assert b"Found in page text" in resp.data
+    assert b"Palms grow in the tropics" in resp.data
+
+
 def test_home_page(client):
 
     resp = client.get("/")
@@ -58,13 +95,124 @@ def test_about_page(client):
     assert b"About Us!" in resp.data
 
 
-@patch("flaskr.backend.Backend.get_image")
-def test_get_image(mock_get_image, client):
-    mock_get_image.return_value = os.urandom(1024)
+@pytest.fixture
+def image_blob():
+    """A MagicMock image blob of ten bytes."""
+    blob = MagicMock(spec=Blob)
+    blob.name = "mock_image.png"
+    blob.size = 10
+    blob.etag = "abc123"
+    blob.updated = datetime.datetime(2023, 3, 1, tzinfo=datetime.timezone.utc)
+    blob.content_type = "image/png"
+    return blob
+
+
+def stream_range(blob, start=0, stop=None):
+    """Stands in for Backend.stream_image over the bytes 0-9."""
+    yield b"0123456789"[start:stop]
+
+
+@patch("flaskr.backend.Backend.stream_image", side_effect=stream_range)
+@patch("flaskr.backend.Backend.get_image_blob")
+def test_get_image(mock_get_image_blob, mock_stream_image, client, image_blob):
+    mock_get_image_blob.return_value = image_blob
 
     resp = client.get("/images/mock_image")
 
     assert resp.status_code == 200
+    assert resp.data == b"0123456789"
+    assert resp.content_type == "image/png"
+    assert resp.headers["ETag"] == '"abc123"'
+    assert resp.headers["Accept-Ranges"] == "bytes"
+    assert resp.last_modified == image_blob.updated
+
+
+@patch("flaskr.backend.Backend.stream_image", side_effect=stream_range)
+@patch("flaskr.backend.Backend.get_image_blob")
+def test_get_image_not_modified(mock_get_image_blob, mock_stream_image, client,
+                                image_blob):
+    mock_get_image_blob.return_value = image_blob
+
+    resp = client.get("/images/mock_image",
+                      headers={"If-None-Match": '"abc123"'})
+
+    assert resp.status_code == 304
+    assert resp.data == b""
+    mock_stream_image.assert_not_called()
+
+
+@patch("flaskr.backend.Backend.stream_image", side_effect=stream_range)
+@patch("flaskr.backend.Backend.get_image_blob")
+def test_get_image_range(mock_get_image_blob, mock_stream_image, client,
+                         image_blob):
+    mock_get_image_blob.return_value = image_blob
+
+    resp = client.get("/images/mock_image", headers={"Range": "bytes=2-5"})
+
+    assert resp.status_code == 206
+    assert resp.data == b"2345"
+    assert resp.headers["Content-Range"] == "bytes 2-5/10"
+    mock_stream_image.assert_called_once_with(image_blob, 2, 6)
+
+
+@patch("flaskr.backend.Backend.stream_image", side_effect=stream_range)
+@patch("flaskr.backend.Backend.get_image_blob")
+def test_get_image_range_with_stale_if_range(mock_get_image_blob,
+                                             mock_stream_image, client,
+                                             image_blob):
+    mock_get_image_blob.return_value = image_blob
+
+    resp = client.get("/images/mock_image",
+                      headers={
+                          "Range": "bytes=2-5",
+                          "If-Range": '"old"'
+                      })
+
+    assert resp.status_code == 200
+    assert resp.data == b"0123456789"
+
+
+@patch("flaskr.backend.Backend.stream_image", side_effect=stream_range)
+@patch("flaskr.backend.Backend.get_image_blob")
+def test_get_image_unsatisfiable_range(mock_get_image_blob, mock_stream_image,
+                                       client, image_blob):
+    mock_get_image_blob.return_value = image_blob
+
+    resp = client.get("/images/mock_image", headers={"Range": "bytes=20-30"})
+
+    assert resp.status_code == 416
+    assert resp.headers["Content-Range"] == "bytes */10"
+
+
+@patch("flaskr.backend.Backend.stream_image", side_effect=stream_range)
+@patch("flaskr.backend.Backend.get_image_blob")
+def test_get_image_size_preset(mock_get_image_blob, mock_stream_image, client,
+                               image_blob):
+    mock_get_image_blob.return_value = image_blob
+
+    resp = client.get("/images/mock_image?size=avatar")
+
+    assert resp.status_code == 200
+    mock_get_image_blob.assert_called_once_with("mock_image", 320)
+
+
+@patch("flaskr.backend.Backend.stream_image", side_effect=stream_range)
+@patch("flaskr.backend.Backend.get_image_blob")
+def test_get_image_width(mock_get_image_blob, mock_stream_image, client,
+                         image_blob):
+    mock_get_image_blob.return_value = image_blob
+
+    resp = client.get("/images/mock_image?width=160")
+
+    assert resp.status_code == 200
+    mock_get_image_blob.assert_called_once_with("mock_image", 160)
+
+
+@pytest.mark.parametrize("query", ["size=huge", "width=161", "width=abc"])
+def test_get_image_rejects_unknown_sizes(query, client):
+    resp = client.get("/images/mock_image?" + query)
+
+    assert resp.status_code == 400
 
 
 def test_image_nonexistent(client):
@@ -157,8 +305,44 @@ def test_file_upload(mock_upload, mock_get_wiki_page, client):
     assert b"Test HTML" in resp.data
 
 
+@patch("flaskr.backend.Backend.upload")
+def test_file_upload_streams_file(mock_upload, client):
+    uploaded = []
+    mock_upload.side_effect = lambda file, name, filename: uploaded.append(
+        (type(file), file.read(), name, filename))
+
+    resp = client.post("/upload",
+                       data=dict(name="tree",
+                                 content="",
+                                 file=FileStorage(filename="tree.png",
+                                                  stream=io.BytesIO(b"png"))))
+
+    assert resp.status_code == 200
+    file_type, content, name, filename = uploaded[0]
+    assert not issubclass(file_type, (bytes, bytearray))
+    assert (content, name, filename) == (b"png", "tree", "tree.png")
+
+
+@patch("flaskr.backend.Backend.upload")
+def test_upload_too_large(mock_upload, app, client):
+    app.config["MAX_CONTENT_LENGTH"] = 1024 * 1024
+
+    resp = client.post("/upload",
+                       data=dict(name="tree",
+                                 content="",
+                                 file=FileStorage(filename="tree.png",
+                                                  stream=io.BytesIO(
+                                                      b"0" * 1024 * 1024))))
+
+    assert resp.status_code == 413
+    assert b"at most 1 MB" in resp.data
+    mock_upload.assert_not_called()
+
+
+@patch("flaskr.manifest.PageManifest._update")
 @patch("flaskr.backend.Backend.get_wiki_page")
-def test_add_tag(mock_get_wiki_page, app, mock_tag_handler, client):
+def test_add_tag(mock_get_wiki_page, mock_manifest_update, app,
+                 mock_tag_handler, client):
     mock_get_wiki_page.return_value = "Mock Content"
 
     with app.test_request_context():
@@ -168,8 +352,441 @@ def test_add_tag(mock_get_wiki_page, app, mock_tag_handler, client):
         resp = client.post(url, data=dict(tag="mock"), follow_redirects=True)
 
     mock_tag_handler.add_tag_to_csv.assert_called_with("mock", "mock")
+    mock_manifest_update.assert_not_called()
+    assert resp.status_code == 200
+
+
+@pytest.fixture
+def logged_in_client(client):
+    with client.session_transaction() as session:
+        session["_user_id"] = "test_user"
+    return client
+
+
+def test_bulk_tags_requires_login(client):
+    resp = client.post("/tags", json={"pages": []})
+
+    assert resp.status_code == 302
+
+
+@patch("flaskr.backend.Backend.get_all_page_names")
+@patch("flaskr.manifest.PageManifest._update")
+def test_bulk_tags_json(mock_manifest_update, mock_get_all_page_names, app,
+                        mock_tag_handler, logged_in_client):
+    mock_get_all_page_names.return_value = ["Palm", "Palmetto"]
+
+    with app.test_request_context():
+        g.tag_handler = mock_tag_handler
+        resp = logged_in_client.post("/tags",
+                                     json={
+                                         "pages": [{
+                                             "filename": "Palm",
+                                             "tags": ["tropical", "tree"]
+                                         }, {
+                                             "filename": "Palmetto",
+                                             "tags": ["tropical"]
+                                         }]
+                                     })
+
+    assert resp.status_code == 200
+    assert resp.get_json() == {"updated": 2}
+    expected = {"Palm": {"tropical", "tree"}, "Palmetto": {"tropical"}}
+    mock_tag_handler.add_tags.assert_called_once_with(expected)
+    mock_manifest_update.assert_not_called()
+
+
+@patch("flaskr.backend.Backend.get_all_page_names")
+def test_bulk_tags_form(mock_get_all_page_names, app, mock_tag_handler,
+                        logged_in_client):
+    mock_get_all_page_names.return_value = ["Palm", "Palmetto"]
+
+    with app.test_request_context():
+        g.tag_handler = mock_tag_handler
+        resp = logged_in_client.post("/tags",
+                                     data={
+                                         "filename": ["Palm", "Palmetto"],
+                                         "tags": ["tropical, tree", "tropical"]
+                                     })
+
     assert resp.status_code == 200
+    mock_tag_handler.add_tags.assert_called_once_with({
+        "Palm": {"tropical", "tree"},
+        "Palmetto": {"tropical"}
+    })
+
+
+@patch("flaskr.backend.Backend.get_all_page_names")
+def test_bulk_tags_unknown_page(mock_get_all_page_names, app, mock_tag_handler,
+                                logged_in_client):
+    mock_get_all_page_names.return_value = ["Palm"]
+
+    with app.test_request_context():
+        g.tag_handler = mock_tag_handler
+        resp = logged_in_client.post(
+            "/tags",
+            json={"pages": [{
+                "filename": "Sequoia",
+                "tags": ["tall"]
+            }]})
+
+    assert resp.status_code == 400
+    assert resp.get_json()["pages"] == ["Sequoia"]
+    mock_tag_handler.add_tags.assert_not_called()
+
+
+@pytest.mark.parametrize("pages", [
+    None,
+    [],
+    [{
+        "tags": ["tall"]
+    }],
+    [{
+        "filename": "Palm",
+        "tags": []
+    }],
+    [{
+        "filename": "Palm",
+        "tags": [" "]
+    }],
+    [{
+        "filename": "Palm",
+        "tags": "tall"
+    }],
+])
+def test_bulk_tags_invalid_request(pages, logged_in_client):
+    resp = logged_in_client.post("/tags", json={"pages": pages})
+
+    assert resp.status_code == 400
+    assert "error" in resp.get_json()
 
 
 def pytest_configure(config):
     warnings.filterwarnings("ignore", category=PendingDeprecationWarning)
+
+
+@pytest.fixture
+def tree_occurrences():
+    species = [
+        Species("Palm", "Americas", "pink"),
+        Species("Ginko", "Asia", "red")
+    ]
+    occurrences = TreeOccurrences(species, [], version="17")
+    occurrences.clusters = MagicMock(return_value=[
+        Cluster(26.123456, -80.5, 1, 0),
+        Cluster(30.0, -90.0, 12, None)
+    ])
+    return occurrences
+
+
+def test_map_is_a_small_shell(client):
+    resp = client.get("/map")
+
+    assert resp.status_code == 200
+    etag, weak = resp.get_etag()
+    assert etag and not weak
+    assert b'data-species-url="/map/species"' in resp.data
+    assert b'data-clusters-url="/map/clusters"' in resp.data
+
+
+def test_map_not_modified(client):
+    etag = client.get("/map").headers["ETag"]
+
+    resp = client.get("/map", headers={"If-None-Match": etag})
+
+    assert resp.status_code == 304
+    assert resp.data == b""
+
+
+@patch("flaskr.backend.Backend.get_tree_occurrences")
+def test_map_species(mock_get_tree_occurrences, client, tree_occurrences):
+    mock_get_tree_occurrences.return_value = tree_occurrences
+
+    resp = client.get("/map/species")
+
+    assert resp.status_code == 200
+    assert resp.get_json() == {
+        "version": "17",
+        "species": [["Palm", "Americas", "pink"], ["Ginko", "Asia", "red"]]
+    }
+    assert resp.headers["ETag"]
+
+
+@patch("flaskr.backend.Backend.get_tree_occurrences")
+def test_map_clusters(mock_get_tree_occurrences, client, tree_occurrences):
+    mock_get_tree_occurrences.return_value = tree_occurrences
+
+    resp = client.get("/map/clusters?bbox=-135,0,-90,45&zoom=3")
+
+    assert resp.status_code == 200
+    assert resp.get_json() == {
+        "version": "17",
+        "clusters": [[26.12346, -80.5, 1, 0], [30.0, -90.0, 12, None]]
+    }
+    tree_occurrences.clusters.assert_called_once_with(
+        (-135.0, 0.0, -90.0, 45.0), 3)
+    assert resp.cache_control.max_age == MAP_CLUSTERS_MAX_AGE
+
+
+@patch("flaskr.backend.Backend.get_tree_occurrences")
+def test_map_clusters_for_version_are_immutable(mock_get_tree_occurrences,
+                                                client, tree_occurrences):
+    mock_get_tree_occurrences.return_value = tree_occurrences
+
+    resp = client.get("/map/clusters?bbox=-135,0,-90,45&zoom=3&v=17")
+
+    assert resp.status_code == 200
+    assert resp.cache_control.max_age == VERSIONED_MAP_CLUSTERS_MAX_AGE
+    assert resp.cache_control.immutable
+
+
+@patch("flaskr.backend.Backend.get_tree_occurrences")
+def test_map_clusters_for_old_version(mock_get_tree_occurrences, client,
+                                      tree_occurrences):
+    mock_get_tree_occurrences.return_value = tree_occurrences
+
+    resp = client.get("/map/clusters?bbox=-135,0,-90,45&zoom=3&v=16")
+
+    assert resp.status_code == 409
+    assert resp.get_json()["version"] == "17"
+
+
+@pytest.mark.parametrize("query", [
+    "", "bbox=1,2,3&zoom=3", "bbox=1,2,3,4&zoom=x", "bbox=0,10,5,0&zoom=3",
+    "bbox=0,0,5,5&zoom=40", "bbox=nan,0,5,5&zoom=3"
+])
+def test_map_clusters_rejects_bad_queries(query, client):
+    resp = client.get("/map/clusters?" + query)
+
+    assert resp.status_code == 400
+    assert "error" in resp.get_json()
+
+
+@patch("flaskr.backend.Backend.get_all_page_names", return_value=["Palm"])
+@patch("flaskr.backend.Backend.get_wiki_page", return_value="<p>Palm</p>")
+def test_page_fetches_only_content(mock_get_wiki_page, mock_get_all_page_names,
+                                   client):
+    resp = client.get("/pages/Palm")
+
+    assert resp.status_code == 200
+    assert b"<p>Palm</p>" in resp.data
+    mock_get_wiki_page.assert_called_once_with("Palm")
+    mock_get_all_page_names.assert_not_called()
+
+
+@patch("flaskr.worker_pool.WorkerPool.gather", side_effect=TimeoutError)
+def test_search_storage_timeout(mock_gather, client):
+    resp = client.post("/search-results", data={"search_input": "Palm"})
+
+    assert resp.status_code == 504
+
+
+def test_page_serves_sanitized_copy(app, client):
+    app.extensions['backend'].upload(
+        b'<p>Palm</p><img src="x" onerror="steal()">', "Palm", "Palm")
+
+    with patch("flaskr.sanitizer.get_cleaner") as mock_get_cleaner:
+        resp = client.get("/pages/Palm")
+
+    assert resp.status_code == 200
+    assert b'<p>Palm</p><img src="x">' in resp.data
+    assert b"steal()" not in resp.data
+    mock_get_cleaner.assert_not_called()
+
+
+def test_page_drawer_is_rendered_once_per_index_version(app, client):
+    backend = app.extensions['backend']
+    page_drawer = app.extensions['page_drawer']
+    backend.upload(b"<p>Palm</p>", "Palm", "Palm")
+
+    for path in ["/", "/about", "/pages/Palm"]:
+        assert b'<a href="/pages/Palm"> Palm </a>' in client.get(path).data
+    assert page_drawer.renders == 1
+
+    backend.upload(b"<p>Oak</p>", "Oak", "Oak")
+
+    assert b'<a href="/pages/Oak"> Oak </a>' in client.get("/").data
+    assert page_drawer.renders == 2
+
+
+def test_page_list_api(app, client):
+    for name in ["Ginko", "Live Oak", "Palm", "Palmetto"]:
+        app.extensions['backend'].upload(name.encode(), name, name)
+
+    first = client.get("/api/pages?prefix=pa&limit=1")
+    rest = client.get("/api/pages?prefix=pa&cursor=" + first.get_json()["next"])
+
+    assert first.status_code == 200
+    assert first.get_json()["pages"] == ["Palm"]
+    assert first.get_json()["total"] == 2
+    assert rest.get_json()["pages"] == ["Palmetto"]
+    assert rest.get_json()["next"] is None
+    assert first.cache_control.no_cache
+
+
+def test_page_list_api_etag(app, client):
+    app.extensions['backend'].upload(b"Palm", "Palm", "Palm")
+    resp = client.get("/api/pages")
+
+    revalidated = client.get("/api/pages",
+                             headers={"If-None-Match": resp.headers["ETag"]})
+
+    assert revalidated.status_code == 304
+
+
+@pytest.mark.parametrize("query", ["limit=0", "limit=501", "limit=ten"])
+def test_page_list_api_rejects_bad_limits(query, client):
+    resp = client.get("/api/pages?" + query)
+
+    assert resp.status_code == 400
+    assert "error" in resp.get_json()
+
+
+def test_page_drawer_shows_first_batch(app, client):
+    backend = app.extensions['backend']
+    for index in range(PAGE_LIST_LIMIT + 1):
+        name = f"Page {index:03}"
+        backend.upload(name.encode(), name, name)
+
+    html = client.get("/about").get_data(as_text=True)
+
+    assert '<a href="/pages/Page 099"> Page 099 </a>' in html
+    assert "Page 100" not in html
+    assert f'data-total="{PAGE_LIST_LIMIT + 1}"' in html
+    assert 'data-next="Page 099"' in html
+
+
+def test_page_sends_content_once(app, logged_in_client):
+    app.extensions['backend'].upload(b"<p>Palm fronds</p>", "Palm", "Palm")
+
+    html = logged_in_client.get("/pages/Palm").get_data(as_text=True)
+
+    assert html.count("Palm fronds") == 1
+    assert 'data-source-url="/pages/Palm/source"' in html
+    assert '<textarea id="myTextarea"></textarea>' in html
+
+
+def test_page_source(app, logged_in_client):
+    app.extensions['backend'].upload(b'<p onclick="x()">Palm</p>', "Palm",
+                                     "Palm")
+
+    resp = logged_in_client.get("/pages/Palm/source")
+    revalidated = logged_in_client.get(
+        "/pages/Palm/source", headers={"If-None-Match": resp.headers["ETag"]})
+
+    assert resp.status_code == 200
+    assert resp.get_data(as_text=True) == '<p onclick="x()">Palm</p>'
+    assert resp.content_type == "text/plain; charset=utf-8"
+    assert resp.headers["X-Content-Type-Options"] == "nosniff"
+    assert revalidated.status_code == 304
+
+
+def test_page_source_missing(logged_in_client):
+    assert logged_in_client.get("/pages/Oak/source").status_code == 404
+
+
+def test_page_source_of_page_that_is_not_utf8(app, logged_in_client):
+    app.extensions['backend'].upload(b"<p>Caf\xe9</p>", "Cafe", "Cafe")
+
+    resp = logged_in_client.get("/pages/Cafe/source")
+
+    assert resp.status_code == 200
+    assert resp.content_type == "text/plain; charset=utf-8"
+    assert resp.get_data(as_text=True) == "<p>Caf\ufffd</p>"
+
+
+def test_page_source_requires_login(app, client):
+    app.extensions['backend'].upload(b"<p>Palm</p>", "Palm", "Palm")
+
+    assert client.get("/pages/Palm/source").status_code == 302
+
+
+@pytest.mark.parametrize("name", [
+    "manifest.json", "search_index.json.gz", "tags.jsonl",
+    "tree_occurrences.json", "trees.csv", ""
+])
+def test_upload_rejects_reserved_names(name, app, client):
+    backend = app.extensions['backend']
+    backend.upload(b"<p>Palm</p>", "Palm", "Palm")
+
+    resp = client.post("/upload", data=dict(name=name, content="<p>x</p>"))
+
+    assert resp.status_code == 400
+    assert backend.get_all_page_names() == ["Palm"]
+    assert client.get("/pages/Palm").status_code == 200
+
+
+@pytest.mark.parametrize("name", ["manifest.json", "tags.jsonl"])
+def test_data_blobs_are_not_pages(name, app, logged_in_client):
+    backend = app.extensions['backend']
+    backend.upload(b"<p>Palm</p>", "Palm", "Palm")
+    backend.tag_handler.add_file_to_csv("Palm")
+    backend.tag_handler.flush()
+
+    assert logged_in_client.get(f"/pages/{name}").status_code == 404
+    assert logged_in_client.get(f"/pages/{name}/source").status_code == 404
+    assert backend.page_bucket.blob(name).exists()
+    assert not backend.page_bucket.blob("_sanitized/" + name).exists()
+
+
+def test_upload_cannot_replace_sanitized_copy(app, client):
+    app.extensions['backend'].upload(b"<p>Palm</p>", "Palm", "Palm")
+
+    resp = client.post("/upload",
+                       data=dict(name="_sanitized/Palm",
+                                 content="<script>alert(1)</script>"))
+
+    assert resp.status_code == 400
+    page = client.get("/pages/Palm").get_data(as_text=True)
+    assert "<p>Palm</p>" in page
+    assert "<script>alert(1)" not in page
+
+
+def test_upload_file_that_is_not_utf8(app, client):
+    backend = app.extensions['backend']
+
+    resp = client.post("/upload",
+                       data=dict(
+                           name="doc",
+                           content="",
+                           file=FileStorage(
+                               filename="doc.pdf",
+                               stream=io.BytesIO(b"%PDF-1.4 caf\xe9 \xff"))))
+
+    assert resp.status_code == 200
+    assert backend.page_bucket.blob(
+        "doc").download_as_bytes() == b"%PDF-1.4 caf\xe9 \xff"
+    assert backend.get_sanitized_page("doc") == "%PDF-1.4 caf� �"
+    assert "doc" in backend.get_all_page_names()
+    assert [hit.name for hit in backend.search_text("PDF")] == ["doc"]
+
+
+def test_upload_cannot_replace_resized_image(client):
+    resp = client.post("/upload",
+                       data=dict(name="_derived/160w/1/tree.png",
+                                 content="",
+                                 file=FileStorage(filename="tree.png",
+                                                  stream=io.BytesIO(b"png"))))
+
+    assert resp.status_code == 400
+
+
+@pytest.mark.parametrize("body", [[{
+    "filename": "Palm",
+    "tags": ["tall"]
+}], "Palm", 3, None])
+def test_bulk_tags_json_must_be_an_object(body, logged_in_client):
+    resp = logged_in_client.post("/tags", json=body)
+
+    assert resp.status_code == 400
+    assert "error" in resp.get_json()
+
+
+def test_bulk_tags_form_rejects_unpaired_fields(logged_in_client):
+    resp = logged_in_client.post("/tags",
+                                 data={
+                                     "filename": ["Palm", "Palmetto"],
+                                     "tags": ["tall"]
+                                 })
+
+    assert resp.status_code == 400
+    assert "error" in resp.get_json()
@@ -0,0 +1,69 @@
+"""Sanitized copies of wiki pages.
+
+Page HTML is sanitized once, when the page is uploaded, and the sanitized
+copy is stored in the page bucket next to the page under SANITIZED_PREFIX.
+Viewing a page serves the stored copy as it is, without parsing it again.
+When the allowlist below changes, "flask resanitize-pages" sanitizes every
+page again.
+
+Disallowed tags are stripped, keeping their text, and disallowed attributes
+and link protocols are dropped.
+
+A bleach Cleaner sets up its allowlist and an HTML parser when it is
+created, so each thread creates one Cleaner on first use and reuses it. A
+Cleaner cannot be shared between threads, since its parser keeps state.
+
+Example:
+    safe_html = sanitize_html('<p onclick="steal()">Palm</p>')
+    blob = page_bucket.blob(sanitized_name("Palm"))
+"""
+from bleach import Cleaner
+import threading
+
+# Sanitized pages are stored under this prefix in the page bucket. Pages
+# cannot be uploaded under it, since manifest.is_page_name() excludes it.
+SANITIZED_PREFIX = "_sanitized/"
+
+# Tags and attributes that may appear in a page.
+ALLOWED_TAGS = [
+    'a', 'abbr', 'acronym', 'b', 'blockquote', 'br', 'code', 'title', 'div',
+    'em', 'i', 'li', 'ol', 'p', 'strong', 'u', 'ul', 'img', 'h1', 'h2', 'h3',
+    'h4', 'h5', 'h6', 'hr', 'pre', 'span', 'table', 'thead', 'tbody', 'tr',
+    'th', 'td'
+]
+ALLOWED_ATTRIBUTES = {
+    'a': ['href', 'title'],
+    'abbr': ['title'],
+    'acronym': ['title'],
+    'img': ['src', 'alt']
+}
+
+_local = threading.local()
+
+
+def sanitized_name(name):
+    """Returns the blob name of the sanitized copy of a page.
+
+    Args:
+        name (str): The page name.
+    """
+    return SANITIZED_PREFIX + name
+
+
+def get_cleaner():
+    """Returns this thread's Cleaner, creating it on first use."""
+    cleaner = getattr(_local, "cleaner", None)
+    if cleaner is None:
+        cleaner = _local.cleaner = Cleaner(tags=ALLOWED_TAGS,
+                                           attributes=ALLOWED_ATTRIBUTES,
+                                           strip=True)
+    return cleaner
+
+
+def sanitize_html(html):
+    """Returns the HTML with everything outside the allowlist removed.
+
+    Args:
+        html (str): The HTML of a page.
+    """
+    return get_cleaner().clean(html)
@@ -0,0 +1,34 @@
+"""Tests for the page sanitizer in the flaskr application."""
+from flaskr import sanitizer
+from flaskr.sanitizer import get_cleaner, sanitize_html, sanitized_name
+import threading
+
+
+def test_keeps_allowed_html():
+    html = ('<h1>Palm</h1><p><a href="https://example.com" title="x">'
+            'Visit</a></p><table><tbody><tr><td>1</td></tr></tbody></table>')
+
+    assert sanitize_html(html) == html
+
+
+def test_strips_disallowed_html():
+    assert sanitize_html('<p onclick="steal()">Palm</p>') == '<p>Palm</p>'
+    assert sanitize_html('<script>steal()</script>') == 'steal()'
+    assert sanitize_html(
+        '<a href="javascript:steal()">Palm</a>') == '<a>Palm</a>'
+    assert (sanitize_html('</textarea><img src="x" onerror="steal()">') ==
+            '<img src="x">')
+
+
+def test_cleaner_is_reused_per_thread():
+    cleaners = []
+    thread = threading.Thread(target=lambda: cleaners.append(get_cleaner()))
+    thread.start()
+    thread.join()
+
+    assert get_cleaner() is get_cleaner()
+    assert cleaners[0] is not get_cleaner()
+
+
+def test_sanitized_name():
+    assert sanitized_name("Live Oak") == sanitizer.SANITIZED_PREFIX + "Live Oak"
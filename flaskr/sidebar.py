@@ -0,0 +1,58 @@
+"""Cache of the rendered page drawer shown in every page's sidebar.
+
+Every template extends "main.html", whose drawer links to every page of the
+wiki. Rendering the drawer takes time that grows with the number of pages,
+so the PageDrawer renders it once per version of the page index and reuses
+the HTML until the index changes. When the index is rebuilt with the same
+names, as it is after each TTL, the HTML is kept as well.
+
+The drawer reaches templates through a context processor as a function, so
+only templates that show it read the page index.
+
+Example:
+    page_drawer = PageDrawer(backend.page_index, render)
+    app.context_processor(lambda: {"page_drawer": page_drawer.get})
+"""
+from collections import namedtuple
+from markupsafe import Markup
+
+_Fragment = namedtuple("_Fragment", ["version", "names", "html"])
+
+
+class PageDrawer:
+    """Renders the page drawer once per version of the page index.
+
+    Attributes:
+        renders (int): How many times the drawer was rendered.
+    """
+
+    def __init__(self, page_index, render):
+        """Creates a drawer that has not been rendered yet.
+
+        Args:
+            page_index (PageIndex): The index of page names.
+            render (callable): Returns the drawer's HTML for a tuple of page
+                names.
+        """
+        self._page_index = page_index
+        self._render = render
+        self._fragment = _Fragment(None, None, None)
+        self.renders = 0
+
+    def get(self):
+        """Returns the drawer's HTML for the current page names.
+
+        Returns:
+            markupsafe.Markup: The rendered drawer.
+        """
+        names, version = self._page_index.get_versioned()
+        fragment = self._fragment
+        if fragment.version == version:
+            return fragment.html
+        if fragment.names != names:
+            fragment = fragment._replace(names=names,
+                                         html=Markup(self._render(names)))
+            self.renders += 1
+        # Swapped in with one assignment, so readers see a whole fragment.
+        self._fragment = fragment._replace(version=version)
+        return fragment.html
@@ -0,0 +1,55 @@
+"""Tests for the page drawer cache in the flaskr application."""
+from flaskr.page_index import PageIndex
+from flaskr.sidebar import PageDrawer
+from markupsafe import Markup
+from unittest.mock import MagicMock
+import pytest
+
+
+@pytest.fixture
+def loader():
+    return MagicMock(return_value=["Ginko", "Palm"])
+
+
+@pytest.fixture
+def page_index(loader):
+    return PageIndex(loader, ttl=60)
+
+
+@pytest.fixture
+def render():
+    return MagicMock(
+        side_effect=lambda names: "<ul>" + ",".join(names) + "</ul>")
+
+
+def test_renders_once_per_version(page_index, render):
+    drawer = PageDrawer(page_index, render)
+
+    html = drawer.get()
+    drawer.get()
+
+    assert html == Markup("<ul>Ginko,Palm</ul>")
+    render.assert_called_once_with(("Ginko", "Palm"))
+
+
+def test_renders_again_when_pages_change(page_index, loader, render):
+    drawer = PageDrawer(page_index, render)
+    drawer.get()
+
+    loader.return_value = ["Ginko", "Live Oak", "Palm"]
+    page_index.invalidate()
+
+    assert drawer.get() == Markup("<ul>Ginko,Live Oak,Palm</ul>")
+    assert drawer.renders == 2
+
+
+def test_keeps_html_when_rebuilt_index_has_same_pages(page_index, render):
+    drawer = PageDrawer(page_index, render)
+    drawer.get()
+
+    page_index.invalidate()
+    drawer.get()
+    drawer.get()
+
+    assert page_index.version == 2
+    assert drawer.renders == 1
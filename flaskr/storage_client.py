@@ -0,0 +1,56 @@
+"""The Cloud Storage client shared by the whole process.
+
+Creating a storage.Client looks up credentials and sets up an HTTP session,
+which is slow and should only happen once. get_storage_client() creates the
+client the first time it is called, not when the app is imported, and then
+returns the same client to every caller.
+
+The client's session keeps a pool of open connections large enough for the
+backend's worker threads and concurrent requests to reuse connections
+instead of opening new ones.
+
+Example:
+    client = get_storage_client()
+    bucket = client.bucket("wiki_content_p1")
+"""
+from google.auth.transport.requests import AuthorizedSession
+from google.cloud import storage
+import google.auth
+import requests.adapters
+import threading
+
+# Connections kept open to Cloud Storage. Requests beyond this still work,
+# but open a new connection that is closed afterwards.
+HTTP_POOL_SIZE = 32
+
+_client = None
+_lock = threading.Lock()
+
+
+def create_storage_client(pool_size=HTTP_POOL_SIZE):
+    """Creates a storage client whose session pools its connections.
+
+    Args:
+        pool_size (int): The number of connections to keep open.
+
+    Returns:
+        google.cloud.storage.Client: A new client.
+    """
+    credentials, project = google.auth.default(scopes=storage.Client.SCOPE)
+    session = AuthorizedSession(credentials)
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                            pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    return storage.Client(project=project,
+                          credentials=credentials,
+                          _http=session)
+
+
+def get_storage_client():
+    """Returns the process-wide storage client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = create_storage_client()
+    return _client
@@ -0,0 +1,32 @@
+"""Tests for the process-wide storage client in the flaskr application."""
+from flaskr import storage_client
+from unittest.mock import MagicMock, patch
+import pytest
+
+
+@pytest.fixture
+def fresh_client():
+    """Forgets the process-wide client for the duration of a test."""
+    with patch.object(storage_client, "_client", None):
+        yield
+
+
+@patch("flaskr.storage_client.storage.Client")
+@patch("flaskr.storage_client.google.auth.default")
+def test_create_storage_client_pools_connections(mock_default, mock_client):
+    mock_default.return_value = (MagicMock(), "project")
+
+    storage_client.create_storage_client(pool_size=16)
+
+    session = mock_client.call_args.kwargs["_http"]
+    adapter = session.get_adapter("https://storage.googleapis.com")
+    assert adapter._pool_maxsize == 16
+    assert mock_client.call_args.kwargs["project"] == "project"
+
+
+@patch("flaskr.storage_client.create_storage_client")
+def test_get_storage_client_is_created_once(mock_create, fresh_client):
+    first = storage_client.get_storage_client()
+
+    assert storage_client.get_storage_client() is first
+    mock_create.assert_called_once_with()
@@ -0,0 +1,892 @@
+"""Interchangeable places to keep the wiki's buckets.
+
+A storage driver stores objects by bucket and object name and supports six
+operations: get, put, list, stat, delete and open_stream. There are three
+drivers:
+
+    GCSDriver: Google Cloud Storage, used in production.
+    LocalDriver: A directory on the local filesystem, for on-premises
+        instances and benchmarks without network access. Large objects are
+        read through memory maps.
+    MemoryDriver: A dict in the process, for tests and load tests.
+
+Every driver keeps a generation for each object that changes whenever the
+object is written, and supports the same preconditions as Cloud Storage.
+Errors are raised as the google.api_core exceptions Cloud Storage raises
+(NotFound, NotModified and PreconditionFailed), so callers handle every
+driver the same way.
+
+The rest of the app is written against the bucket and blob interface of the
+google-cloud-storage library. DriverClient wraps any driver in the subset of
+that interface the app uses, so a Backend can be given any driver:
+
+Example:
+    client = DriverClient(create_driver("local", root="/var/lib/wiki"))
+    backend = Backend(storage_client=client)
+    blob = client.bucket("wiki_content_p1").get_blob("Live Oak")
+"""
+from collections import namedtuple
+from flaskr.storage_client import get_storage_client
+from google.api_core.exceptions import NotFound, NotModified, PreconditionFailed
+from urllib.parse import quote, unquote
+import datetime
+import io
+import itertools
+import json
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+# Names accepted by create_driver().
+DRIVER_NAMES = ("gcs", "local", "memory")
+
+# Bytes read at a time by open_stream().
+STREAM_CHUNK_SIZE = 256 * 1024
+
+# Objects at least this large are read by LocalDriver through a memory map.
+MMAP_THRESHOLD = 1024 * 1024
+
+# Bytes sent per request when a large file is uploaded to Cloud Storage in
+# parts; a multiple of 256 KiB. Smaller files are sent in a single request.
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# The content type of objects written without one.
+DEFAULT_CONTENT_TYPE = "application/octet-stream"
+
+# The size, generation, content type, ETag and last modification time of an
+# object. "size" is None when a driver cannot tell without another request.
+ObjectInfo = namedtuple(
+    "ObjectInfo",
+    ["name", "size", "generation", "content_type", "etag", "updated"])
+
+
+def check_preconditions(name,
+                        generation,
+                        if_generation_match=None,
+                        if_generation_not_match=None):
+    """Raises the error Cloud Storage raises if a precondition fails.
+
+    Args:
+        name (str): The object name, for the error message.
+        generation (int): The object's generation, or None if it does not
+            exist.
+        if_generation_match (int): The generation the object must have; 0
+            means the object must not exist.
+        if_generation_not_match (int): A generation the object must not have.
+
+    Raises:
+        PreconditionFailed: If if_generation_match does not hold.
+        NotModified: If the object has the if_generation_not_match generation.
+    """
+    if (if_generation_match is not None and
+        (generation or 0) != if_generation_match):
+        raise PreconditionFailed(
+            f"{name} does not have generation {if_generation_match}")
+    if (if_generation_not_match is not None and
+            generation == if_generation_not_match):
+        raise NotModified(f"{name} still has generation {generation}")
+
+
+def _remaining_size(file):
+    # The bytes left to read from a file, or None if it cannot seek.
+    try:
+        position = file.tell()
+        size = file.seek(0, os.SEEK_END) - position
+        file.seek(position)
+    except (AttributeError, OSError, ValueError):
+        return None
+    return size
+
+
+def _clamp(start, stop, size):
+    start = 0 if start is None else min(start, size)
+    stop = size if stop is None else min(max(stop, start), size)
+    return start, stop
+
+
+class StorageDriver:
+    """The operations every storage driver supports.
+
+    Byte ranges are given as a start offset and an exclusive stop offset,
+    like Python slices.
+    """
+
+    def get(self,
+            bucket,
+            name,
+            start=None,
+            stop=None,
+            if_generation_match=None,
+            if_generation_not_match=None):
+        """Reads an object, or a range of its bytes.
+
+        Args:
+            bucket (str): The bucket name.
+            name (str): The object name.
+            start (int): The offset of the first byte to read.
+            stop (int): The offset after the last byte to read.
+            if_generation_match (int): Only read this generation.
+            if_generation_not_match (int): Raise NotModified if the object
+                still has this generation.
+
+        Returns:
+            tuple: The bytes read and the object's ObjectInfo.
+
+        Raises:
+            NotFound: If there is no such object.
+        """
+        raise NotImplementedError
+
+    def put(self,
+            bucket,
+            name,
+            data,
+            content_type=None,
+            if_generation_match=None):
+        """Writes an object, replacing any object of the same name.
+
+        Args:
+            bucket (str): The bucket name.
+            name (str): The object name.
+            data (bytes or file): The content, or a binary file to copy it
+                from.
+            content_type (str): The content type to store.
+            if_generation_match (int): Only replace this generation; 0 only
+                creates the object.
+
+        Returns:
+            ObjectInfo: The new object.
+        """
+        raise NotImplementedError
+
+    def list(self, bucket, prefix=None):
+        """Lists the objects of a bucket in name order.
+
+        Args:
+            bucket (str): The bucket name.
+            prefix (str): Only list objects whose names start with it.
+
+        Returns:
+            iterator: An ObjectInfo for every object.
+        """
+        raise NotImplementedError
+
+    def stat(self, bucket, name):
+        """Returns an object's ObjectInfo, or None if there is no object."""
+        raise NotImplementedError
+
+    def delete(self, bucket, name, if_generation_match=None):
+        """Deletes an object.
+
+        Raises:
+            NotFound: If there is no such object.
+        """
+        raise NotImplementedError
+
+    def open_stream(self,
+                    bucket,
+                    name,
+                    start=0,
+                    stop=None,
+                    chunk_size=STREAM_CHUNK_SIZE,
+                    if_generation_match=None):
+        """Reads an object in chunks, without holding all of it in memory.
+
+        Every chunk comes from the generation the object had when the stream
+        was opened; if the object is replaced meanwhile, reading the next
+        chunk raises PreconditionFailed.
+
+        Args:
+            bucket (str): The bucket name.
+            name (str): The object name.
+            start (int): The offset of the first byte to read.
+            stop (int): The offset after the last byte to read.
+            chunk_size (int): The most bytes in a chunk.
+            if_generation_match (int): Only read this generation.
+
+        Returns:
+            tuple: An iterator over the chunks, and the object's ObjectInfo.
+
+        Raises:
+            NotFound: If there is no such object.
+        """
+        info = self.stat(bucket, name)
+        if info is None:
+            raise NotFound(f"{bucket}/{name}")
+        check_preconditions(name, info.generation, if_generation_match)
+        start, stop = _clamp(start, stop, info.size)
+
+        def chunks(start):
+            while start < stop:
+                end = min(start + chunk_size, stop)
+                data, _ = self.get(bucket,
+                                   name,
+                                   start,
+                                   end,
+                                   if_generation_match=info.generation)
+                yield data
+                start = end
+
+        return chunks(start), info
+
+
+class GCSDriver(StorageDriver):
+    """Keeps objects in Google Cloud Storage buckets."""
+
+    def __init__(self, client=None):
+        """Creates a driver.
+
+        Args:
+            client (google.cloud.storage.Client): Defaults to the process-wide
+                client.
+        """
+        self.client = client or get_storage_client()
+
+    @staticmethod
+    def _info(blob, size=None):
+        return ObjectInfo(blob.name, size if blob.size is None else blob.size,
+                          blob.generation, blob.content_type, blob.etag,
+                          blob.updated)
+
+    def get(self,
+            bucket,
+            name,
+            start=None,
+            stop=None,
+            if_generation_match=None,
+            if_generation_not_match=None):
+        blob = self.client.bucket(bucket).blob(name)
+        ranged = start is not None or stop is not None
+        if stop is not None and stop <= (start or 0):
+            # Cloud Storage has no empty ranges.
+            info = self.stat(bucket, name)
+            if info is None:
+                raise NotFound(f"{bucket}/{name}")
+            check_preconditions(name, info.generation, if_generation_match,
+                                if_generation_not_match)
+            return b"", info
+        # Checksums only cover whole objects. Cloud Storage ranges include
+        # the end byte.
+        data = blob.download_as_bytes(
+            start=start,
+            end=None if stop is None else stop - 1,
+            if_generation_match=if_generation_match,
+            if_generation_not_match=if_generation_not_match,
+            checksum=None if ranged else "md5")
+        return data, self._info(blob, None if ranged else len(data))
+
+    def put(self,
+            bucket,
+            name,
+            data,
+            content_type=None,
+            if_generation_match=None):
+        blob = self.client.bucket(bucket).blob(name)
+        content_type = content_type or DEFAULT_CONTENT_TYPE
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            blob.upload_from_string(bytes(data),
+                                    content_type=content_type,
+                                    if_generation_match=if_generation_match)
+        else:
+            # Files of a known size up to 8 MiB are sent in one request;
+            # larger or unsized files are sent in resumable parts, so only
+            # one part is in memory at a time.
+            blob.chunk_size = UPLOAD_CHUNK_SIZE
+            blob.upload_from_file(data,
+                                  size=_remaining_size(data),
+                                  content_type=content_type,
+                                  if_generation_match=if_generation_match)
+        return self._info(blob)
+
+    def list(self, bucket, prefix=None):
+        return (self._info(blob)
+                for blob in self.client.bucket(bucket).list_blobs(
+                    prefix=prefix))
+
+    def stat(self, bucket, name):
+        blob = self.client.bucket(bucket).get_blob(name)
+        return None if blob is None else self._info(blob)
+
+    def delete(self, bucket, name, if_generation_match=None):
+        self.client.bucket(bucket).blob(name).delete(
+            if_generation_match=if_generation_match)
+
+
+class MemoryDriver(StorageDriver):
+    """Keeps objects in a dict, for tests and load tests.
+
+    The objects live as long as the driver, and are not shared with other
+    processes.
+    """
+
+    def __init__(self):
+        # (bucket, name) -> (data, ObjectInfo)
+        self._objects = {}
+        self._generations = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _get_object(self, bucket, name):
+        entry = self._objects.get((bucket, name))
+        if entry is None:
+            raise NotFound(f"{bucket}/{name}")
+        return entry
+
+    def get(self,
+            bucket,
+            name,
+            start=None,
+            stop=None,
+            if_generation_match=None,
+            if_generation_not_match=None):
+        data, info = self._get_object(bucket, name)
+        check_preconditions(name, info.generation, if_generation_match,
+                            if_generation_not_match)
+        start, stop = _clamp(start, stop, info.size)
+        return data[start:stop], info
+
+    def put(self,
+            bucket,
+            name,
+            data,
+            content_type=None,
+            if_generation_match=None):
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            data = data.read()
+        data = bytes(data)
+        with self._lock:
+            current = self._objects.get((bucket, name))
+            check_preconditions(name, current and current[1].generation,
+                                if_generation_match)
+            generation = next(self._generations)
+            info = ObjectInfo(name, len(data), generation, content_type or
+                              DEFAULT_CONTENT_TYPE, str(generation),
+                              datetime.datetime.now(datetime.timezone.utc))
+            self._objects[(bucket, name)] = (data, info)
+        return info
+
+    def list(self, bucket, prefix=None):
+        with self._lock:
+            infos = [
+                info for (bucket_name, name), (_,
+                                               info) in self._objects.items()
+                if bucket_name == bucket and name.startswith(prefix or "")
+            ]
+        return iter(sorted(infos, key=lambda info: info.name))
+
+    def stat(self, bucket, name):
+        entry = self._objects.get((bucket, name))
+        return None if entry is None else entry[1]
+
+    def delete(self, bucket, name, if_generation_match=None):
+        with self._lock:
+            _, info = self._get_object(bucket, name)
+            check_preconditions(name, info.generation, if_generation_match)
+            del self._objects[(bucket, name)]
+
+
+class LocalDriver(StorageDriver):
+    """Keeps objects as files in a directory on the local filesystem.
+
+    Every bucket is a directory under the root, and every object a file named
+    after the percent-encoded object name. A file starts with a line of JSON
+    holding the object's generation, content type and modification time,
+    followed by the content. Writes go to a temporary file that then replaces
+    the object's file, so readers always see a whole object and a reader
+    that already opened a file keeps reading the generation it opened.
+
+    Preconditions are checked under a lock of the driver, so one directory
+    should only be written by one process.
+
+    Attributes:
+        root (str): The directory holding the buckets.
+        mmap_threshold (int): Objects at least this large are read through a
+            memory map instead of being copied by read calls.
+    """
+
+    def __init__(self, root, mmap_threshold=MMAP_THRESHOLD):
+        self.root = root
+        self.mmap_threshold = mmap_threshold
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _filename(name):
+        # Files starting with a dot are the driver's own, and "." and ".."
+        # must never name an object.
+        filename = quote(name, safe="")
+        if filename.startswith("."):
+            filename = "%2E" + filename[1:]
+        return filename
+
+    def _path(self, bucket, name):
+        return os.path.join(self.root, self._filename(bucket),
+                            self._filename(name))
+
+    @staticmethod
+    def _read_header(file, name):
+        header = json.loads(file.readline())
+        offset = file.tell()
+        size = os.fstat(file.fileno()).st_size - offset
+        generation = header["generation"]
+        return ObjectInfo(
+            name, size, generation, header["content_type"], str(generation),
+            datetime.datetime.fromtimestamp(header["updated"],
+                                            datetime.timezone.utc)), offset
+
+    def _open(self, bucket, name):
+        try:
+            file = open(self._path(bucket, name), "rb")
+        except FileNotFoundError:
+            raise NotFound(f"{bucket}/{name}") from None
+        try:
+            info, offset = self._read_header(file, name)
+        except BaseException:
+            file.close()
+            raise
+        return file, info, offset
+
+    def get(self,
+            bucket,
+            name,
+            start=None,
+            stop=None,
+            if_generation_match=None,
+            if_generation_not_match=None):
+        file, info, offset = self._open(bucket, name)
+        with file:
+            check_preconditions(name, info.generation, if_generation_match,
+                                if_generation_not_match)
+            start, stop = _clamp(start, stop, info.size)
+            if info.size >= self.mmap_threshold:
+                with mmap.mmap(file.fileno(), 0,
+                               access=mmap.ACCESS_READ) as mapped:
+                    return mapped[offset + start:offset + stop], info
+            file.seek(offset + start)
+            return file.read(stop - start), info
+
+    def put(self,
+            bucket,
+            name,
+            data,
+            content_type=None,
+            if_generation_match=None):
+        path = self._path(bucket, name)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            current = self.stat(bucket, name)
+            current_generation = current and current.generation
+            check_preconditions(name, current_generation, if_generation_match)
+            # Generations come from the clock so that they keep increasing
+            # across restarts, and caches never mistake a new object for one
+            # they hold.
+            generation = max(time.time_ns(), (current_generation or 0) + 1)
+            updated = time.time()
+            content_type = content_type or DEFAULT_CONTENT_TYPE
+            header = json.dumps({
+                "generation": generation,
+                "content_type": content_type,
+                "updated": updated
+            }).encode() + b"\n"
+            fd, temporary = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as file:
+                    file.write(header)
+                    if isinstance(data, (bytes, bytearray, memoryview)):
+                        file.write(data)
+                    else:
+                        shutil.copyfileobj(data, file, STREAM_CHUNK_SIZE)
+                    size = file.tell() - len(header)
+                os.replace(temporary, path)
+            except BaseException:
+                os.unlink(temporary)
+                raise
+        return ObjectInfo(
+            name, size, generation, content_type, str(generation),
+            datetime.datetime.fromtimestamp(updated, datetime.timezone.utc))
+
+    def list(self, bucket, prefix=None):
+        directory = os.path.join(self.root, self._filename(bucket))
+        try:
+            filenames = os.listdir(directory)
+        except FileNotFoundError:
+            return iter(())
+        names = sorted(
+            unquote(filename)
+            for filename in filenames
+            if not filename.startswith("."))
+        return (info for info in (self.stat(bucket, name)
+                                  for name in names
+                                  if name.startswith(prefix or ""))
+                if info is not None)
+
+    def stat(self, bucket, name):
+        try:
+            file, info, _ = self._open(bucket, name)
+        except NotFound:
+            return None
+        file.close()
+        return info
+
+    def delete(self, bucket, name, if_generation_match=None):
+        with self._lock:
+            info = self.stat(bucket, name)
+            if info is None:
+                raise NotFound(f"{bucket}/{name}")
+            check_preconditions(name, info.generation, if_generation_match)
+            os.unlink(self._path(bucket, name))
+
+    def open_stream(self,
+                    bucket,
+                    name,
+                    start=0,
+                    stop=None,
+                    chunk_size=STREAM_CHUNK_SIZE,
+                    if_generation_match=None):
+        file, info, offset = self._open(bucket, name)
+        try:
+            check_preconditions(name, info.generation, if_generation_match)
+        except BaseException:
+            file.close()
+            raise
+        start, stop = _clamp(start, stop, info.size)
+
+        def chunks(start):
+            # The open file keeps the generation it was opened with readable
+            # even if the object is replaced.
+            with file:
+                if info.size < self.mmap_threshold:
+                    file.seek(offset + start)
+                    while start < stop:
+                        data = file.read(min(chunk_size, stop - start))
+                        yield data
+                        start += len(data)
+                    return
+                with mmap.mmap(file.fileno(), 0,
+                               access=mmap.ACCESS_READ) as mapped:
+                    while start < stop:
+                        end = min(start + chunk_size, stop)
+                        yield mapped[offset + start:offset + end]
+                        start = end
+
+        return chunks(start), info
+
+
+class WrappedDriver(StorageDriver):
+    """Passes every operation on to another driver through one method.
+
+    Subclasses override _call() to observe or change every operation.
+
+    Attributes:
+        driver (StorageDriver): The driver that stores the objects.
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def _call(self, operation, *args, **kwargs):
+        return getattr(self.driver, operation)(*args, **kwargs)
+
+    def get(self, *args, **kwargs):
+        return self._call("get", *args, **kwargs)
+
+    def put(self, *args, **kwargs):
+        return self._call("put", *args, **kwargs)
+
+    def list(self, *args, **kwargs):
+        return self._call("list", *args, **kwargs)
+
+    def stat(self, *args, **kwargs):
+        return self._call("stat", *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._call("delete", *args, **kwargs)
+
+    def open_stream(self, *args, **kwargs):
+        return self._call("open_stream", *args, **kwargs)
+
+
+class CountingDriver(WrappedDriver):
+    """Counts the operations made on another driver and the bytes they move.
+
+    Every operation counts as one round trip to storage, and the chunks of a
+    stream count as read once they are consumed.
+
+    Example:
+        driver = CountingDriver(MemoryDriver())
+        ...
+        print(driver.stats())
+        driver.reset()
+    """
+
+    def __init__(self, driver):
+        super().__init__(driver)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Sets every counter back to zero."""
+        with self._lock:
+            self.calls = {}
+            self.bytes_read = 0
+            self.bytes_written = 0
+
+    def _count(self, operation=None, read=0, written=0):
+        with self._lock:
+            if operation is not None:
+                self.calls[operation] = self.calls.get(operation, 0) + 1
+            self.bytes_read += read
+            self.bytes_written += written
+
+    def _call(self, operation, *args, **kwargs):
+        self._count(operation)
+        result = super()._call(operation, *args, **kwargs)
+        if operation == "get":
+            self._count(read=len(result[0]))
+        elif operation == "put":
+            self._count(written=result.size or 0)
+        elif operation == "open_stream":
+            chunks, info = result
+            result = (self._count_chunks(chunks), info)
+        return result
+
+    def _count_chunks(self, chunks):
+        for chunk in chunks:
+            self._count(read=len(chunk))
+            yield chunk
+
+    def stats(self):
+        """Returns the counters.
+
+        Returns:
+            dict: The number of round trips, the number of each operation,
+                and the bytes read and written.
+        """
+        with self._lock:
+            return {
+                "round_trips": sum(self.calls.values()),
+                "calls": dict(self.calls),
+                "bytes_read": self.bytes_read,
+                "bytes_written": self.bytes_written,
+            }
+
+
+def create_driver(name, root=None):
+    """Creates a storage driver by name.
+
+    Args:
+        name (str): One of DRIVER_NAMES.
+        root (str): The directory of the "local" driver.
+
+    Raises:
+        ValueError: If there is no such driver, or "local" has no root.
+    """
+    if name == "gcs":
+        return GCSDriver()
+    if name == "memory":
+        return MemoryDriver()
+    if name == "local":
+        if not root:
+            raise ValueError("The local storage driver needs a root directory")
+        return LocalDriver(root)
+    raise ValueError(f"Unknown storage driver {name!r}; expected one of "
+                     f"{', '.join(DRIVER_NAMES)}")
+
+
+class _StreamReader(io.RawIOBase):
+    """A read-only file over the chunks of an open_stream()."""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._buffer = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._buffer:
+            self._buffer = next(self._chunks, None)
+            if self._buffer is None:
+                self._buffer = b""
+                return 0
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            close = getattr(self._chunks, "close", None)
+            if close is not None:
+                close()
+        super().close()
+
+
+class DriverBlob:
+    """An object of a DriverBucket, with the interface of storage.Blob.
+
+    Like a storage.Blob, its metadata is only known after it was read,
+    written or reloaded.
+
+    Attributes:
+        bucket (DriverBucket): The bucket holding the object.
+        name (str): The object name.
+        size (int): The size in bytes.
+        generation (int): The generation.
+        content_type (str): The content type, also used by the next upload.
+        etag (str): The ETag.
+        updated (datetime.datetime): When the object was last written.
+    """
+
+    def __init__(self, bucket, name, info=None):
+        self.bucket = bucket
+        self.name = name
+        self.size = None
+        self.generation = None
+        self.content_type = None
+        self.etag = None
+        self.updated = None
+        self.cache_control = None
+        self.metadata = None
+        if info is not None:
+            self._set_info(info)
+
+    @property
+    def _driver(self):
+        return self.bucket.client.driver
+
+    def _set_info(self, info):
+        if info.size is not None or info.generation != self.generation:
+            self.size = info.size
+        self.generation = info.generation
+        self.content_type = info.content_type
+        self.etag = info.etag
+        self.updated = info.updated
+
+    def download_as_bytes(self,
+                          start=None,
+                          end=None,
+                          if_generation_match=None,
+                          if_generation_not_match=None,
+                          **kwargs):
+        """Downloads the object; like storage.Blob, end is inclusive."""
+        data, info = self._driver.get(
+            self.bucket.name,
+            self.name,
+            start,
+            None if end is None else end + 1,
+            if_generation_match=if_generation_match,
+            if_generation_not_match=if_generation_not_match)
+        self._set_info(info)
+        return data
+
+    def download_as_text(self, encoding="utf-8", **kwargs):
+        return self.download_as_bytes(**kwargs).decode(encoding)
+
+    def upload_from_string(self,
+                           data,
+                           content_type="text/plain",
+                           if_generation_match=None,
+                           **kwargs):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self._set_info(
+            self._driver.put(self.bucket.name,
+                             self.name,
+                             data,
+                             content_type=content_type,
+                             if_generation_match=if_generation_match))
+
+    def upload_from_file(self,
+                         file_obj,
+                         content_type=None,
+                         if_generation_match=None,
+                         **kwargs):
+        self._set_info(
+            self._driver.put(self.bucket.name,
+                             self.name,
+                             file_obj,
+                             content_type=content_type or self.content_type,
+                             if_generation_match=if_generation_match))
+
+    def exists(self, **kwargs):
+        return self._driver.stat(self.bucket.name, self.name) is not None
+
+    def reload(self, **kwargs):
+        info = self._driver.stat(self.bucket.name, self.name)
+        if info is None:
+            raise NotFound(f"{self.bucket.name}/{self.name}")
+        self._set_info(info)
+
+    def delete(self, if_generation_match=None, **kwargs):
+        self._driver.delete(self.bucket.name,
+                            self.name,
+                            if_generation_match=if_generation_match)
+
+    def open(self,
+             mode="r",
+             chunk_size=None,
+             if_generation_match=None,
+             encoding="utf-8",
+             **kwargs):
+        """Opens the object for reading in chunks.
+
+        Args:
+            mode (str): "r" or "rb".
+            chunk_size (int): Bytes read from storage at a time.
+            if_generation_match (int): Only read this generation.
+            encoding (str): The text encoding in "r" mode.
+
+        Returns:
+            A binary or text file.
+        """
+        if mode not in ("r", "rt", "rb"):
+            raise ValueError(f"Unsupported mode {mode!r}")
+        chunks, info = self._driver.open_stream(
+            self.bucket.name,
+            self.name,
+            chunk_size=chunk_size or STREAM_CHUNK_SIZE,
+            if_generation_match=if_generation_match)
+        self._set_info(info)
+        file = io.BufferedReader(_StreamReader(chunks),
+                                 buffer_size=chunk_size or
+                                 io.DEFAULT_BUFFER_SIZE)
+        if mode == "rb":
+            return file
+        return io.TextIOWrapper(file, encoding=encoding)
+
+
+class DriverBucket:
+    """A bucket of a DriverClient, with the interface of storage.Bucket."""
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def blob(self, blob_name, **kwargs):
+        return DriverBlob(self, blob_name)
+
+    def get_blob(self, blob_name, **kwargs):
+        """Returns the blob with its metadata, or None if it does not exist."""
+        info = self.client.driver.stat(self.name, blob_name)
+        return None if info is None else DriverBlob(self, blob_name, info)
+
+    def list_blobs(self, prefix=None, **kwargs):
+        return (DriverBlob(self, info.name, info)
+                for info in self.client.driver.list(self.name, prefix=prefix))
+
+
+class DriverClient:
+    """Gives a storage driver the interface of storage.Client.
+
+    Attributes:
+        driver (StorageDriver): Stores the objects.
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def bucket(self, bucket_name, **kwargs):
+        return DriverBucket(self, bucket_name)
@@ -0,0 +1,302 @@
+"""Tests for the storage drivers in the flaskr application."""
+from flaskr.storage_drivers import (CountingDriver, DriverClient, GCSDriver,
+                                    LocalDriver, MemoryDriver, create_driver)
+from google.api_core.exceptions import NotFound, NotModified, PreconditionFailed
+from google.cloud import storage
+from unittest.mock import MagicMock
+import io
+import os
+import pytest
+
+
+@pytest.fixture(params=["memory", "local", "local_mmap"])
+def driver(request, tmp_path):
+    if request.param == "memory":
+        return MemoryDriver()
+    if request.param == "local":
+        return LocalDriver(str(tmp_path))
+    # Reads every object through a memory map.
+    return LocalDriver(str(tmp_path), mmap_threshold=1)
+
+
+def test_put_and_get(driver):
+    info = driver.put("pages",
+                      "Live Oak",
+                      b"<p>Oak</p>",
+                      content_type="text/html")
+
+    data, read_info = driver.get("pages", "Live Oak")
+
+    assert data == b"<p>Oak</p>"
+    assert read_info == info
+    assert info.name == "Live Oak"
+    assert info.size == 10
+    assert info.content_type == "text/html"
+    assert info.generation
+    assert info.etag
+    assert info.updated is not None
+
+
+def test_put_from_file(driver):
+    driver.put("pages", "Palm", io.BytesIO(b"palm" * 1000))
+
+    assert driver.get("pages", "Palm")[0] == b"palm" * 1000
+    assert driver.stat("pages",
+                       "Palm").content_type == "application/octet-stream"
+
+
+def test_get_range(driver):
+    driver.put("pages", "Palm", b"0123456789")
+
+    assert driver.get("pages", "Palm", start=2, stop=5)[0] == b"234"
+    assert driver.get("pages", "Palm", start=8)[0] == b"89"
+    assert driver.get("pages", "Palm", start=20)[0] == b""
+
+
+def test_get_missing(driver):
+    with pytest.raises(NotFound):
+        driver.get("pages", "Palm")
+    assert driver.stat("pages", "Palm") is None
+
+
+def test_overwrite_changes_generation(driver):
+    first = driver.put("pages", "Palm", b"one")
+    second = driver.put("pages", "Palm", b"two")
+
+    assert second.generation != first.generation
+    assert second.etag != first.etag
+    assert driver.get("pages", "Palm")[0] == b"two"
+
+
+def test_conditional_get(driver):
+    info = driver.put("pages", "Palm", b"one")
+
+    with pytest.raises(NotModified):
+        driver.get("pages", "Palm", if_generation_not_match=info.generation)
+    with pytest.raises(PreconditionFailed):
+        driver.get("pages", "Palm", if_generation_match=info.generation + 1)
+    assert driver.get("pages", "Palm",
+                      if_generation_match=info.generation)[0] == b"one"
+
+
+def test_create_only_put(driver):
+    driver.put("pages", "Palm", b"one", if_generation_match=0)
+
+    with pytest.raises(PreconditionFailed):
+        driver.put("pages", "Palm", b"two", if_generation_match=0)
+    assert driver.get("pages", "Palm")[0] == b"one"
+
+
+def test_conditional_put(driver):
+    info = driver.put("pages", "Palm", b"one")
+
+    with pytest.raises(PreconditionFailed):
+        driver.put("pages",
+                   "Palm",
+                   b"two",
+                   if_generation_match=info.generation + 1)
+    driver.put("pages", "Palm", b"three", if_generation_match=info.generation)
+
+    assert driver.get("pages", "Palm")[0] == b"three"
+
+
+def test_list(driver):
+    driver.put("users", "users/b", b"")
+    driver.put("users", "users/a", b"")
+    driver.put("users", "other", b"")
+    driver.put("pages", "users/c", b"")
+
+    assert [info.name for info in driver.list("users")
+           ] == ["other", "users/a", "users/b"]
+    assert [info.name for info in driver.list("users", prefix="users/")
+           ] == ["users/a", "users/b"]
+    assert list(driver.list("images")) == []
+
+
+def test_delete(driver):
+    info = driver.put("pages", "Palm", b"one")
+
+    with pytest.raises(PreconditionFailed):
+        driver.delete("pages", "Palm", if_generation_match=info.generation + 1)
+    driver.delete("pages", "Palm", if_generation_match=info.generation)
+
+    assert driver.stat("pages", "Palm") is None
+    with pytest.raises(NotFound):
+        driver.delete("pages", "Palm")
+
+
+def test_open_stream(driver):
+    driver.put("images", "tree.png", bytes(range(256)) * 10)
+
+    chunks, info = driver.open_stream("images",
+                                      "tree.png",
+                                      start=100,
+                                      stop=1100,
+                                      chunk_size=300)
+
+    chunks = list(chunks)
+    assert [len(chunk) for chunk in chunks] == [300, 300, 300, 100]
+    assert b"".join(chunks) == (bytes(range(256)) * 10)[100:1100]
+    assert info.size == 2560
+
+
+def test_open_stream_missing(driver):
+    with pytest.raises(NotFound):
+        driver.open_stream("images", "tree.png")
+
+
+def test_local_stream_keeps_opened_generation(tmp_path):
+    driver = LocalDriver(str(tmp_path), mmap_threshold=1)
+    driver.put("images", "tree.png", b"a" * 100)
+    chunks, _ = driver.open_stream("images", "tree.png", chunk_size=10)
+    first = next(chunks)
+
+    driver.put("images", "tree.png", b"b" * 100)
+
+    assert first + b"".join(chunks) == b"a" * 100
+    assert driver.get("images", "tree.png")[0] == b"b" * 100
+
+
+def test_local_names_stay_inside_bucket(tmp_path):
+    driver = LocalDriver(str(tmp_path / "root"))
+    names = ["..", ".", "../escape", "_derived/160w/tree.png", ".hidden"]
+
+    for name in names:
+        driver.put("pages", name, name.encode())
+
+    assert os.listdir(tmp_path) == ["root"]
+    assert [info.name for info in driver.list("pages")] == sorted(names)
+    for name in names:
+        assert driver.get("pages", name)[0] == name.encode()
+
+
+def test_local_objects_survive_restart(tmp_path):
+    info = LocalDriver(str(tmp_path)).put("pages", "Palm", b"one")
+
+    driver = LocalDriver(str(tmp_path))
+
+    assert driver.stat("pages", "Palm") == info
+    assert driver.put("pages", "Palm", b"two").generation > info.generation
+
+
+def test_gcs_driver_get():
+    client = MagicMock(spec=storage.Client)
+    blob = client.bucket.return_value.blob.return_value
+    blob.name = "Palm"
+    blob.size = None
+    blob.generation = 7
+    blob.download_as_bytes.return_value = b"palm"
+
+    data, info = GCSDriver(client).get("pages", "Palm", start=2, stop=4)
+
+    client.bucket.assert_called_with("pages")
+    blob.download_as_bytes.assert_called_once_with(start=2,
+                                                   end=3,
+                                                   if_generation_match=None,
+                                                   if_generation_not_match=None,
+                                                   checksum=None)
+    assert data == b"palm"
+    assert info.generation == 7
+
+
+def test_gcs_driver_put_and_stat():
+    client = MagicMock(spec=storage.Client)
+    bucket = client.bucket.return_value
+    bucket.get_blob.return_value = None
+    driver = GCSDriver(client)
+
+    driver.put("pages", "Palm", b"palm", if_generation_match=0)
+
+    bucket.blob.return_value.upload_from_string.assert_called_once_with(
+        b"palm", content_type="application/octet-stream", if_generation_match=0)
+    assert driver.stat("pages", "Palm") is None
+
+
+def test_gcs_driver_put_streams_file():
+    client = MagicMock(spec=storage.Client)
+    blob = client.bucket.return_value.blob.return_value
+    blob.size = None
+    file = io.BytesIO(b"0123456789")
+    file.seek(2)
+
+    GCSDriver(client).put("images", "tree.png", file, content_type="image/png")
+
+    blob.upload_from_file.assert_called_once_with(file,
+                                                  size=8,
+                                                  content_type="image/png",
+                                                  if_generation_match=None)
+    assert blob.chunk_size % (256 * 1024) == 0
+    assert file.tell() == 2
+
+
+def test_driver_client_blobs():
+    client = DriverClient(MemoryDriver())
+    bucket = client.bucket("pages")
+    blob = bucket.blob("Palm")
+
+    assert not blob.exists()
+    blob.upload_from_string("<p>Palm</p>", content_type="text/html")
+    found = bucket.get_blob("Palm")
+
+    assert blob.exists()
+    assert found.generation == blob.generation
+    assert found.size == 11
+    assert found.content_type == "text/html"
+    assert bucket.blob("Palm").download_as_text() == "<p>Palm</p>"
+    assert bucket.blob("Palm").download_as_bytes(start=3, end=6) == b"Palm"
+    assert [blob.name for blob in bucket.list_blobs()] == ["Palm"]
+    assert bucket.get_blob("Oak") is None
+
+
+def test_driver_client_ranged_download_keeps_size():
+    bucket = DriverClient(MemoryDriver()).bucket("images")
+    bucket.blob("tree.png").upload_from_string(b"0123456789")
+    blob = bucket.get_blob("tree.png")
+
+    blob.download_as_bytes(start=0, end=1, if_generation_match=blob.generation)
+
+    assert blob.size == 10
+
+
+def test_driver_client_open():
+    bucket = DriverClient(MemoryDriver()).bucket("pages")
+    bucket.blob("Palm").upload_from_string("line one\nline two\n")
+
+    with bucket.blob("Palm").open("r", chunk_size=4) as file:
+        assert file.readlines() == ["line one\n", "line two\n"]
+    with bucket.blob("Palm").open("rb") as file:
+        assert file.read() == b"line one\nline two\n"
+    with pytest.raises(NotFound):
+        bucket.blob("Oak").open("rb")
+
+
+def test_create_driver(tmp_path):
+    assert isinstance(create_driver("memory"), MemoryDriver)
+    assert create_driver("local", root=str(tmp_path)).root == str(tmp_path)
+    with pytest.raises(ValueError):
+        create_driver("local")
+    with pytest.raises(ValueError):
+        create_driver("ftp")
+
+
+def test_counting_driver():
+    driver = CountingDriver(MemoryDriver())
+    driver.put("images", "tree.png", b"0123456789")
+    driver.get("images", "tree.png", start=0, stop=4)
+    with pytest.raises(NotFound):
+        driver.get("images", "oak.png")
+    chunks, _ = driver.open_stream("images", "tree.png", chunk_size=3)
+    list(chunks)
+
+    assert driver.stats() == {
+        "round_trips": 4,
+        "calls": {
+            "put": 1,
+            "get": 2,
+            "open_stream": 1
+        },
+        "bytes_read": 14,
+        "bytes_written": 10,
+    }
+    driver.reset()
+    assert driver.stats()["round_trips"] == 0
@@ -1,9 +1,24 @@
-"""TagHandler for managing tags in a CSV file stored in Google Cloud Storage.
+"""TagHandler for managing page tags stored in Google Cloud Storage.
 
 This module provides a TagHandler class to handle adding and retrieving tags
-associated with filenames in a CSV file stored in a Google Cloud Storage bucket.
-It allows users to add new filenames and tags to the CSV file, retrieve a list of
-filenames associated with a given tag, and add new tags to existing filenames.
+associated with filenames. Tags are stored as a JSON lines file in a Google
+Cloud Storage bucket, one line per filename holding its set of tags:
+
+    {"filename": "Live Oak", "tags": ["Live Oak", "evergreen"]}
+
+It allows users to add new filenames and tags, retrieve a list of filenames
+associated with a given tag, and add new tags to existing filenames. Lookups
+are exact and go through an in-memory index from tags to filenames.
+
+Older deployments stored the tags as a CSV file with comma-joined tags. The
+first time a TagHandler finds no JSON lines file it converts that CSV file.
+
+Changes are queued and written together once per flush interval, so a burst
+of tagging costs a single rewrite of the file. Every write is conditional on
+the generation that was read, and is retried on top of the newer file if
+another instance wrote in between. A flush that fails is retried later,
+waiting twice as long after each failure up to MAX_RETRY_DELAY, and lookups
+meanwhile see the queued changes on top of the last file that was read.
 
 Example:
     from google.cloud import storage
@@ -17,48 +32,325 @@ Example:
 
 Attributes:
     storage_client (google.cloud.storage.Client): Google Cloud Storage client object.
-    dict_reader (csv.DictReader): CSV DictReader object for reading CSV data as dictionaries.
-    dict_writer (csv.DictWriter): CSV DictWriter object for writing dictionaries as CSV data.
+    dict_reader (csv.DictReader): CSV DictReader object for reading the legacy CSV data as dictionaries.
 """
-from google.cloud import storage
+from google.api_core.exceptions import NotFound, NotModified, PreconditionFailed
+from flaskr.storage_client import get_storage_client
 import csv
 import io
+import json
+import logging
+import threading
+
+TAGS_FILENAME = "tags.jsonl"
+
+# Seconds that changes are collected before they are written together.
+FLUSH_INTERVAL = 0.5
+
+# How many times a flush is retried after losing a write race.
+MAX_WRITE_ATTEMPTS = 5
+
+# The longest wait, in seconds, before a failed flush is retried.
+MAX_RETRY_DELAY = 60
+
+logger = logging.getLogger(__name__)
+
+
+def _index_tags(tags_by_filename):
+    """Returns the filenames of each tag, in file order."""
+    filenames_by_tag = {}
+    for filename, tags in tags_by_filename.items():
+        for tag in tags:
+            # A dict keeps the filenames unique and in file order.
+            filenames_by_tag.setdefault(tag, {})[filename] = None
+    return filenames_by_tag
 
 
 class TagHandler:
-    """Handles adding and retrieving tags associated with filenames in a CSV file stored in Google Cloud Storage.
+    """Handles adding and retrieving tags associated with filenames in a JSON lines file stored in Google Cloud Storage.
+
+    The parsed tags are kept in memory together with the generation of the
+    blob they were read from. Every lookup revalidates them with a
+    conditional download, so the file is only downloaded and parsed again
+    after it has changed.
 
     Attributes:
-        csv_filename (str): The name of the CSV file stored in the Google Cloud Storage bucket.
-        storage_client (google.cloud.storage.Client): Google Cloud Storage client object.
-        bucket (google.cloud.storage.Bucket): The Google Cloud Storage bucket where the CSV file is stored.
-        blob (google.cloud.storage.Blob): The Google Cloud Storage blob representing the CSV file.
-        dict_reader (csv.DictReader): CSV DictReader object for reading CSV data as dictionaries.
-        dict_writer (csv.DictWriter): CSV DictWriter object for writing dictionaries as CSV data.
+        csv_filename (str): The name of the legacy CSV file stored in the Google Cloud Storage bucket.
+        tags_filename (str): The name of the JSON lines file stored in the Google Cloud Storage bucket.
+        storage_client (google.cloud.storage.Client): Google Cloud Storage client object; defaults to the process-wide client.
+        bucket (google.cloud.storage.Bucket): The Google Cloud Storage bucket where the tags are stored.
+        csv_blob (google.cloud.storage.Blob): The Google Cloud Storage blob representing the legacy CSV file.
+        blob (google.cloud.storage.Blob): The Google Cloud Storage blob representing the JSON lines file.
+        dict_reader (csv.DictReader): CSV DictReader object for reading the legacy CSV data as dictionaries.
+        flush_interval (float): Seconds changes are queued before being written; 0 writes them immediately.
+        rewrites (int): How many times the whole JSON lines file has been written.
+        write_conflicts (int): How many writes failed because another writer got there first.
     """
 
     def __init__(self,
                  csv_filename="tags.csv",
-                 storage_client=storage.Client(),
+                 storage_client=None,
                  dict_reader=csv.DictReader,
-                 dict_writer=csv.DictWriter):
+                 tags_filename=TAGS_FILENAME,
+                 flush_interval=FLUSH_INTERVAL):
         self.csv_filename = csv_filename
-        self.storage_client = storage_client
+        self.tags_filename = tags_filename
+        self.storage_client = storage_client or get_storage_client()
         self.bucket = self.storage_client.bucket("wiki_content_p1")
-        self.blob = self.bucket.blob(self.csv_filename)
+        self.csv_blob = self.bucket.blob(self.csv_filename)
+        self.blob = self.bucket.blob(self.tags_filename)
         self.dict_reader = dict_reader
-        self.dict_writer = dict_writer
+        self._generation = None
+        self._tags_by_filename = {}
+        self._filenames_by_tag = {}
+        self._lock = threading.Lock()
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._flush_timer = None
+        self._failed_flushes = 0
+        self.rewrites = 0
+        self.write_conflicts = 0
 
     def open_file(self):
-        """Opens the CSV file as a StringIO object.
+        """Opens the legacy CSV file as a StringIO object.
 
         Returns:
             io.StringIO: StringIO object containing the CSV data.
         """
-        return io.StringIO(self.blob.download_as_text())
+        return io.StringIO(self.csv_blob.download_as_text())
+
+    def _read_csv(self):
+        """Reads the legacy CSV file.
+
+        Returns:
+            dict: A dictionary mapping each filename to a set of its tags.
+        """
+        try:
+            csvfile = self.open_file()
+        except NotFound:
+            return {}
+        with csvfile:
+            return {
+                row["filename"]:
+                set(row["tags"].split(", ")) if row["tags"] else set()
+                for row in self.dict_reader(csvfile)
+            }
+
+    def _migrate(self):
+        """Creates the JSON lines file from the legacy CSV file.
+
+        Must be called with the lock held.
+        """
+        try:
+            self._write(self._read_csv(), if_generation_match=0)
+        except PreconditionFailed:
+            # Another instance migrated first; use its file.
+            self._generation = None
+            self._revalidate()
+
+    def _revalidate(self):
+        """Reloads the in-memory tags if the JSON lines file changed.
+
+        Must be called with the lock held.
+        """
+        try:
+            if self._generation is None:
+                data = self.blob.download_as_text()
+            else:
+                data = self.blob.download_as_text(
+                    if_generation_not_match=self._generation)
+        except NotModified:
+            return
+        except NotFound:
+            self._migrate()
+            return
+        tags_by_filename = {}
+        for line in data.splitlines():
+            if line:
+                entry = json.loads(line)
+                tags_by_filename[entry["filename"]] = set(entry["tags"])
+        self._set_tags(tags_by_filename)
+        self._generation = self.blob.generation
+
+    def _set_tags(self, tags_by_filename):
+        """Replaces the in-memory tags and rebuilds the tag index.
+
+        Must be called with the lock held.
+        """
+        self._tags_by_filename = tags_by_filename
+        self._filenames_by_tag = _index_tags(tags_by_filename)
+
+    def _read_tags(self):
+        """Returns a copy of the current tags for modification.
+
+        Must be called with the lock held.
+        """
+        self._revalidate()
+        return {
+            filename: set(tags)
+            for filename, tags in self._tags_by_filename.items()
+        }
+
+    def _write(self, tags_by_filename, if_generation_match=None):
+        """Uploads the tags as the new JSON lines file and caches them.
+
+        Must be called with the lock held.
+        """
+        lines = [
+            json.dumps({
+                "filename": filename,
+                "tags": sorted(tags)
+            },
+                       separators=(",", ":"))
+            for filename, tags in tags_by_filename.items()
+        ]
+        self.blob.upload_from_string("\n".join(lines) + "\n",
+                                     content_type="application/x-ndjson",
+                                     if_generation_match=if_generation_match)
+        self.rewrites += 1
+        self._set_tags(tags_by_filename)
+        self._generation = self.blob.generation
+
+    def _enqueue(self, change):
+        """Queues a change and makes sure a flush will write it.
+
+        Args:
+            change (callable): Modifies a dict of filenames to tag sets in
+                place and returns True if it changed anything.
+        """
+        with self._pending_lock:
+            self._pending.append(change)
+            self._start_flush_timer()
+        if not self.flush_interval:
+            self.flush()
+
+    def _start_flush_timer(self, delay=None):
+        # Schedules a background flush, unless one is scheduled already.
+        # Called with _pending_lock held.
+        if self.flush_interval and self._flush_timer is None:
+            self._flush_timer = threading.Timer(delay or self.flush_interval,
+                                                self._flush_in_background)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _retry_delay(self):
+        # Seconds until a failed flush is retried, doubling with each
+        # failure in a row. Called with _pending_lock held.
+        return min(self.flush_interval * 2**self._failed_flushes,
+                   MAX_RETRY_DELAY)
+
+    def _requeue(self, changes):
+        # Puts changes that could not be written back at the front of the
+        # queue, and schedules another flush to retry them.
+        with self._pending_lock:
+            self._pending = changes + self._pending
+            self._failed_flushes += 1
+            self._start_flush_timer(self._retry_delay())
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Could not write queued tag changes")
+
+    def flush(self):
+        """Writes all queued changes with a single rewrite of the file.
+
+        The write is conditional on the generation the changes were applied
+        to. If another writer changed the file first, the changes are applied
+        again to the newer file.
+
+        If the changes cannot be written, because every attempt lost a write
+        race or storage failed, they stay queued and another flush is
+        scheduled to retry them. Each failure in a row doubles the wait
+        before that retry, up to MAX_RETRY_DELAY.
+
+        Raises:
+            PreconditionFailed: If every attempt lost a write race.
+            Exception: Whatever storage raised when the write failed.
+        """
+        with self._pending_lock:
+            changes = self._pending
+            self._pending = []
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+        if not changes:
+            return
+
+        try:
+            with self._lock:
+                for _ in range(MAX_WRITE_ATTEMPTS):
+                    tags_by_filename = self._read_tags()
+                    changed = [change(tags_by_filename) for change in changes]
+                    if not any(changed):
+                        self._flush_succeeded()
+                        return
+                    try:
+                        self._write(tags_by_filename,
+                                    if_generation_match=self._generation or 0)
+                        self._flush_succeeded()
+                        return
+                    except PreconditionFailed:
+                        self.write_conflicts += 1
+                        self._generation = None
+        except Exception:
+            self._requeue(changes)
+            raise
+
+        self._requeue(changes)
+        raise PreconditionFailed(f"Could not update {self.blob.name} after "
+                                 f"{MAX_WRITE_ATTEMPTS} attempts")
+
+    def _flush_succeeded(self):
+        with self._pending_lock:
+            self._failed_flushes = 0
+
+    def _current_tags(self):
+        """Returns the tags with every queued change applied.
+
+        Queued changes are flushed first. If that fails the error is logged,
+        not raised, since a lookup should not fail because of a write; the
+        changes stay queued and are applied to a copy of the tags instead.
+
+        Returns:
+            tuple: The tags of each filename and the filenames of each tag.
+        """
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Could not write queued tag changes")
+        with self._pending_lock:
+            changes = list(self._pending)
+        with self._lock:
+            self._revalidate()
+            if not changes:
+                return self._tags_by_filename, self._filenames_by_tag
+            tags_by_filename = {
+                filename: set(tags)
+                for filename, tags in self._tags_by_filename.items()
+            }
+        for change in changes:
+            change(tags_by_filename)
+        return tags_by_filename, _index_tags(tags_by_filename)
+
+    def stats(self):
+        """Returns counters describing the writes made by this handler.
+
+        Returns:
+            dict: The number of full rewrites, write conflicts and queued changes.
+        """
+        with self._pending_lock:
+            pending = len(self._pending)
+        return {
+            "rewrites": self.rewrites,
+            "write_conflicts": self.write_conflicts,
+            "pending_changes": pending,
+        }
 
     def get_filenames_by_tag(self, tag):
-        """Get a list of filenames associated with a given tag.
+        """Get a list of filenames that have exactly the given tag.
 
         Args:
             tag (str): The tag to search for.
@@ -66,73 +358,78 @@ class TagHandler:
         Returns:
             list: A list of filenames associated with the given tag.
         """
-        with self.open_file() as csvfile:
-            reader = self.dict_reader(csvfile)
-            filenames = []
+        _, filenames_by_tag = self._current_tags()
+        return list(filenames_by_tag.get(tag, ()))
 
-            for row in reader:
-                if tag in row["tags"]:
-                    filenames.append(row["filename"])
+    def get_tags_by_filename(self):
+        """Get the tags of every filename.
 
-        return filenames
+        Returns:
+            dict: A dictionary mapping each filename to a sorted list of its tags.
+        """
+        tags_by_filename, _ = self._current_tags()
+        return {
+            filename: sorted(tags)
+            for filename, tags in tags_by_filename.items()
+        }
 
     def add_tag_to_csv(self, filename, tag):
-        """Add a new tag to the CSV file for a given filename.
+        """Add a new tag to a filename that already has an entry.
+
+        The change is queued and written by the next flush.
 
         Args:
             filename (str): The filename to add the tag to.
             tag (str): The new tag to add.
         """
-        with self.open_file() as csvfile:
-            reader = self.dict_reader(csvfile)
-            rows = list(reader)
-
-            for row in rows:
-                if row["filename"] == filename:
-                    if row["tags"]:
-                        existing_tags = row["tags"].split(", ")
-                        existing_tags.append(tag)
-                        updated_tags = list(set(existing_tags))
-                        row["tags"] = ", ".join(updated_tags)
-                        break
-                    else:
-                        row["tags"] = f"{tag}"
-                        break
-
-        updated_csv = io.StringIO()
-        fieldnames = ["filename", "tags"]
-        writer = self.dict_writer(updated_csv, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(rows)
-
-        updated_csv.seek(0)
-        self.blob.upload_from_file(updated_csv, content_type="text/csv")
+
+        def change(tags_by_filename):
+            tags = tags_by_filename.get(filename)
+            if tags is None or tag in tags:
+                return False
+            tags.add(tag)
+            return True
+
+        self._enqueue(change)
 
     def add_file_to_csv(self, filename):
-        """Add a new filename entry to the CSV file if it does not already exist.
+        """Add a new filename entry, tagged with its own name, if it does not already exist.
+
+        The change is queued and written by the next flush.
 
         Args:
             filename (str): The filename to add.
         """
-        with self.open_file() as csvfile:
-            reader = self.dict_reader(csvfile)
-            rows = list(reader)
 
-        filename_exists = False
+        def change(tags_by_filename):
+            if filename in tags_by_filename:
+                return False
+            tags_by_filename[filename] = {filename}
+            return True
 
-        for row in rows:
-            if row["filename"] == filename:
-                filename_exists = True
-                break
+        self._enqueue(change)
 
-        if not filename_exists:
-            rows.append({"filename": filename, "tags": filename})
+    def add_tags(self, tags_by_filename):
+        """Add many tags to many filenames with a single rewrite of the file.
+
+        Filenames without an entry get one, tagged with their own name and
+        the given tags. The change is written before this method returns.
+
+        Args:
+            tags_by_filename (dict): Filenames mapped to iterables of tags to add.
+        """
 
-            updated_csv = io.StringIO()
-            fieldnames = ["filename", "tags"]
-            writer = self.dict_writer(updated_csv, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(rows)
+        def change(current):
+            changed = False
+            for filename, tags in tags_by_filename.items():
+                existing = current.get(filename)
+                if existing is None:
+                    current[filename] = {filename, *tags}
+                    changed = True
+                elif not existing.issuperset(tags):
+                    existing.update(tags)
+                    changed = True
+            return changed
 
-            updated_csv.seek(0)
-            self.blob.upload_from_file(updated_csv, content_type="text/csv")
+        self._enqueue(change)
+        self.flush()
@@ -4,29 +4,61 @@ Tests for the TagHandler class in the flaskr application.
 This module contains test functions for the TagHandler class, which is
 responsible for managing tags associated with files stored in Google Cloud Storage.
 These tests use MagicMock objects to simulate the behavior of the required
-Google Cloud Storage, csv.DictReader, and csv.DictWriter objects.
+Google Cloud Storage and csv.DictReader objects.
 """
 from flaskr.tag_handler import TagHandler
+from google.api_core.exceptions import NotFound, NotModified, PreconditionFailed
 from google.cloud import storage
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 import pytest
 import csv
+import json
+
+
+def jsonl(entries):
+    """Returns JSON lines text for (filename, tags) pairs."""
+    return "".join(
+        json.dumps({
+            "filename": filename,
+            "tags": tags
+        }) + "\n" for filename, tags in entries)
+
+
+def written_tags(blob):
+    """Returns the tags written by the last upload to the blob."""
+    data = blob.upload_from_string.call_args.args[0]
+    return {
+        entry["filename"]: entry["tags"]
+        for entry in map(json.loads, data.splitlines())
+    }
 
 
 # Fixtures
 @pytest.fixture
 def mock_blob():
-    """Fixture for a MagicMock storage.Blob object."""
+    """Fixture for a MagicMock storage.Blob object holding the JSON lines file."""
+    mock = MagicMock(spec=storage.Blob)
+    mock.name = "tags.jsonl"
+    mock.generation = 1
+    mock.download_as_text.return_value = jsonl([("file1", ["tag1", "tag2"]),
+                                                ("file2", ["tag1", "tag3"])])
+    return mock
+
+
+@pytest.fixture
+def mock_csv_blob():
+    """Fixture for a MagicMock storage.Blob object holding the legacy CSV file."""
     mock = MagicMock(spec=storage.Blob)
     mock.download_as_text.return_value = None
     return mock
 
 
 @pytest.fixture
-def mock_bucket(mock_blob):
+def mock_bucket(mock_blob, mock_csv_blob):
     """Fixture for a MagicMock storage.Bucket object."""
     mock = MagicMock(spec=storage.Bucket)
-    mock.blob.return_value = mock_blob
+    mock.blob.side_effect = lambda name: (mock_csv_blob
+                                          if name == "mock.csv" else mock_blob)
     return mock
 
 
@@ -46,128 +78,315 @@ def mock_dict_reader():
 
 
 @pytest.fixture
-def mock_dict_writer():
-    """Fixture for a MagicMock csv.DictWriter object."""
-    mock = MagicMock(spec=csv.DictWriter)
-    return mock
-
-
-@pytest.fixture
-def mock_tag_handler(mock_client, mock_dict_reader, mock_dict_writer):
+def mock_tag_handler(mock_client, mock_dict_reader):
     """Fixture for a MagicMock TagHandler object."""
     mock = TagHandler("mock.csv",
                       storage_client=mock_client,
                       dict_reader=mock_dict_reader,
-                      dict_writer=mock_dict_writer)
+                      flush_interval=0)
     return mock
 
 
+@pytest.fixture
+def batching_tag_handler(mock_client, mock_dict_reader):
+    """Fixture for a TagHandler that queues changes until flush() is called."""
+    handler = TagHandler("mock.csv",
+                         storage_client=mock_client,
+                         dict_reader=mock_dict_reader,
+                         flush_interval=60)
+    yield handler
+    if handler._flush_timer is not None:
+        handler._flush_timer.cancel()
+
+
 # Test functions
 def test_get_filenames_by_tag_no_match(mock_tag_handler):
     """Test the get_filenames_by_tag function when there's no match."""
-    mock_tag_handler.dict_reader.return_value = [{
-        "filename": "file1",
-        "tags": "tag1, tag2"
-    }, {
-        "filename": "file2",
-        "tags": "tag1, tag3"
-    }]
-
     assert mock_tag_handler.get_filenames_by_tag("mock") == []
 
 
 def test_get_filenames_by_tag_match(mock_tag_handler):
     """Test the get_filenames_by_tag function when there's a match."""
-    mock_tag_handler.dict_reader.return_value = [{
-        "filename": "file1",
-        "tags": "tag1, tag2"
-    }, {
-        "filename": "file2",
-        "tags": "tag1, tag3"
-    }]
-
     assert mock_tag_handler.get_filenames_by_tag("tag1") == ["file1", "file2"]
 
 
-def test_add_tag_to_csv_invalid_filename(mock_tag_handler):
+def test_get_filenames_by_tag_is_exact(mock_tag_handler):
+    """Test that a tag does not match longer tags that contain it."""
+    assert mock_tag_handler.get_filenames_by_tag("tag") == []
+    assert mock_tag_handler.get_filenames_by_tag("tag3") == ["file2"]
+
+
+def test_add_tag_to_csv_invalid_filename(mock_tag_handler, mock_blob):
     """Test the add_tag_to_csv function when the filename is invalid."""
-    mock_tag_handler.dict_reader.return_value = [{
-        "filename": "file1",
-        "tags": "tag1, tag2"
-    }]
-    mock_tag_handler.add_tag_to_csv("file2", "tag1")
+    mock_tag_handler.add_tag_to_csv("file3", "tag1")
 
-    mock_tag_handler.dict_writer.return_value.writeheader.assert_called_once()
-    mock_tag_handler.dict_writer.return_value.writerows.assert_called_once_with(
-        [{
-            "filename": "file1",
-            "tags": "tag1, tag2"
-        }])
+    mock_blob.upload_from_string.assert_not_called()
 
 
-def test_add_tag_to_csv_no_tags(mock_tag_handler):
+def test_add_tag_to_csv_no_tags(mock_tag_handler, mock_blob):
     """Test the add_tag_to_csv function when there are no tags."""
-    mock_tag_handler.dict_reader.return_value = [{
-        "filename": "file1",
-        "tags": ""
-    }]
+    mock_blob.download_as_text.return_value = jsonl([("file1", [])])
     mock_tag_handler.add_tag_to_csv("file1", "tag1")
 
-    mock_tag_handler.dict_writer.return_value.writeheader.assert_called_once()
-    mock_tag_handler.dict_writer.return_value.writerows.assert_called_once_with(
-        [{
-            "filename": "file1",
-            "tags": "tag1"
-        }])
+    assert written_tags(mock_blob) == {"file1": ["tag1"]}
 
 
-def test_add_tag_to_csv(mock_tag_handler):
+def test_add_tag_to_csv(mock_tag_handler, mock_blob):
     """Test the add_tag_to_csv function when adding a new tag."""
-    mock_tag_handler.dict_reader.return_value = [{
-        "filename": "file1",
-        "tags": "tag1"
-    }]
-    mock_tag_handler.add_tag_to_csv("file1", "tag2")
-
-    mock_tag_handler.dict_writer.return_value.writeheader.assert_called_once()
-    try:
-        mock_tag_handler.dict_writer.return_value.writerows.assert_called_once_with(
-            [{
-                "filename": "file1",
-                "tags": "tag1, tag2"
-            }])
-    except AssertionError:
-        mock_tag_handler.dict_writer.return_value.writerows.assert_called_once_with(
-            [{
-                "filename": "file1",
-                "tags": "tag2, tag1"
-            }])
-
-
-def test_add_file_to_csv_existing_file(mock_tag_handler):
+    mock_tag_handler.add_tag_to_csv("file1", "tag4")
+
+    assert written_tags(mock_blob) == {
+        "file1": ["tag1", "tag2", "tag4"],
+        "file2": ["tag1", "tag3"]
+    }
+    mock_blob.download_as_text.side_effect = NotModified("unchanged")
+    assert mock_tag_handler.get_filenames_by_tag("tag4") == ["file1"]
+
+
+def test_add_file_to_csv_existing_file(mock_tag_handler, mock_blob):
     """Test the add_file_to_csv function when the file already exists."""
-    mock_tag_handler.dict_reader.return_value = [{
-        "filename": "file1",
-        "tags": "tag1"
-    }]
     mock_tag_handler.add_file_to_csv("file1")
 
-    mock_tag_handler.dict_writer.return_value.writerow.assert_not_called()
+    mock_blob.upload_from_string.assert_not_called()
 
 
-def test_add_file_to_csv(mock_tag_handler):
+def test_add_file_to_csv(mock_tag_handler, mock_blob):
     """Test the add_file_to_csv function when adding a new file."""
-    mock_tag_handler.dict_reader.return_value = [{
+    mock_tag_handler.add_file_to_csv("file3")
+
+    assert written_tags(mock_blob) == {
+        "file1": ["tag1", "tag2"],
+        "file2": ["tag1", "tag3"],
+        "file3": ["file3"]
+    }
+
+
+def test_get_filenames_by_tag_uses_cache(mock_tag_handler, mock_blob):
+    """Test that an unchanged file is not downloaded and parsed again."""
+    mock_tag_handler.get_filenames_by_tag("tag1")
+    mock_blob.download_as_text.side_effect = NotModified("unchanged")
+
+    assert mock_tag_handler.get_filenames_by_tag("tag1") == ["file1", "file2"]
+    mock_blob.download_as_text.assert_called_with(if_generation_not_match=1)
+
+
+def test_get_filenames_by_tag_reloads_changed_file(mock_tag_handler, mock_blob):
+    """Test that a changed file is parsed again."""
+    mock_tag_handler.get_filenames_by_tag("tag1")
+    mock_blob.download_as_text.return_value = jsonl([("file3", ["tag1"])])
+
+    assert mock_tag_handler.get_filenames_by_tag("tag1") == ["file3"]
+
+
+def test_add_file_to_csv_updates_cache(mock_tag_handler, mock_blob):
+    """Test that a written file is looked up without downloading it again."""
+    mock_tag_handler.add_file_to_csv("file3")
+    mock_blob.download_as_text.side_effect = NotModified("unchanged")
+
+    assert mock_tag_handler.get_filenames_by_tag("file3") == ["file3"]
+
+
+def test_get_tags_by_filename(mock_tag_handler):
+    """Test that every filename is mapped to its list of tags."""
+    assert mock_tag_handler.get_tags_by_filename() == {
+        "file1": ["tag1", "tag2"],
+        "file2": ["tag1", "tag3"]
+    }
+
+
+def test_migrates_legacy_csv(mock_tag_handler, mock_blob, mock_dict_reader):
+    """Test that a missing JSON lines file is created from the CSV file."""
+    mock_blob.download_as_text.side_effect = NotFound("tags.jsonl")
+    mock_dict_reader.return_value = [{
         "filename": "file1",
-        "tags": "tag1"
+        "tags": "tag1, tag2"
+    }, {
+        "filename": "file2",
+        "tags": ""
     }]
-    mock_tag_handler.add_file_to_csv("file2")
-
-    mock_tag_handler.dict_writer.return_value.writerows.assert_called_once_with(
-        [{
-            "filename": "file1",
-            "tags": "tag1"
-        }, {
-            "filename": "file2",
-            "tags": "file2"
-        }])
+
+    assert mock_tag_handler.get_filenames_by_tag("tag2") == ["file1"]
+    assert written_tags(mock_blob) == {"file1": ["tag1", "tag2"], "file2": []}
+    assert mock_blob.upload_from_string.call_args.kwargs[
+        "if_generation_match"] == 0
+
+
+def test_migration_race_uses_other_file(mock_tag_handler, mock_blob,
+                                        mock_dict_reader):
+    """Test that losing the migration race loads the other instance's file."""
+    mock_blob.download_as_text.side_effect = [
+        NotFound("tags.jsonl"),
+        jsonl([("file9", ["tag9"])])
+    ]
+    mock_dict_reader.return_value = []
+    mock_blob.upload_from_string.side_effect = PreconditionFailed("exists")
+
+    assert mock_tag_handler.get_filenames_by_tag("tag9") == ["file9"]
+
+
+def test_changes_are_coalesced(batching_tag_handler, mock_blob):
+    """Test that queued changes are written with a single rewrite."""
+    batching_tag_handler.add_file_to_csv("file3")
+    batching_tag_handler.add_tag_to_csv("file3", "tag4")
+    batching_tag_handler.add_tag_to_csv("file1", "tag4")
+
+    mock_blob.upload_from_string.assert_not_called()
+    assert batching_tag_handler.stats()["pending_changes"] == 3
+
+    batching_tag_handler.flush()
+
+    mock_blob.upload_from_string.assert_called_once()
+    assert written_tags(mock_blob) == {
+        "file1": ["tag1", "tag2", "tag4"],
+        "file2": ["tag1", "tag3"],
+        "file3": ["file3", "tag4"]
+    }
+    assert batching_tag_handler.stats() == {
+        "rewrites": 1,
+        "write_conflicts": 0,
+        "pending_changes": 0
+    }
+
+
+def test_lookup_sees_queued_changes(batching_tag_handler, mock_blob):
+    """Test that a lookup writes queued changes first."""
+    batching_tag_handler.add_file_to_csv("file3")
+    mock_blob.download_as_text.side_effect = [
+        mock_blob.download_as_text.return_value,
+        NotModified("unchanged")
+    ]
+
+    assert batching_tag_handler.get_filenames_by_tag("file3") == ["file3"]
+
+
+def test_flush_without_changes_does_not_write(batching_tag_handler, mock_blob):
+    """Test that changes that leave the tags as they were are not written."""
+    batching_tag_handler.add_file_to_csv("file1")
+    batching_tag_handler.add_tag_to_csv("file2", "tag3")
+    batching_tag_handler.flush()
+
+    mock_blob.upload_from_string.assert_not_called()
+
+
+def test_flush_writes_with_generation_precondition(batching_tag_handler,
+                                                   mock_blob):
+    """Test that a flush only overwrites the generation it read."""
+    batching_tag_handler.add_file_to_csv("file3")
+    batching_tag_handler.flush()
+
+    assert mock_blob.upload_from_string.call_args.kwargs[
+        "if_generation_match"] == 1
+
+
+def test_flush_retries_on_conflict(batching_tag_handler, mock_blob):
+    """Test that a lost write race reapplies the changes to the newer file."""
+    mock_blob.download_as_text.side_effect = [
+        jsonl([("file1", ["tag1"])]),
+        jsonl([("file1", ["tag1"]), ("file9", ["tag9"])])
+    ]
+    mock_blob.upload_from_string.side_effect = [
+        PreconditionFailed("conflict"), None
+    ]
+
+    batching_tag_handler.add_tag_to_csv("file1", "tag2")
+    batching_tag_handler.flush()
+
+    assert written_tags(mock_blob) == {
+        "file1": ["tag1", "tag2"],
+        "file9": ["tag9"]
+    }
+    assert batching_tag_handler.stats()["rewrites"] == 1
+    assert batching_tag_handler.stats()["write_conflicts"] == 1
+
+
+def test_flush_keeps_changes_after_repeated_conflicts(batching_tag_handler,
+                                                      mock_blob):
+    """Test that changes stay queued if every write attempt conflicts."""
+    mock_blob.upload_from_string.side_effect = PreconditionFailed("conflict")
+    batching_tag_handler.add_file_to_csv("file3")
+
+    with pytest.raises(PreconditionFailed):
+        batching_tag_handler.flush()
+    assert batching_tag_handler.stats()["pending_changes"] == 1
+
+
+def test_add_tags(batching_tag_handler, mock_blob):
+    """Test that bulk tags are written at once, creating missing entries."""
+    batching_tag_handler.add_tags({
+        "file1": {"tag4", "tag5"},
+        "file3": {"tag4"}
+    })
+
+    mock_blob.upload_from_string.assert_called_once()
+    assert written_tags(mock_blob) == {
+        "file1": ["tag1", "tag2", "tag4", "tag5"],
+        "file2": ["tag1", "tag3"],
+        "file3": ["file3", "tag4"]
+    }
+
+
+def test_add_tags_without_changes_does_not_write(batching_tag_handler,
+                                                 mock_blob):
+    """Test that tags a file already has are not written again."""
+    batching_tag_handler.add_tags({"file1": {"tag1"}})
+
+    mock_blob.upload_from_string.assert_not_called()
+
+
+@patch("flaskr.tag_handler.get_storage_client")
+def test_default_storage_client_is_shared(mock_get_storage_client):
+    """Tests that a TagHandler without a client uses the process-wide one."""
+    tag_handler = TagHandler()
+
+    assert tag_handler.storage_client is mock_get_storage_client.return_value
+
+
+def test_flush_keeps_changes_after_storage_error(batching_tag_handler,
+                                                 mock_blob):
+    """Test that a failed write keeps the changes and retries them later."""
+    mock_blob.upload_from_string.side_effect = ConnectionError("reset")
+    batching_tag_handler.add_tag_to_csv("file1", "evergreen")
+    batching_tag_handler._flush_timer.cancel()
+    batching_tag_handler._flush_timer = None
+
+    batching_tag_handler._flush_in_background()
+
+    assert batching_tag_handler.stats()["pending_changes"] == 1
+    assert batching_tag_handler.stats()["rewrites"] == 0
+    assert batching_tag_handler._flush_timer is not None
+
+    mock_blob.upload_from_string.side_effect = None
+    batching_tag_handler.flush()
+
+    assert written_tags(mock_blob)["file1"] == ["evergreen", "tag1", "tag2"]
+    assert batching_tag_handler.stats()["pending_changes"] == 0
+
+
+def test_lookups_during_write_outage(batching_tag_handler, mock_blob):
+    """Test that lookups see queued changes when they cannot be written."""
+    mock_blob.upload_from_string.side_effect = ConnectionError("reset")
+    batching_tag_handler.add_tag_to_csv("file1", "evergreen")
+    batching_tag_handler.add_file_to_csv("file3")
+
+    assert batching_tag_handler.get_filenames_by_tag("evergreen") == ["file1"]
+    assert batching_tag_handler.get_tags_by_filename()["file3"] == ["file3"]
+    assert batching_tag_handler.stats()["pending_changes"] == 2
+
+
+@patch("flaskr.tag_handler.MAX_RETRY_DELAY", 3)
+def test_failed_flushes_back_off(batching_tag_handler, mock_blob):
+    """Test that each failed flush waits twice as long, up to a ceiling."""
+    batching_tag_handler.flush_interval = 0.5
+    mock_blob.upload_from_string.side_effect = ConnectionError("reset")
+    batching_tag_handler.add_tag_to_csv("file1", "evergreen")
+
+    delays = []
+    for _ in range(4):
+        batching_tag_handler._flush_in_background()
+        delays.append(batching_tag_handler._flush_timer.interval)
+    mock_blob.upload_from_string.side_effect = None
+    batching_tag_handler.flush()
+    batching_tag_handler.add_tag_to_csv("file2", "evergreen")
+
+    assert delays == [1, 2, 3, 3]
+    assert batching_tag_handler._flush_timer.interval == 0.5
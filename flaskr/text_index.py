@@ -0,0 +1,347 @@
+"""Full-text search over the contents of wiki pages.
+
+The TextIndex is an inverted index from words to the pages that contain them,
+ranked with BM25. It is updated one page at a time as pages are uploaded and
+serialized into a single gzip-compressed JSON blob, so a new instance loads
+the whole index with one download instead of fetching every page.
+
+The blob holds only the postings and the length of each page, so it grows
+with the vocabulary rather than with the text of the wiki. Snippets are not
+stored; they are cut from the page itself when it is shown as a hit, with
+page_snippet().
+
+Example:
+    index = TextIndex()
+    index.add_document("Palm", "<p>Palms grow in the tropics.</p>")
+    hits = index.search("tropical palms")
+    data = index.to_bytes()
+    same_index = TextIndex.from_bytes(data)
+    snippet = page_snippet(page_html, "tropical palms")
+"""
+from collections import Counter, namedtuple
+from flaskr.manifest import SEARCH_INDEX_NAME
+from google.api_core.exceptions import NotFound, NotModified, PreconditionFailed
+import gzip
+import html.parser
+import json
+import math
+import re
+import threading
+
+# BM25 parameters: term frequency saturation and document length weight.
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+SNIPPET_LENGTH = 160
+
+# How many times an update is retried after losing a write race.
+MAX_WRITE_ATTEMPTS = 5
+
+_WORD_RE = re.compile(r"\w+")
+
+SearchHit = namedtuple("SearchHit", ["name", "score", "snippet"])
+
+
+class _TextExtractor(html.parser.HTMLParser):
+    """Collects the visible text of an HTML document."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self._skip += 1
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style") and self._skip:
+            self._skip -= 1
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+
+def html_to_text(html):
+    """Returns the visible text of an HTML string with collapsed whitespace.
+
+    Args:
+        html (str): The HTML to convert.
+    """
+    extractor = _TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return " ".join(" ".join(extractor.parts).split())
+
+
+def tokenize(text):
+    """Splits text into lowercase words.
+
+    Args:
+        text (str): The text to split.
+
+    Returns:
+        list: The words in the order they appear.
+    """
+    return _WORD_RE.findall(text.lower())
+
+
+class TextIndex:
+    """An inverted index over page text with BM25 ranking."""
+
+    def __init__(self):
+        # word -> {page name: term frequency}
+        self._postings = {}
+        # page name -> number of words
+        self._docs = {}
+        # page name -> words of the page, so a page can be removed without
+        # scanning every posting list
+        self._terms_by_doc = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, name):
+        return name in self._docs
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add_document(self, name, html):
+        """Indexes a page, replacing any earlier version of it.
+
+        Args:
+            name (str): The page name.
+            html (str): The page's HTML content.
+        """
+        text = html_to_text(html)
+        words = tokenize(text)
+        with self._lock:
+            self._remove(name)
+            self._insert(name, len(words), Counter(words))
+
+    def remove_document(self, name):
+        """Removes a page from the index if it is present.
+
+        Args:
+            name (str): The page name.
+        """
+        with self._lock:
+            self._remove(name)
+
+    def _insert(self, name, length, term_counts):
+        self._docs[name] = length
+        self._terms_by_doc[name] = list(term_counts)
+        self._total_length += length
+        for term, count in term_counts.items():
+            self._postings.setdefault(term, {})[name] = count
+
+    def _remove(self, name):
+        if name not in self._docs:
+            return
+        length = self._docs.pop(name)
+        self._total_length -= length
+        for term in self._terms_by_doc.pop(name):
+            docs = self._postings[term]
+            del docs[name]
+            if not docs:
+                del self._postings[term]
+
+    def copy(self):
+        """Returns an independent copy of the index."""
+        index = TextIndex()
+        with self._lock:
+            index._postings = {
+                term: dict(docs) for term, docs in self._postings.items()
+            }
+            index._docs = dict(self._docs)
+            index._terms_by_doc = dict(self._terms_by_doc)
+            index._total_length = self._total_length
+        return index
+
+    def search(self, query, limit=10):
+        """Returns the pages that best match the query words.
+
+        Args:
+            query (str): The words to search for.
+            limit (int): The maximum number of hits to return.
+
+        Returns:
+            list: SearchHit tuples, best match first. Their snippets are
+            None, since the index does not keep page text.
+        """
+        terms = set(tokenize(query))
+        scores = Counter()
+        with self._lock:
+            count = len(self._docs)
+            if not count or not terms:
+                return []
+            average_length = self._total_length / count
+            for term in terms:
+                docs = self._postings.get(term, {})
+                idf = math.log(1 + (count - len(docs) + 0.5) /
+                               (len(docs) + 0.5))
+                for name, frequency in docs.items():
+                    length = self._docs[name]
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * length /
+                                      (average_length or 1))
+                    scores[name] += idf * frequency * (BM25_K1 +
+                                                       1) / (frequency + norm)
+            best = scores.most_common(limit)
+        return [SearchHit(name, score, None) for name, score in best]
+
+    def to_bytes(self):
+        """Serializes the index into compact gzip-compressed JSON.
+
+        Pages are numbered so each posting stores a small integer instead of
+        the page name.
+        """
+        with self._lock:
+            names = sorted(self._docs)
+            ids = {name: i for i, name in enumerate(names)}
+            data = {
+                "docs": [[name, self._docs[name]] for name in names],
+                "postings": {
+                    term: [[ids[name], count] for name, count in docs.items()
+                          ] for term, docs in self._postings.items()
+                },
+            }
+        return gzip.compress(
+            json.dumps(data, separators=(",", ":")).encode("utf-8"))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Loads an index serialized by to_bytes().
+
+        Args:
+            data (bytes): The serialized index.
+
+        Returns:
+            TextIndex: The loaded index.
+        """
+        data = json.loads(gzip.decompress(data))
+        index = cls()
+        names = []
+        # Indexes written before snippets were cut from the page also hold
+        # the start of each page's text, which is dropped.
+        for name, length, *_ in data["docs"]:
+            names.append(name)
+            index._docs[name] = length
+            index._total_length += length
+            index._terms_by_doc[name] = []
+        for term, docs in data["postings"].items():
+            index._postings[term] = {names[i]: count for i, count in docs}
+            for i, _ in docs:
+                index._terms_by_doc[names[i]].append(term)
+        return index
+
+
+def make_snippet(text, terms, length=SNIPPET_LENGTH):
+    """Returns a short excerpt of text around the first matching word.
+
+    Args:
+        text (str): The page text.
+        terms (set): Lowercase words to look for.
+        length (int): The approximate length of the snippet.
+    """
+    start = 0
+    for match in _WORD_RE.finditer(text.lower()):
+        if match.group() in terms:
+            start = max(0, match.start() - length // 4)
+            break
+    snippet = text[start:start + length]
+    if start > 0:
+        snippet = "..." + snippet
+    if start + length < len(text):
+        snippet += "..."
+    return snippet
+
+
+def page_snippet(html, query, length=SNIPPET_LENGTH):
+    """Returns a short excerpt of a page's text around the first query word.
+
+    Args:
+        html (str): The page's HTML content.
+        query (str): The words that were searched for.
+        length (int): The approximate length of the snippet.
+    """
+    return make_snippet(html_to_text(html), set(tokenize(query)), length)
+
+
+class StoredTextIndex:
+    """Keeps a TextIndex in sync with its blob in the page bucket.
+
+    Attributes:
+        blob (google.cloud.storage.Blob): The blob holding the index.
+    """
+
+    def __init__(self, bucket, blob_name=SEARCH_INDEX_NAME):
+        self.blob = bucket.blob(blob_name)
+        self._index = TextIndex()
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Returns the index, downloading it again only if it changed."""
+        with self._lock:
+            self._load()
+            return self._index
+
+    def _load(self):
+        try:
+            if self._generation is None:
+                data = self.blob.download_as_bytes()
+            else:
+                data = self.blob.download_as_bytes(
+                    if_generation_not_match=self._generation)
+        except NotModified:
+            return
+        except NotFound:
+            # Nothing has been indexed yet.
+            return
+        self._index = TextIndex.from_bytes(data)
+        self._generation = self.blob.generation
+
+    def _save(self, index, if_generation_match):
+        self.blob.upload_from_string(index.to_bytes(),
+                                     content_type="application/gzip",
+                                     if_generation_match=if_generation_match)
+        self._index = index
+        self._generation = self.blob.generation
+
+    def add_document(self, name, html):
+        """Indexes a page and writes the updated index back to its blob.
+
+        The write only succeeds if nobody else changed the blob since it was
+        read; otherwise the latest index is loaded and the page added again.
+
+        Args:
+            name (str): The page name.
+            html (str): The page's HTML content.
+        """
+        with self._lock:
+            for _ in range(MAX_WRITE_ATTEMPTS):
+                self._load()
+                # Edit a copy so readers of the current index are unaffected
+                # if the write fails.
+                index = self._index.copy()
+                index.add_document(name, html)
+                try:
+                    self._save(index, if_generation_match=self._generation or 0)
+                    return
+                except PreconditionFailed:
+                    self._generation = None
+            raise PreconditionFailed(f"Could not update {self.blob.name} after "
+                                     f"{MAX_WRITE_ATTEMPTS} attempts")
+
+    def rebuild(self, pages):
+        """Replaces the stored index with one built from the given pages.
+
+        Args:
+            pages (iterable): (name, html) pairs of every page.
+        """
+        index = TextIndex()
+        for name, html in pages:
+            index.add_document(name, html)
+        with self._lock:
+            self._save(index, if_generation_match=None)
@@ -0,0 +1,165 @@
+"""Tests for the TextIndex and StoredTextIndex classes in the flaskr application."""
+from flaskr.text_index import (TextIndex, StoredTextIndex, html_to_text,
+                               make_snippet, page_snippet)
+from google.api_core.exceptions import NotFound, NotModified, PreconditionFailed
+from google.cloud import storage
+from unittest.mock import MagicMock
+import gzip
+import json
+import pytest
+
+
+@pytest.fixture
+def index():
+    index = TextIndex()
+    index.add_document(
+        "Palm", "<h1>Palm</h1><p>Palms grow in warm tropical climates.</p>")
+    index.add_document(
+        "Live Oak",
+        "<p>The live oak is an evergreen oak of the American south.</p>")
+    index.add_document(
+        "Juniper", "<p>Juniper berries flavor gin.</p><script>oak</script>")
+    return index
+
+
+@pytest.fixture
+def mock_blob():
+    mock = MagicMock(spec=storage.Blob)
+    mock.name = "search_index.json.gz"
+    mock.generation = 3
+    mock.download_as_bytes.side_effect = NotFound("missing")
+    return mock
+
+
+@pytest.fixture
+def stored_index(mock_blob):
+    bucket = MagicMock(spec=storage.Bucket)
+    bucket.blob.return_value = mock_blob
+    return StoredTextIndex(bucket)
+
+
+def test_html_to_text_skips_markup_and_scripts():
+    """Tests that only visible text is extracted from HTML."""
+    assert html_to_text(
+        "<p>Hello <b>world</b></p><script>x()</script>") == "Hello world"
+
+
+def test_search_ranks_by_term_frequency(index):
+    """Tests that the page mentioning the word most often ranks first."""
+    hits = index.search("oak")
+
+    assert [hit.name for hit in hits] == ["Live Oak"]
+
+
+def test_search_ignores_case_and_unknown_words(index):
+    """Tests that queries are case-insensitive and unknown words are skipped."""
+    assert [hit.name for hit in index.search("TROPICAL sequoia")] == ["Palm"]
+
+
+def test_index_holds_no_page_text(index):
+    """Tests that only postings and page lengths are serialized."""
+    data = json.loads(gzip.decompress(index.to_bytes()))
+
+    assert data["docs"] == [["Juniper", 4], ["Live Oak", 11], ["Palm", 7]]
+    assert index.search("gin")[0].snippet is None
+
+
+def test_from_bytes_reads_indexes_with_stored_text(index):
+    """Tests that indexes written with page text in them still load."""
+    data = json.loads(gzip.decompress(index.to_bytes()))
+    data["docs"] = [[name, length, "old text"] for name, length in data["docs"]]
+
+    loaded = TextIndex.from_bytes(gzip.compress(json.dumps(data).encode()))
+
+    assert loaded.search("evergreen oak") == index.search("evergreen oak")
+    assert b"old text" not in gzip.decompress(loaded.to_bytes())
+
+
+def test_search_respects_limit(index):
+    """Tests that no more than the limit of hits are returned."""
+    assert len(index.search("palm oak juniper", limit=2)) == 2
+
+
+def test_add_document_replaces_old_version(index):
+    """Tests that re-indexing a page drops the words it no longer has."""
+    index.add_document("Palm", "<p>Coconuts</p>")
+
+    assert index.search("tropical") == []
+    assert index.search("coconuts")[0].name == "Palm"
+
+
+def test_remove_document(index):
+    """Tests that removed pages are no longer found."""
+    index.remove_document("Juniper")
+
+    assert "Juniper" not in index
+    assert index.search("gin") == []
+
+
+def test_round_trip(index):
+    """Tests that a serialized index gives the same results."""
+    loaded = TextIndex.from_bytes(index.to_bytes())
+
+    assert len(loaded) == 3
+    assert loaded.search("evergreen oak") == index.search("evergreen oak")
+    loaded.remove_document("Live Oak")
+    assert loaded.search("oak") == []
+
+
+def test_make_snippet_centers_on_match():
+    """Tests that the snippet starts near the first matching word."""
+    text = "a " * 200 + "needle" + " b" * 200
+    snippet = make_snippet(text, {"needle"})
+
+    assert snippet.startswith("...")
+    assert snippet.endswith("...")
+    assert "needle" in snippet
+
+
+def test_page_snippet_uses_visible_text():
+    """Tests that a page's snippet is cut from its text, not its markup."""
+    assert page_snippet("<p>Juniper berries <b>flavor</b> gin.</p>",
+                        "GIN") == "Juniper berries flavor gin."
+
+
+def test_stored_index_starts_empty(stored_index):
+    """Tests that a missing index blob gives an empty index."""
+    assert len(stored_index.get()) == 0
+
+
+def test_stored_index_add_document_saves(stored_index, mock_blob):
+    """Tests that adding a page writes the index with a precondition."""
+    stored_index.add_document("Palm", "<p>Tropical</p>")
+
+    data = mock_blob.upload_from_string.call_args.args[0]
+    assert TextIndex.from_bytes(data).search("tropical")[0].name == "Palm"
+    assert mock_blob.upload_from_string.call_args.kwargs[
+        "if_generation_match"] == 0
+
+
+def test_stored_index_reloads_after_conflict(stored_index, mock_blob):
+    """Tests that a lost write race merges with the other writer's index."""
+    other = TextIndex()
+    other.add_document("Ginko", "<p>Fan shaped leaves</p>")
+    mock_blob.download_as_bytes.side_effect = [
+        NotFound("missing"), other.to_bytes()
+    ]
+    mock_blob.upload_from_string.side_effect = [
+        PreconditionFailed("conflict"), None
+    ]
+
+    stored_index.add_document("Palm", "<p>Tropical</p>")
+
+    data = mock_blob.upload_from_string.call_args.args[0]
+    assert len(TextIndex.from_bytes(data)) == 2
+
+
+def test_stored_index_get_is_conditional(stored_index, mock_blob, index):
+    """Tests that the index is only downloaded again if it changed."""
+    mock_blob.download_as_bytes.side_effect = None
+    mock_blob.download_as_bytes.return_value = index.to_bytes()
+    stored_index.get()
+    mock_blob.download_as_bytes.side_effect = NotModified("unchanged")
+
+    assert len(stored_index.get()) == 3
+    mock_blob.download_as_bytes.assert_called_with(if_generation_not_match=3)
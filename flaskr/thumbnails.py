@@ -0,0 +1,125 @@
+"""Resized copies of uploaded images.
+
+Images are uploaded at full resolution, but are often shown much smaller,
+like the author pictures on the about page. A Thumbnailer creates a copy of
+an image scaled down to a given width the first time it is asked for, stores
+it in the image bucket under a derived name, and returns the stored copy on
+later requests. Only a few widths are allowed so that the number of stored
+copies of an image stays small.
+
+A copy's name includes the generation of the original it was made from, so
+replacing an image needs no deletes: the new generation simply has no
+copies yet. Copies of replaced generations are no longer read and can be
+removed by a lifecycle rule on the "_derived/" prefix.
+
+Example:
+    thumbnailer = Thumbnailer(image_bucket)
+    blob = thumbnailer.get("squirtle.jpeg", IMAGE_SIZE_PRESETS["avatar"])
+"""
+from google.api_core.exceptions import PreconditionFailed
+from io import BytesIO
+from PIL import Image, ImageOps
+
+# Named widths, in pixels, that images can be requested at.
+IMAGE_SIZE_PRESETS = {
+    "thumb": 160,
+    "avatar": 320,
+    "medium": 800,
+}
+ALLOWED_WIDTHS = frozenset(IMAGE_SIZE_PRESETS.values())
+
+# Resized copies are stored under this prefix in the image bucket.
+DERIVATIVE_PREFIX = "_derived/"
+
+JPEG_QUALITY = 85
+
+
+def derivative_name(image_name, width, generation):
+    """Returns the blob name of an image resized to the given width.
+
+    Args:
+        image_name (str): The name of the original image.
+        width (int): The width of the resized copy.
+        generation (int): The generation of the original image.
+    """
+    return f"{DERIVATIVE_PREFIX}{width}w/{generation}/{image_name}"
+
+
+def resize_image(data, width):
+    """Scales an image down to the given width, keeping its aspect ratio.
+
+    Images that are already no wider are re-encoded at their own size.
+
+    Args:
+        data (bytes): The encoded image.
+        width (int): The maximum width of the result.
+
+    Returns:
+        bytes: The resized image, encoded in the same format as the original.
+    """
+    with Image.open(BytesIO(data)) as original:
+        image_format = original.format
+        # Apply the camera's orientation before the metadata is dropped.
+        image = ImageOps.exif_transpose(original)
+        if image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.LANCZOS)
+        options = {}
+        if image_format == "JPEG":
+            image = image.convert("RGB")
+            options = {"quality": JPEG_QUALITY, "optimize": True}
+        output = BytesIO()
+        image.save(output, format=image_format, **options)
+    return output.getvalue()
+
+
+class Thumbnailer:
+    """Creates and stores resized copies of the images in a bucket.
+
+    Attributes:
+        bucket (google.cloud.storage.Bucket): The bucket holding both the
+            original images and their resized copies.
+    """
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def get(self, image_name, width):
+        """Returns the blob of an image resized to the given width.
+
+        The resized copy is created and stored on the first request for the
+        current generation of the image, so later requests cost two metadata
+        lookups: the original's and the copy's.
+
+        Args:
+            image_name (str): The name of the original image.
+            width (int): One of ALLOWED_WIDTHS.
+
+        Returns:
+            google.cloud.storage.Blob: The resized copy, or None if there is
+                no such image.
+
+        Raises:
+            ValueError: If the width is not one of ALLOWED_WIDTHS.
+        """
+        if width not in ALLOWED_WIDTHS:
+            raise ValueError(f"Images cannot be resized to {width} pixels")
+        original = self.bucket.get_blob(image_name)
+        if original is None:
+            return None
+        name = derivative_name(image_name, width, original.generation)
+        blob = self.bucket.get_blob(name)
+        if blob is not None:
+            return blob
+        data = resize_image(
+            original.download_as_bytes(if_generation_match=original.generation),
+            width)
+        blob = self.bucket.blob(name)
+        try:
+            blob.upload_from_string(data,
+                                    content_type=original.content_type,
+                                    if_generation_match=0)
+        except PreconditionFailed:
+            # Another request stored the same copy first.
+            return self.bucket.get_blob(name)
+        return blob
@@ -0,0 +1,129 @@
+"""Tests for the Thumbnailer class in the flaskr application."""
+from flaskr.thumbnails import Thumbnailer, derivative_name, resize_image
+from google.api_core.exceptions import PreconditionFailed
+from google.cloud import storage
+from io import BytesIO
+from PIL import Image
+from unittest.mock import MagicMock
+import pytest
+
+
+def make_image(width, height, image_format="PNG"):
+    """Returns an encoded image of the given size."""
+    output = BytesIO()
+    Image.new("RGB", (width, height), "green").save(output, format=image_format)
+    return output.getvalue()
+
+
+def image_size(data):
+    with Image.open(BytesIO(data)) as image:
+        return image.size
+
+
+@pytest.fixture
+def original():
+    blob = MagicMock(spec=storage.Blob)
+    blob.name = "tree.png"
+    blob.generation = 4
+    blob.content_type = "image/png"
+    blob.download_as_bytes.return_value = make_image(1000, 500)
+    return blob
+
+
+@pytest.fixture
+def derivative():
+    return MagicMock(spec=storage.Blob)
+
+
+@pytest.fixture
+def mock_bucket(original, derivative):
+    mock = MagicMock(spec=storage.Bucket)
+    mock.get_blob.side_effect = lambda name: {"tree.png": original}.get(name)
+    mock.blob.return_value = derivative
+    return mock
+
+
+@pytest.fixture
+def thumbnailer(mock_bucket):
+    return Thumbnailer(mock_bucket)
+
+
+def test_resize_image_keeps_aspect_ratio():
+    """Tests that an image is scaled down to the width proportionally."""
+    assert image_size(resize_image(make_image(1000, 500), 160)) == (160, 80)
+
+
+def test_resize_image_does_not_enlarge():
+    """Tests that a narrower image keeps its size."""
+    assert image_size(resize_image(make_image(100, 50), 320)) == (100, 50)
+
+
+def test_resize_image_keeps_format():
+    """Tests that the resized image has the original's format."""
+    data = resize_image(make_image(1000, 500, "JPEG"), 160)
+
+    with Image.open(BytesIO(data)) as image:
+        assert image.format == "JPEG"
+
+
+def test_get_creates_and_stores_derivative(thumbnailer, derivative,
+                                           mock_bucket):
+    """Tests that the first request stores a resized copy."""
+    assert thumbnailer.get("tree.png", 160) is derivative
+
+    mock_bucket.blob.assert_called_once_with(derivative_name(
+        "tree.png", 160, 4))
+    assert derivative_name("tree.png", 160, 4) == "_derived/160w/4/tree.png"
+    data = derivative.upload_from_string.call_args.args[0]
+    assert image_size(data) == (160, 80)
+    assert derivative.upload_from_string.call_args.kwargs == {
+        "content_type": "image/png",
+        "if_generation_match": 0
+    }
+
+
+def test_get_reuses_stored_derivative(thumbnailer, mock_bucket, original):
+    """Tests that a stored copy is returned without resizing again."""
+    stored = MagicMock(spec=storage.Blob)
+    mock_bucket.get_blob.side_effect = lambda name: {
+        "tree.png": original,
+        "_derived/160w/4/tree.png": stored
+    }.get(name)
+
+    assert thumbnailer.get("tree.png", 160) is stored
+    original.download_as_bytes.assert_not_called()
+
+
+def test_get_missing_image(thumbnailer):
+    """Tests that there is no copy of an image that does not exist."""
+    assert thumbnailer.get("missing.png", 160) is None
+
+
+def test_get_rejects_other_widths(thumbnailer):
+    """Tests that only the allowed widths can be requested."""
+    with pytest.raises(ValueError):
+        thumbnailer.get("tree.png", 161)
+
+
+def test_get_uses_copy_stored_concurrently(thumbnailer, derivative, mock_bucket,
+                                           original):
+    """Tests that losing the race to store a copy returns the winner's."""
+    stored = MagicMock(spec=storage.Blob)
+    lookups = iter([original, None, stored])
+    mock_bucket.get_blob.side_effect = lambda name: next(lookups)
+    derivative.upload_from_string.side_effect = PreconditionFailed("exists")
+
+    assert thumbnailer.get("tree.png", 160) is stored
+
+
+def test_replaced_image_gets_new_copies(thumbnailer, mock_bucket, original):
+    """Tests that copies of an older generation are not returned."""
+    stored = MagicMock(spec=storage.Blob)
+    mock_bucket.get_blob.side_effect = lambda name: {
+        "tree.png": original,
+        "_derived/160w/4/tree.png": stored
+    }.get(name)
+    original.generation = 5
+
+    assert thumbnailer.get("tree.png", 160) is not stored
+    mock_bucket.blob.assert_called_once_with("_derived/160w/5/tree.png")
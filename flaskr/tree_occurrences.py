@@ -0,0 +1,381 @@
+"""Tree occurrences shown on the tree distribution map.
+
+The map can show tens of thousands of trees, far too many to send to the
+browser at once. TreeOccurrences groups them into clusters on a grid whose
+cells shrink as the map zooms in, and answers queries for the clusters inside
+a bounding box. The grid for each zoom level is built the first time it is
+queried and kept, so a query only visits the cells inside the box.
+
+The grid is aligned with map tiles: a tile at zoom z is 360 / 2**z degrees
+wide and holds CLUSTERS_PER_TILE by CLUSTERS_PER_TILE cells. A query for the
+bounds of a tile therefore returns exactly the clusters of that tile, and the
+browser can load the map tile by tile without getting a cluster twice.
+
+The occurrences are stored as JSON in the page bucket:
+
+    {"species": [{"name": "Palm", "distribution": "...", "color": "pink"}],
+     "points": [[26.7056, -80.0364, 0]]}
+
+where each point is a latitude, a longitude and an index into "species".
+A stored dataset's version is the generation of its blob. The browser sends
+it with every clusters request, so it notices when the species it holds no
+longer match the dataset.
+
+Example:
+    occurrences = TreeOccurrences.from_distributions(TREE_DISTRIBUTIONS)
+    clusters = occurrences.clusters((-90.0, 25.0, -75.0, 35.0), zoom=6)
+"""
+from collections import namedtuple
+from google.api_core.exceptions import NotFound, NotModified
+import json
+import math
+import threading
+import time
+
+TREE_OCCURRENCES_NAME = "tree_occurrences.json"
+
+# Zoom levels the map supports. Above MAX_CLUSTER_ZOOM every tree is
+# returned on its own.
+MAX_ZOOM = 18
+MAX_CLUSTER_ZOOM = 12
+
+# Cells per side of a map tile.
+CLUSTERS_PER_TILE = 4
+
+# Seconds the loaded occurrences are used before checking for a new blob.
+RELOAD_INTERVAL = 60
+
+# The color of species that are not in TREE_DISTRIBUTIONS.
+DEFAULT_COLOR = "gray"
+
+# Where each species grows and the color of its markers, with one tree of
+# each species that is shown until a dataset of occurrences is stored.
+TREE_DISTRIBUTIONS = {
+    'Coast Redwood': {
+        'location': (38.9822, -123.3781),
+        'distribution': 'North America',
+        'color': 'green'
+    },
+    'Ginko': {
+        'location': (39.7684, -86.1581),
+        'distribution': 'East Asia',
+        'color': 'red'
+    },
+    'Japanese Magnolia': {
+        'location': (35.8801, -79.0800),
+        'distribution': 'East Asia',
+        'color': 'blue'
+    },
+    'Juniper': {
+        'location': (40.7968, -77.8619),
+        'distribution': 'North America, Eurasia',
+        'color': 'orange'
+    },
+    'Live Oak': {
+        'location': (30.3894, -86.5229),
+        'distribution': 'North America',
+        'color': 'darkgreen'
+    },
+    'Monterey Cypress': {
+        'location': (36.6002, -121.8947),
+        'distribution': 'North America',
+        'color': 'darkblue'
+    },
+    'Palm': {
+        'location': (26.7056, -80.0364),
+        'distribution': 'Africa, Eurasia, Americas',
+        'color': 'pink'
+    },
+    'Palmetto': {
+        'location': (26.7153, -81.0522),
+        'distribution': 'North America',
+        'color': 'darkred'
+    },
+    'Water Oak': {
+        'location': (30.4383, -84.2807),
+        'distribution': 'North America',
+        'color': 'gray'
+    },
+    'White Oak': {
+        'location': (33.9860, -83.7185),
+        'distribution': 'North America',
+        'color': 'purple'
+    }
+}
+
+# The version of the built-in dataset. Stored datasets are versioned by the
+# generation of their blob.
+BUILTIN_VERSION = "builtin"
+
+# Tolerance for bounding boxes computed in floating point by the browser.
+_EPSILON = 1e-9
+
+Species = namedtuple("Species", ["name", "distribution", "color"])
+
+# "species" is the index of the species of every tree in the cluster, or
+# None if they are of different species.
+Cluster = namedtuple("Cluster", ["lat", "lng", "count", "species"])
+
+
+def cell_size(zoom):
+    """Returns the width in degrees of a grid cell at a zoom level.
+
+    Args:
+        zoom (int): The map zoom level.
+    """
+    return 360 / 2**zoom / CLUSTERS_PER_TILE
+
+
+def _cell(lat, lng, size):
+    return (math.floor((lat + 90) / size), math.floor((lng + 180) / size))
+
+
+def _cell_range(low, high, offset, size):
+    # The cells overlapping [low, high), tolerating rounding errors at the
+    # edges of tile-aligned boxes.
+    return (math.floor((low + offset) / size + _EPSILON),
+            math.ceil((high + offset) / size - _EPSILON) - 1)
+
+
+class TreeOccurrences:
+    """Tree occurrences indexed by grid cell at every zoom level.
+
+    Attributes:
+        species (list): Species tuples, referred to by index.
+        points (list): (lat, lng, species index) tuples.
+        version (str): Identifies the dataset, so the browser can tell when
+            the species indexes it holds no longer apply.
+    """
+
+    def __init__(self, species, points, version=BUILTIN_VERSION):
+        self.version = version
+        self.species = list(species)
+        self.points = [
+            (float(lat), float(lng), int(index)) for lat, lng, index in points
+        ]
+        # zoom -> {cell: [count, sum of lat, sum of lng, species]}
+        self._levels = {}
+        # cell at MAX_CLUSTER_ZOOM -> points in it
+        self._points = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_distributions(cls, tree_distributions):
+        """Creates occurrences with one tree for every species.
+
+        Args:
+            tree_distributions (dict): Tree names mapped to their location,
+                distribution and color, like TREE_DISTRIBUTIONS.
+        """
+        species = []
+        points = []
+        for name, tree in tree_distributions.items():
+            points.append((*tree["location"], len(species)))
+            species.append(Species(name, tree["distribution"], tree["color"]))
+        return cls(species, points)
+
+    @classmethod
+    def from_records(cls, records, tree_distributions=TREE_DISTRIBUTIONS):
+        """Creates occurrences from individual sightings of trees.
+
+        Species found in tree_distributions keep their distribution and
+        color; other species are shown in DEFAULT_COLOR.
+
+        Args:
+            records (iterable): (species name, lat, lng) tuples.
+            tree_distributions (dict): Known species, like TREE_DISTRIBUTIONS.
+        """
+        species = []
+        indexes = {}
+        points = []
+        for name, lat, lng in records:
+            if name not in indexes:
+                tree = tree_distributions.get(name, {})
+                indexes[name] = len(species)
+                species.append(
+                    Species(name, tree.get("distribution", ""),
+                            tree.get("color", DEFAULT_COLOR)))
+            points.append((lat, lng, indexes[name]))
+        return cls(species, points)
+
+    @classmethod
+    def from_json(cls, data, version=BUILTIN_VERSION):
+        """Loads occurrences stored by to_json().
+
+        Args:
+            data (str or bytes): The stored JSON.
+            version (str): Identifies the dataset.
+        """
+        data = json.loads(data)
+        species = [
+            Species(s["name"], s.get("distribution", ""), s.get("color", ""))
+            for s in data["species"]
+        ]
+        return cls(species, data["points"], version)
+
+    def to_json(self):
+        """Returns the occurrences as compact JSON."""
+        return json.dumps(
+            {
+                "species": [s._asdict() for s in self.species],
+                "points": self.points
+            },
+            separators=(",", ":"))
+
+    def _level(self, zoom):
+        with self._lock:
+            level = self._levels.get(zoom)
+            if level is None:
+                level = {}
+                size = cell_size(zoom)
+                for lat, lng, index in self.points:
+                    cell = level.setdefault(_cell(lat, lng, size),
+                                            [0, 0.0, 0.0, index])
+                    cell[0] += 1
+                    cell[1] += lat
+                    cell[2] += lng
+                    if cell[3] != index:
+                        cell[3] = None
+                self._levels[zoom] = level
+            return level
+
+    def _points_by_cell(self):
+        with self._lock:
+            if self._points is None:
+                size = cell_size(MAX_CLUSTER_ZOOM)
+                points = {}
+                for point in self.points:
+                    points.setdefault(_cell(point[0], point[1], size),
+                                      []).append(point)
+                self._points = points
+            return self._points
+
+    def clusters(self, bbox, zoom):
+        """Returns the clusters of trees whose grid cells overlap a box.
+
+        Args:
+            bbox (tuple): West, south, east and north edges in degrees. A box
+                crossing the antimeridian has a west edge greater than its
+                east edge.
+            zoom (int): The map zoom level.
+
+        Returns:
+            list: Cluster tuples. Above MAX_CLUSTER_ZOOM each is a single tree.
+        """
+        west, south, east, north = bbox
+        south, north = max(south, -90.0), min(north, 90.0)
+        if west > east:
+            return (self.clusters(
+                (west, south, 180.0, north), zoom) + self.clusters(
+                    (-180.0, south, east, north), zoom))
+
+        zoom = min(max(int(zoom), 0), MAX_ZOOM)
+        level_zoom = min(zoom, MAX_CLUSTER_ZOOM)
+        size = cell_size(level_zoom)
+        level = self._level(level_zoom)
+        rows = _cell_range(south, north, 90, size)
+        cols = _cell_range(max(west, -180.0), min(east, 180.0), 180, size)
+        if rows[1] < rows[0] or cols[1] < cols[0]:
+            return []
+
+        # Visit whichever is smaller: the cells in the box, or the cells
+        # that hold trees.
+        area = (rows[1] - rows[0] + 1) * (cols[1] - cols[0] + 1)
+        if area < len(level):
+            cells = ((row, col)
+                     for row in range(rows[0], rows[1] + 1)
+                     for col in range(cols[0], cols[1] + 1)
+                     if (row, col) in level)
+        else:
+            cells = (cell for cell in level if rows[0] <= cell[0] <= rows[1] and
+                     cols[0] <= cell[1] <= cols[1])
+
+        if zoom > MAX_CLUSTER_ZOOM:
+            # Trees on the edge between two boxes belong to the box east or
+            # north of it, so neighbouring tiles never share a tree.
+            points = self._points_by_cell()
+            return [
+                Cluster(lat, lng, 1, index)
+                for cell in cells
+                for lat, lng, index in points[cell]
+                if south <= lat < north and west <= lng < east
+            ]
+        clusters = []
+        for cell in cells:
+            count, lat_sum, lng_sum, index = level[cell]
+            clusters.append(
+                Cluster(lat_sum / count, lng_sum / count, count, index))
+        return clusters
+
+
+class StoredTreeOccurrences:
+    """Keeps TreeOccurrences in sync with their blob in the page bucket.
+
+    Until a dataset is stored, the given fallback occurrences are used.
+    """
+
+    def __init__(self,
+                 bucket,
+                 fallback,
+                 blob_name=TREE_OCCURRENCES_NAME,
+                 reload_interval=RELOAD_INTERVAL,
+                 clock=time.monotonic):
+        """Creates a store that loads the blob on first use.
+
+        Args:
+            bucket (google.cloud.storage.Bucket): The page bucket.
+            fallback (TreeOccurrences): Used while there is no blob.
+            blob_name (str): The name of the blob holding the occurrences.
+            reload_interval (float): Seconds between checks for a new blob.
+            clock (callable): Returns the current time in seconds.
+        """
+        self.blob = bucket.blob(blob_name)
+        self._fallback = fallback
+        self._occurrences = fallback
+        self._generation = None
+        self._checked_at = None
+        self.reload_interval = reload_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Returns the occurrences, downloading them again if they changed."""
+        with self._lock:
+            now = self._clock()
+            if (self._checked_at is None or
+                    now - self._checked_at >= self.reload_interval):
+                self._load()
+                self._checked_at = now
+            return self._occurrences
+
+    def _load(self):
+        try:
+            if self._generation is None:
+                data = self.blob.download_as_bytes()
+            else:
+                data = self.blob.download_as_bytes(
+                    if_generation_not_match=self._generation)
+        except NotModified:
+            return
+        except NotFound:
+            self._occurrences = self._fallback
+            self._generation = None
+            return
+        self._generation = self.blob.generation
+        self._occurrences = TreeOccurrences.from_json(data,
+                                                      version=str(
+                                                          self._generation))
+
+    def save(self, occurrences):
+        """Replaces the stored occurrences.
+
+        Args:
+            occurrences (TreeOccurrences): The new dataset.
+        """
+        with self._lock:
+            self.blob.upload_from_string(occurrences.to_json(),
+                                         content_type="application/json")
+            self._generation = self.blob.generation
+            occurrences.version = str(self._generation)
+            self._occurrences = occurrences
+            self._checked_at = self._clock()
@@ -0,0 +1,175 @@
+"""Tests for the tree occurrences shown on the tree map."""
+from flaskr.tree_occurrences import (BUILTIN_VERSION, DEFAULT_COLOR,
+                                     MAX_CLUSTER_ZOOM, TREE_DISTRIBUTIONS,
+                                     Species, StoredTreeOccurrences,
+                                     TreeOccurrences, cell_size)
+from google.api_core.exceptions import NotFound, NotModified
+from google.cloud import storage
+from unittest.mock import MagicMock
+import pytest
+import random
+
+SPECIES = [Species("Palm", "Americas", "pink"), Species("Ginko", "Asia", "red")]
+
+
+def tile_bbox(x, y, zoom):
+    """Returns the edges of a map tile, as the browser computes them."""
+    size = 360 / 2**zoom
+    return (x * size - 180, y * size - 90, (x + 1) * size - 180,
+            min(90, (y + 1) * size - 90))
+
+
+@pytest.fixture
+def occurrences():
+    generator = random.Random(1)
+    points = [(generator.uniform(-60, 60), generator.uniform(-170, 170),
+               generator.randrange(2)) for _ in range(5000)]
+    return TreeOccurrences(SPECIES, points)
+
+
+def test_from_distributions_has_a_tree_per_species():
+    """Tests that the built-in dataset has one tree of each species."""
+    occurrences = TreeOccurrences.from_distributions(TREE_DISTRIBUTIONS)
+
+    assert [s.name for s in occurrences.species] == list(TREE_DISTRIBUTIONS)
+    assert len(occurrences.points) == len(TREE_DISTRIBUTIONS)
+    assert occurrences.species[0].color == "green"
+
+
+def test_from_records_reuses_species():
+    """Tests that records of the same species share one species entry."""
+    occurrences = TreeOccurrences.from_records([("Palm", 1, 2),
+                                                ("Baobab", 3, 4),
+                                                ("Palm", 5, 6)])
+
+    assert [s.name for s in occurrences.species] == ["Palm", "Baobab"]
+    assert occurrences.species[0].color == "pink"
+    assert occurrences.species[1].color == DEFAULT_COLOR
+    assert [p[2] for p in occurrences.points] == [0, 1, 0]
+
+
+def test_json_round_trip(occurrences):
+    """Tests that stored occurrences load back unchanged."""
+    loaded = TreeOccurrences.from_json(occurrences.to_json())
+
+    assert loaded.species == occurrences.species
+    assert loaded.points == occurrences.points
+
+
+def test_world_clusters_count_every_tree(occurrences):
+    """Tests that the clusters of the whole world hold every tree once."""
+    clusters = occurrences.clusters((-180, -90, 180, 90), zoom=2)
+
+    assert sum(c.count for c in clusters) == 5000
+    assert len(clusters) <= (2**2 * 4) * (2**1 * 4)
+
+
+def test_tiles_partition_clusters(occurrences):
+    """Tests that neighbouring tiles never return the same cluster."""
+    zoom = 3
+    total = 0
+    for x in range(2**zoom):
+        for y in range(2**(zoom - 1)):
+            total += sum(
+                c.count
+                for c in occurrences.clusters(tile_bbox(x, y, zoom), zoom))
+
+    assert total == 5000
+
+
+def test_high_zoom_tiles_partition_trees():
+    """Tests that single trees on tile edges belong to one tile."""
+    size = 360 / 2**14
+    occurrences = TreeOccurrences(SPECIES, [(size, size, 0), (0.0001, 0, 1)])
+
+    found = []
+    for x in range(2**13 - 1, 2**13 + 2):
+        for y in range(2**12 - 1, 2**12 + 2):
+            found += occurrences.clusters(tile_bbox(x, y, 14), 14)
+
+    assert sorted(c.species for c in found) == [0, 1]
+    assert all(c.count == 1 for c in found)
+
+
+def test_cluster_of_one_species(occurrences):
+    """Tests that a cluster of a single species names it."""
+    occurrences = TreeOccurrences(SPECIES, [(10, 10, 1), (10.1, 10.1, 1),
+                                            (10.2, 10.2, 0)])
+
+    mixed = occurrences.clusters((0, 0, 20, 20), zoom=2)
+    assert mixed == [(pytest.approx(10.1), pytest.approx(10.1), 3, None)]
+    single = occurrences.clusters((9.95, 9.95, 10.15, 10.15), zoom=11)
+    assert {c.species for c in single} == {1}
+
+
+def test_clusters_crossing_antimeridian():
+    """Tests that a box with a west edge east of its east edge wraps."""
+    occurrences = TreeOccurrences(SPECIES, [(0, 179, 0), (0, -179, 1),
+                                            (0, 0, 0)])
+
+    clusters = occurrences.clusters((170, -10, -170, 10), zoom=6)
+
+    assert sorted(c.species for c in clusters) == [0, 1]
+
+
+def test_clusters_shrink_with_zoom(occurrences):
+    """Tests that zooming in splits clusters apart."""
+    bbox = (-20, -20, 20, 20)
+
+    assert len(occurrences.clusters(bbox, 2)) < len(
+        occurrences.clusters(bbox, 6))
+    assert cell_size(MAX_CLUSTER_ZOOM) < cell_size(2)
+
+
+@pytest.fixture
+def dataset_blob(occurrences):
+    blob = MagicMock(spec=storage.Blob)
+    blob.generation = 3
+    blob.download_as_bytes.return_value = occurrences.to_json().encode()
+    return blob
+
+
+@pytest.fixture
+def stored(dataset_blob):
+    bucket = MagicMock(spec=storage.Bucket)
+    bucket.blob.return_value = dataset_blob
+    clock = MagicMock(return_value=0)
+    fallback = TreeOccurrences.from_distributions(TREE_DISTRIBUTIONS)
+    return StoredTreeOccurrences(bucket, fallback, clock=clock)
+
+
+def test_stored_occurrences_are_loaded(stored):
+    """Tests that the stored dataset is used."""
+    assert len(stored.get().points) == 5000
+    assert stored.get().version == "3"
+
+
+def test_stored_occurrences_fall_back(stored, dataset_blob):
+    """Tests that the built-in dataset is used while none is stored."""
+    dataset_blob.download_as_bytes.side_effect = NotFound("missing")
+
+    assert len(stored.get().points) == len(TREE_DISTRIBUTIONS)
+    assert stored.get().version == BUILTIN_VERSION
+
+
+def test_stored_occurrences_are_revalidated(stored, dataset_blob):
+    """Tests that the blob is checked again only after the interval."""
+    first = stored.get()
+    assert stored.get() is first
+    dataset_blob.download_as_bytes.assert_called_once()
+
+    stored._clock.return_value = stored.reload_interval
+    dataset_blob.download_as_bytes.side_effect = NotModified("unchanged")
+    assert stored.get() is first
+    dataset_blob.download_as_bytes.assert_called_with(if_generation_not_match=3)
+
+
+def test_save_uploads_dataset(stored, dataset_blob):
+    """Tests that saved occurrences are uploaded and used."""
+    occurrences = TreeOccurrences.from_records([("Palm", 1, 2)])
+
+    stored.save(occurrences)
+
+    assert stored.get() is occurrences
+    uploaded = dataset_blob.upload_from_string.call_args.args[0]
+    assert TreeOccurrences.from_json(uploaded).points == [(1.0, 2.0, 0)]
@@ -0,0 +1,165 @@
+"""User records stored as JSON, with a short-lived in-process cache.
+
+Every user has one blob, "users/<username>", holding a JSON object with the
+username and the hash of their password. Reading a user is a single
+download, and a missing blob means there is no such user. Creating a user
+is a create-only upload, so two sign-ups for the same name cannot both
+succeed and no existence check is needed first.
+
+Records written before they were stored as JSON hold the repr of a Python
+dict. They are still read, with ast.literal_eval, which only accepts
+literals and never runs code.
+
+Users who were found are kept in memory for a few seconds, so a burst of
+logins for the same user downloads their record once. Users who were not
+found are not cached, so a user created by another process can log in right
+away.
+
+Example:
+    users = UserStore(login_bucket, ttl=30)
+    users.create("ada", {"username": "ada", "hash_pword": "..."})
+    record = users.get("ada")
+    print(users.stats())
+"""
+from collections import OrderedDict, namedtuple
+from google.api_core.exceptions import NotFound, PreconditionFailed
+import ast
+import json
+import threading
+import time
+
+# Seconds a user record is reused before it is downloaded again.
+USER_CACHE_TTL = 30
+
+# The most user records kept in memory.
+USER_CACHE_MAX_ENTRIES = 1024
+
+# User blobs are named with this prefix followed by the username.
+USER_PREFIX = "users/"
+
+_Entry = namedtuple("_Entry", ["record", "expires_at"])
+
+
+def user_blob_name(username):
+    """Returns the name of the blob holding a user's record."""
+    return USER_PREFIX + username
+
+
+def parse_record(data):
+    """Parses a stored user record.
+
+    Args:
+        data (bytes): The blob's content, either JSON or the repr of a dict.
+
+    Returns:
+        dict: The user record.
+
+    Raises:
+        ValueError: If the content is not a user record.
+    """
+    text = data.decode("utf-8")
+    try:
+        record = json.loads(text)
+    except ValueError:
+        # Written as str(dict) before records were JSON.
+        try:
+            record = ast.literal_eval(text)
+        except (ValueError, SyntaxError) as error:
+            raise ValueError("not a user record") from error
+    if not isinstance(record, dict):
+        raise ValueError("not a user record")
+    return record
+
+
+class UserStore:
+    """Reads and creates user records, caching the ones it reads.
+
+    Attributes:
+        bucket (google.cloud.storage.Bucket): The bucket holding the users.
+        ttl (float): Seconds a cached record is reused.
+        max_entries (int): The most records kept in memory.
+        hits (int): Reads answered from the cache.
+        misses (int): Reads that downloaded the record.
+    """
+
+    def __init__(self,
+                 bucket,
+                 ttl=USER_CACHE_TTL,
+                 max_entries=USER_CACHE_MAX_ENTRIES,
+                 clock=time.monotonic):
+        self.bucket = bucket
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, username):
+        """Returns a user's record.
+
+        Args:
+            username (str): The username.
+
+        Returns:
+            dict: The user record, or None if there is no such user.
+        """
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None and self._clock() < entry.expires_at:
+                self.hits += 1
+                self._entries.move_to_end(username)
+                return entry.record
+        try:
+            data = self.bucket.blob(
+                user_blob_name(username)).download_as_bytes()
+        except NotFound:
+            self.invalidate(username)
+            return None
+        record = parse_record(data)
+        with self._lock:
+            self.misses += 1
+        self._store(username, record)
+        return record
+
+    def create(self, username, record):
+        """Stores a new user's record.
+
+        Args:
+            username (str): The username.
+            record (dict): The user record.
+
+        Returns:
+            bool: True if the user was created, False if the user exists.
+        """
+        blob = self.bucket.blob(user_blob_name(username))
+        try:
+            blob.upload_from_string(json.dumps(record, separators=(",", ":")),
+                                    content_type="application/json",
+                                    if_generation_match=0)
+        except PreconditionFailed:
+            return False
+        self._store(username, record)
+        return True
+
+    def invalidate(self, username):
+        """Drops a user's record from the cache."""
+        with self._lock:
+            self._entries.pop(username, None)
+
+    def _store(self, username, record):
+        with self._lock:
+            self._entries[username] = _Entry(record, self._clock() + self.ttl)
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        """Returns the cache counters as a dict."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
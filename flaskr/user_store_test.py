@@ -0,0 +1,98 @@
+"""Tests for the user records in the flaskr application."""
+from flaskr.storage_drivers import CountingDriver, DriverClient, MemoryDriver
+from flaskr.user_store import UserStore, parse_record
+import pytest
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def driver():
+    return CountingDriver(MemoryDriver())
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def users(driver, clock):
+    return UserStore(DriverClient(driver).bucket("users"), ttl=30, clock=clock)
+
+
+def test_create_stores_json(users, driver):
+    assert users.create("ada", {"username": "ada", "hash_pword": "abc"})
+
+    data, info = driver.get("users", "users/ada")
+    assert data == b'{"username":"ada","hash_pword":"abc"}'
+    assert info.content_type == "application/json"
+
+
+def test_create_existing_user(users, driver):
+    users.create("ada", {"username": "ada", "hash_pword": "abc"})
+    driver.reset()
+
+    assert not users.create("ada", {"username": "ada", "hash_pword": "xyz"})
+    assert users.get("ada")["hash_pword"] == "abc"
+    assert driver.stats()["calls"] == {"put": 1}
+
+
+def test_get_is_one_download(users, driver):
+    driver.put("users", "users/ada", b'{"username": "ada", "hash_pword": "a"}')
+
+    assert users.get("ada") == {"username": "ada", "hash_pword": "a"}
+    assert users.get("bob") is None
+    assert driver.stats()["calls"] == {"get": 2, "put": 1}
+
+
+def test_get_reuses_record_until_ttl(users, driver, clock):
+    driver.put("users", "users/ada", b'{"username": "ada", "hash_pword": "a"}')
+    driver.reset()
+
+    for _ in range(5):
+        users.get("ada")
+    clock.now = 31
+    users.get("ada")
+
+    assert driver.stats()["round_trips"] == 2
+    assert users.stats() == {"entries": 1, "hits": 4, "misses": 2}
+
+
+def test_missing_users_are_not_cached(users, driver):
+    assert users.get("ada") is None
+
+    driver.put("users", "users/ada", b'{"username": "ada", "hash_pword": "a"}')
+
+    assert users.get("ada") is not None
+
+
+def test_cache_is_bounded(driver, clock):
+    users = UserStore(DriverClient(driver).bucket("users"),
+                      max_entries=2,
+                      clock=clock)
+    for name in ["ada", "bob", "cy"]:
+        users.create(name, {"username": name, "hash_pword": name})
+
+    assert users.stats()["entries"] == 2
+
+
+def test_parse_legacy_record():
+    assert parse_record(b"{'username': 'ada', 'hash_pword': 'abc'}") == {
+        "username": "ada",
+        "hash_pword": "abc"
+    }
+
+
+@pytest.mark.parametrize(
+    "data", [b"__import__('os').system('true')", b"[1, 2]", b"{", b"null"])
+def test_parse_rejects_non_records(data):
+    with pytest.raises(ValueError):
+        parse_record(data)
@@ -0,0 +1,97 @@
+"""A bounded thread pool for running independent storage calls at once.
+
+Rendering a page needs several round trips to Cloud Storage that do not
+depend on each other, such as the page itself and the list of pages for the
+sidebar. A WorkerPool runs such calls on a fixed number of shared threads so
+a request waits for the slowest call instead of the sum of all of them.
+
+Every call runs in a copy of the caller's context, so context variables set
+for the request, like per-route metrics, are visible to the call. Calls made
+from inside a worker run inline, so nested use cannot exhaust the pool.
+
+Example:
+    workers = WorkerPool(max_workers=8, timeout=10)
+    page, names = workers.gather(lambda: backend.get_wiki_page("Palm"),
+                                 backend.get_all_page_names)
+"""
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import time
+
+# Threads shared by all requests of one process.
+DEFAULT_MAX_WORKERS = 8
+
+# Seconds a request waits for a call before giving up on it.
+DEFAULT_TIMEOUT = 10
+
+_in_worker = contextvars.ContextVar("in_worker", default=False)
+
+
+def _run_in_worker(call):
+    _in_worker.set(True)
+    return call()
+
+
+class WorkerPool:
+    """Runs calls concurrently on a bounded, shared set of threads.
+
+    Attributes:
+        max_workers (int): The most calls that run at the same time.
+        timeout (float): Seconds gather() waits for its calls.
+    """
+
+    def __init__(self,
+                 max_workers=DEFAULT_MAX_WORKERS,
+                 timeout=DEFAULT_TIMEOUT):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix="backend")
+
+    def submit(self, call):
+        """Starts a call on the pool in a copy of the caller's context.
+
+        Args:
+            call (callable): Takes no arguments.
+
+        Returns:
+            concurrent.futures.Future: The call's result.
+        """
+        context = contextvars.copy_context()
+        return self._executor.submit(context.run, _run_in_worker, call)
+
+    def gather(self, *calls, timeout=None):
+        """Runs calls concurrently and returns their results in order.
+
+        Args:
+            *calls (callable): Take no arguments.
+            timeout (float): Seconds to wait for all of the calls; defaults
+                to the pool's timeout.
+
+        Returns:
+            list: The result of each call.
+
+        Raises:
+            concurrent.futures.TimeoutError: If a call did not finish in
+                time. Calls that have not started are cancelled.
+            Exception: The first exception raised by a call.
+        """
+        if _in_worker.get() or len(calls) < 2:
+            return [call() for call in calls]
+        if timeout is None:
+            timeout = self.timeout
+        deadline = time.monotonic() + timeout
+        futures = [self.submit(call) for call in calls]
+        try:
+            return [
+                future.result(timeout=max(0, deadline - time.monotonic()))
+                for future in futures
+            ]
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    def shutdown(self):
+        """Stops the threads once the calls already started have finished."""
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,64 @@
+"""Tests for the WorkerPool class in the flaskr application."""
+from concurrent.futures import TimeoutError
+from flaskr.worker_pool import WorkerPool
+import contextvars
+import pytest
+import threading
+
+request_name = contextvars.ContextVar("request_name", default=None)
+
+
+@pytest.fixture
+def workers():
+    pool = WorkerPool(max_workers=2, timeout=1)
+    yield pool
+    pool.shutdown()
+
+
+def test_gather_returns_results_in_order(workers):
+    """Tests that results are returned in the order of the calls."""
+    assert workers.gather(lambda: 1, lambda: 2, lambda: 3) == [1, 2, 3]
+
+
+def test_gather_runs_calls_concurrently(workers):
+    """Tests that two calls run at the same time."""
+    barrier = threading.Barrier(2, timeout=1)
+
+    assert workers.gather(barrier.wait, barrier.wait) in ([0, 1], [1, 0])
+
+
+def test_gather_raises_call_exception(workers):
+    """Tests that an exception in a call reaches the caller."""
+
+    def fail():
+        raise ValueError("broken")
+
+    with pytest.raises(ValueError):
+        workers.gather(lambda: 1, fail)
+
+
+def test_gather_times_out(workers):
+    """Tests that a slow call raises TimeoutError after the timeout."""
+    release = threading.Event()
+    try:
+        with pytest.raises(TimeoutError):
+            workers.gather(lambda: 1, release.wait, timeout=0.05)
+    finally:
+        release.set()
+
+
+def test_calls_see_caller_context(workers):
+    """Tests that calls run in a copy of the caller's context."""
+    request_name.set("page")
+
+    assert workers.gather(request_name.get,
+                          request_name.get) == ["page", "page"]
+
+
+def test_nested_gather_runs_inline(workers):
+    """Tests that gathering from a worker cannot deadlock a full pool."""
+
+    def nested():
+        return workers.gather(lambda: "a", lambda: "b")
+
+    assert workers.gather(nested, nested) == [["a", "b"], ["a", "b"]]
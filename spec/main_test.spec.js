@@ -2,7 +2,8 @@
  * Test suite for the JavaScript functions used in the Wiki application.
  *
  * This test suite covers the following functions:
- *  - toggleEditor(): Toggles the visibility of the TinyMCE editor and initializes/destroys it accordingly.
+ *  - toggleEditor(): Toggles the visibility of the TinyMCE editor, fetching the page source the first time,
+ *    and initializes/destroys it accordingly.
  *  - toggleForm(): Toggles the visibility of the form container and adjusts the layout.
  *  - toggleSave(): Toggles the visibility of the save button container.
  *  - togglePage(): Toggles the visibility of the page data container and updates the toggle button.
@@ -18,6 +19,7 @@
  * 1. 'toggleEditor()':
  *     - Verify that the editor's visibility is toggled ON and the TinyMCE editor is initialized.
  *     - Verify that the editor's visibility is toggled OFF and the TinyMCE editor is destroyed.
+ *     - Verify that the page source is fetched into the editor when it is first opened.
  *
  * 2. 'toggleForm()':
  *     - Verify that the form's visibility is toggled OFF and the layout is adjusted accordingly.
@@ -41,6 +43,14 @@
  *
  * 7. 'uploadPageFromEditor()':
  *     - Verify that the content from the TinyMCE editor is uploaded to the server by submitting the form.
+ *
+ * 8. Page drawer:
+ *     - Verify that the page list URL carries the prefix, cursor and limit.
+ *     - Verify that only the rows in view, and a few around them, are drawn.
+ *     - Verify that batches are loaded with the cursor of the previous batch until enough names are loaded.
+ *     - Verify that filtering starts over and drops batches of the previous filter.
+ *     - Verify that the drawer draws the server-rendered first batch without requesting it again.
+ *     - Verify that a hidden drawer keeps its server-rendered rows and draws the rows in view once shown.
  */
 describe("Toggle Functions", function() {
     describe("toggleEditor()", function() {
@@ -89,6 +99,20 @@ describe("Toggle Functions", function() {
             expect(editorContainer.style.display).toEqual("none");
             expect(tinymce).toBeFalsy;
         });
+
+        it("fetches the page source into the editor when it is first opened", async function() {
+            editorContainer.style.display = "none";
+            editorContainer.dataset.sourceUrl = "/pages/Palm/source";
+            spyOn(window, "fetch").and.returnValue(Promise.resolve(new Response("<p>Palm</p>")));
+            spyOn(tinymce, "init");
+
+            await toggleEditor();
+
+            expect(window.fetch).toHaveBeenCalledOnceWith("/pages/Palm/source");
+            expect(myTextarea.value).toEqual("<p>Palm</p>");
+            expect(tinymce.init).toHaveBeenCalled();
+            expect(editorContainer.dataset.sourceUrl).toBeUndefined();
+        });
     });
 
     describe("toggleForm()", function() {
@@ -332,3 +356,126 @@ describe("Upload Function - uploadPageFromEditor()", function() {
     });
 });
 
+
+describe("Page Drawer", function() {
+    function batch(pages, next, total) {
+        return Promise.resolve({pages: pages, next: next, total: total, version: 1});
+    }
+
+    it("builds the page list URL", function() {
+        expect(pageListUrl("/api/pages", "", null, 100)).toEqual("/api/pages?limit=100");
+        expect(pageListUrl("/api/pages", "Live O", "Ginko", 50))
+            .toEqual("/api/pages?prefix=Live+O&cursor=Ginko&limit=50");
+    });
+
+    it("draws the rows in view and a few around them", function() {
+        expect(visibleRows(0, 600, 1000)).toEqual({start: 0, end: 20});
+        expect(visibleRows(6000, 600, 1000)).toEqual({start: 90, end: 120});
+        expect(visibleRows(59700, 600, 1000)).toEqual({start: 985, end: 1000});
+        expect(visibleRows(0, 600, 0)).toEqual({start: 0, end: 0});
+    });
+
+    it("loads batches after the previous one until enough names are loaded", async function() {
+        const fetchJson = jasmine.createSpy("fetchJson").and.returnValues(
+            batch(["Live Oak", "Palm"], "Palm", 5), batch(["Palmetto"], null, 5));
+        const pageList = createPageList("/api/pages", fetchJson);
+        pageList.seed(["Coast Redwood", "Ginko"], 5, "Ginko");
+
+        await pageList.ensure(5);
+
+        expect(fetchJson.calls.allArgs()).toEqual([
+            ["/api/pages?cursor=Ginko&limit=100"],
+            ["/api/pages?cursor=Palm&limit=100"]
+        ]);
+        expect(pageList.state().names).toEqual(["Coast Redwood", "Ginko", "Live Oak", "Palm", "Palmetto"]);
+        expect(pageList.state().next).toBeNull();
+    });
+
+    it("does not request batches that are already loaded", async function() {
+        const fetchJson = jasmine.createSpy("fetchJson");
+        const pageList = createPageList("/api/pages", fetchJson);
+        pageList.seed(["Coast Redwood", "Ginko"], 2, "");
+
+        await pageList.ensure(20);
+
+        expect(fetchJson).not.toHaveBeenCalled();
+    });
+
+    it("starts over when filtered and drops batches of the previous filter", async function() {
+        let finishOld;
+        const fetchJson = jasmine.createSpy("fetchJson").and.returnValues(
+            new Promise(function(resolve) {
+                finishOld = resolve;
+            }),
+            batch(["Palm", "Palmetto"], null, 2));
+        const pageList = createPageList("/api/pages", fetchJson);
+        pageList.seed(["Coast Redwood"], 3, "Coast Redwood");
+
+        const loading = pageList.ensure(3);
+        await pageList.filter("pal");
+        finishOld({pages: ["Ginko", "Live Oak"], next: null, total: 3});
+        await loading;
+
+        expect(fetchJson.calls.mostRecent().args).toEqual(["/api/pages?prefix=pal&limit=100"]);
+        expect(pageList.state().names).toEqual(["Palm", "Palmetto"]);
+        expect(pageList.state().total).toEqual(2);
+    });
+
+    describe("initPageDrawer()", function() {
+        let container, list;
+
+        beforeEach(function() {
+            container = document.createElement("div");
+            container.style.height = "300px";
+            container.style.overflowY = "auto";
+            container.dataset.pagesUrl = "/api/pages";
+            container.dataset.total = "1000";
+            container.dataset.next = "Page 1";
+            list = document.createElement("ul");
+            list.innerHTML = '<li><a href="/pages/Page 0"> Page 0 </a></li><li><a href="/pages/Page 1"> Page 1 </a></li>';
+            container.appendChild(list);
+            document.body.appendChild(container);
+        });
+
+        afterEach(function() {
+            document.body.removeChild(container);
+        });
+
+        it("draws the first batch and makes the list as tall as every page", function() {
+            const fetchJson = jasmine.createSpy("fetchJson").and.returnValue(new Promise(function() {}));
+
+            const pageList = initPageDrawer(container, null, fetchJson);
+
+            expect(pageList.state().names).toEqual(["Page 0", "Page 1"]);
+            expect(list.style.height).toEqual("60000px");
+            expect(list.querySelectorAll("li").length).toEqual(2);
+            expect(list.querySelectorAll("li")[1].style.top).toEqual("60px");
+            expect(list.querySelector("a").getAttribute("href")).toEqual("/pages/Page%200");
+            // The rows in view are past the first batch, so the next one is requested
+            expect(fetchJson).toHaveBeenCalledWith("/api/pages?cursor=Page+1&limit=100");
+        });
+
+        it("keeps the server-rendered rows while the drawer is hidden and draws them once it is shown", async function() {
+            const fetchJson = jasmine.createSpy("fetchJson").and.returnValue(new Promise(function() {}));
+            container.style.display = "none";
+
+            initPageDrawer(container, null, fetchJson);
+
+            expect(list.querySelectorAll("li").length).toEqual(2);
+            expect(list.querySelector("li").style.position).toEqual("");
+            expect(fetchJson).not.toHaveBeenCalled();
+
+            container.style.display = "block";
+            await new Promise(function(resolve) {
+                setTimeout(resolve, 100);
+            });
+
+            expect(list.style.height).toEqual("60000px");
+            expect(fetchJson).toHaveBeenCalledWith("/api/pages?cursor=Page+1&limit=100");
+        });
+
+        it("returns null without a drawer", function() {
+            expect(initPageDrawer(null, null, function() {})).toBeNull();
+        });
+    });
+});
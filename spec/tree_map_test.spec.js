@@ -4,6 +4,9 @@
  * This test suite covers the following functions:
  *  - myFunction(): Sets a timeout to call showPage() function after 3000 milliseconds.
  *  - showPage(): Hides the loader and shows the map container after the specified delay.
+ *  - tilesForBounds() and tileBbox(): Split the map into the tiles that clusters are requested for.
+ *  - createClusterLoader(): Requests the clusters of each tile only once per zoom level.
+ *  - parseSpecies() and renderLegend(): Read the compact species feed and draw the legend.
  *
  * Each function is tested using the Jasmine testing framework, with beforeEach and afterEach hooks
  * to set up and clean up the required DOM elements for each test case.
@@ -15,6 +18,14 @@
  *
  * 2. 'showPage()':
  *     - Verify that the loader is hidden and the map container is shown after the specified delay.
+ *
+ * 3. 'Cluster tiles':
+ *     - Verify that tiles cover the view, wrap around the antimeridian and match the server's grid.
+ *     - Verify that a tile is only requested again after its request failed.
+ *     - Verify that a changed tree dataset is reported once.
+ *
+ * 4. 'Species feed':
+ *     - Verify that compact species are expanded and listed in the legend.
  */
 describe("Tree Map Functions", function () {
     let loader, myDiv;
@@ -64,4 +75,107 @@ describe("Tree Map Functions", function () {
             expect(myDiv.style.display).toEqual("block");
         });
     });
+
+    describe("Cluster tiles", function () {
+        it("covers the bounds with tiles", function () {
+            const tiles = tilesForBounds({west: -100, south: 20, east: -80, north: 40}, 3);
+
+            expect(tileSize(3)).toEqual(45);
+            expect(tiles).toEqual([{x: 1, y: 2}, {x: 2, y: 2}]);
+        });
+
+        it("wraps tiles around the antimeridian", function () {
+            const tiles = tilesForBounds({west: 170, south: 0, east: 190, north: 10}, 2);
+
+            expect(tiles).toEqual([{x: 3, y: 1}, {x: 0, y: 1}]);
+        });
+
+        it("requests each column once when the whole world is in view", function () {
+            const tiles = tilesForBounds({west: -400, south: -90, east: 400, north: 90}, 1);
+
+            expect(tiles.length).toEqual(2);
+        });
+
+        it("gives the edges of a tile", function () {
+            expect(tileBbox({x: 1, y: 2}, 3)).toEqual([-135, 0, -90, 45]);
+            expect(tileBbox({x: 0, y: 0}, 0)).toEqual([-180, -90, 180, 90]);
+        });
+
+        it("builds the clusters URL", function () {
+            expect(clustersUrl("/map/clusters", [-135, 0, -90, 45], 3, "17"))
+                .toEqual("/map/clusters?bbox=-135,0,-90,45&zoom=3&v=17");
+        });
+
+        it("requests each tile once per zoom level", function () {
+            const loader = createClusterLoader("/map/clusters", "17", function () {});
+            const bounds = {west: -100, south: 20, east: -80, north: 40};
+
+            expect(loader.missingTiles(bounds, 3).length).toEqual(2);
+            expect(loader.missingTiles(bounds, 3).length).toEqual(0);
+            expect(loader.missingTiles(bounds, 4).length).toBeGreaterThan(0);
+        });
+
+        it("passes the clusters of each tile on", async function () {
+            const fetchJson = jasmine.createSpy("fetchJson").and.returnValue(
+                Promise.resolve({version: "17", clusters: [[30, -90, 2, null], [31, -91, 1, 4]]}));
+            const onClusters = jasmine.createSpy("onClusters");
+            const loader = createClusterLoader("/map/clusters", "17", fetchJson);
+
+            loader.load({west: -100, south: 20, east: -95, north: 25}, 3, onClusters);
+            await Promise.resolve();
+            await Promise.resolve();
+
+            expect(fetchJson).toHaveBeenCalledWith("/map/clusters?bbox=-135,0,-90,45&zoom=3&v=17");
+            expect(onClusters).toHaveBeenCalledWith([
+                {lat: 30, lng: -90, count: 2, species: null},
+                {lat: 31, lng: -91, count: 1, species: 4}
+            ], 3);
+        });
+
+        it("reports a changed tree dataset once", async function () {
+            const error = new Error("Conflict");
+            error.status = 409;
+            const fetchJson = jasmine.createSpy("fetchJson").and.returnValue(Promise.reject(error));
+            const onStale = jasmine.createSpy("onStale");
+            const loader = createClusterLoader("/map/clusters", "17", fetchJson, onStale);
+
+            loader.load({west: -100, south: 20, east: -80, north: 40}, 3, function () {});
+            await Promise.resolve();
+            await Promise.resolve();
+
+            expect(fetchJson).toHaveBeenCalledTimes(2);
+            expect(onStale).toHaveBeenCalledTimes(1);
+        });
+
+        it("grows clusters with their tree count", function () {
+            expect(clusterRadius(1)).toEqual(6);
+            expect(clusterRadius(100)).toBeGreaterThan(clusterRadius(10));
+            expect(clusterRadius(1000000)).toEqual(30);
+        });
+    });
+
+    describe("Species feed", function () {
+        let legend;
+
+        beforeEach(function () {
+            legend = document.createElement("ul");
+        });
+
+        it("expands compact species", function () {
+            const species = parseSpecies({version: "17", species: [["Palm", "Americas", "pink"]]});
+
+            expect(species).toEqual([{name: "Palm", distribution: "Americas", color: "pink"}]);
+        });
+
+        it("lists every species in the legend", function () {
+            renderLegend(legend, [
+                {name: "Palm", distribution: "Americas", color: "pink"},
+                {name: "Ginko", distribution: "Asia", color: "red"}
+            ]);
+
+            expect(legend.children.length).toEqual(2);
+            expect(legend.children[0].textContent).toEqual("Palm");
+            expect(legend.children[1].firstChild.style.backgroundColor).toEqual("red");
+        });
+    });
 });
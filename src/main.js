@@ -1,13 +1,47 @@
 /**
  * @fileoverview This script contains a collection of functions that provide various functionalities for a web
  * application. These functions are responsible for toggling the editor, forms, uploads, and drawers on the page,
- * managing unsaved changes, handling the drawer's state, and adjusting margins for wiki pages.
+ * managing unsaved changes, handling the drawer's state, and adjusting margins for wiki pages. The page drawer
+ * draws only the pages in view and loads more from the page list API as the user scrolls or filters it.
  */
 
 (function() {
+    function initEditor() {
+        /**
+         * Initialize the TinyMCE editor on the page's textarea.
+         */
+        tinymce.init({
+            height: 1000,
+            selector: "#myTextarea",
+            plugins: "anchor autolink charmap codesample image link lists media searchreplace table visualblocks wordcount",
+            toolbar: "export | undo redo | blocks fontfamily fontsize | bold italic underline strikethrough | link image media table | addcomment showcomments | spellcheckdialog a11ycheck | align lineheight | checklist numlist bullist indent outdent | emoticons charmap | removeformat",
+            setup: function (editor) {
+                // Save initial content
+                var initialContent = editor.getContent();
+            
+                // Add event listener for beforeunload event
+                window.addEventListener("beforeunload", handler, false);
+                window.addEventListener("click", handler, false);
+
+                function handler(event) {
+                    // Check if content has been changed
+                    if (initialContent !== editor.getContent()) {
+                        // Display confirmation dialog
+                        var confirmationMessage = "You have unsaved changes. Do you want to save them?";
+                        (event || window.event).returnValue = confirmationMessage;
+                        return confirmationMessage;
+                    }
+                };
+            }
+        });
+    }
+
     function toggleEditor() {
         /**
          * Toggle the editor's visibility and initialize or remove TinyMCE editor accordingly.
+         * The page's source is only sent with the page when it is needed, so it is fetched from the
+         * editor container's data-source-url when the editor is first opened.
+         * @return {Promise} Resolves once the editor is initialized or removed.
          */
         // Get the editor container element
         var editorContainer = document.getElementById("editor-container");
@@ -16,34 +50,34 @@
         if (editorContainer.style.display === "none") {
             // If not displayed, display the container and initialize the TinyMCE editor
             editorContainer.style.display = "block";
-            tinymce.init({
-                height: 1000,
-                selector: "#myTextarea",
-                plugins: "anchor autolink charmap codesample image link lists media searchreplace table visualblocks wordcount",
-                toolbar: "export | undo redo | blocks fontfamily fontsize | bold italic underline strikethrough | link image media table | addcomment showcomments | spellcheckdialog a11ycheck | align lineheight | checklist numlist bullist indent outdent | emoticons charmap | removeformat",
-                setup: function (editor) {
-                    // Save initial content
-                    var initialContent = editor.getContent();
-                
-                    // Add event listener for beforeunload event
-                    window.addEventListener("beforeunload", handler, false);
-                    window.addEventListener("click", handler, false);
-
-                    function handler(event) {
-                        // Check if content has been changed
-                        if (initialContent !== editor.getContent()) {
-                            // Display confirmation dialog
-                            var confirmationMessage = "You have unsaved changes. Do you want to save them?";
-                            (event || window.event).returnValue = confirmationMessage;
-                            return confirmationMessage;
-                        }
-                    };
+            var sourceUrl = editorContainer.dataset.sourceUrl;
+            if (!sourceUrl) {
+                initEditor();
+                return Promise.resolve();
+            }
+            return fetch(sourceUrl).then(function(response) {
+                if (!response.ok) {
+                    throw new Error(response.statusText);
+                }
+                return response.text();
+            }).then(function(source) {
+                // The source is only fetched once, the first time the editor is opened
+                delete editorContainer.dataset.sourceUrl;
+                document.getElementById("myTextarea").value = source;
+                // The editor may have been closed while the source was loading
+                if (editorContainer.style.display === "block") {
+                    initEditor();
                 }
+            }).catch(function() {
+                alert("Sorry! The page could not be loaded for editing :(");
+                // Go back to the page, as the back button does
+                location.reload();
             });
         } else {
             // If displayed, hide the container and remove the TinyMCE editor
             editorContainer.style.display = "none";
             tinymce.remove();
+            return Promise.resolve();
         }
     }
 
@@ -162,8 +196,247 @@
         }
     }
 
+    /**
+     * The height of a row of the page drawer, as set for ".page-drawer li" in main.css.
+     */
+    var PAGE_ROW_HEIGHT = 60;
+
+    /**
+     * Rows drawn above and below the ones in view, so that scrolling does not show gaps.
+     */
+    var PAGE_LIST_OVERSCAN = 10;
+
+    /**
+     * Page names requested from the page list API at a time.
+     */
+    var PAGE_LIST_BATCH = 100;
+
+    /**
+     * Milliseconds to wait after the user stops typing in the page filter before filtering.
+     */
+    var PAGE_FILTER_DELAY = 200;
+
+    function pageListUrl(url, prefix, cursor, limit) {
+        /**
+         * Build the URL of a batch of page names.
+         * @param {string} url - The page list endpoint.
+         * @param {string} prefix - Only pages starting with this are listed.
+         * @param {string} cursor - The "next" cursor of the previous batch, or null for the first batch.
+         * @param {number} limit - The most page names to return.
+         * @return {string} The URL to request.
+         */
+        var params = new URLSearchParams();
+        if (prefix) {
+            params.set("prefix", prefix);
+        }
+        if (cursor) {
+            params.set("cursor", cursor);
+        }
+        params.set("limit", limit);
+        return url + "?" + params.toString();
+    }
+
+    function visibleRows(scrollTop, viewHeight, total) {
+        /**
+         * Get the rows of the page drawer that are in view, with some extra rows around them.
+         * @param {number} scrollTop - How far the list is scrolled, in pixels.
+         * @param {number} viewHeight - The height of the list's viewport, in pixels.
+         * @param {number} total - The number of rows in the list.
+         * @return {Object} The index of the first row to draw and the index after the last.
+         */
+        var start = Math.max(0, Math.floor(scrollTop / PAGE_ROW_HEIGHT) - PAGE_LIST_OVERSCAN);
+        var end = Math.min(total, Math.ceil((scrollTop + viewHeight) / PAGE_ROW_HEIGHT) + PAGE_LIST_OVERSCAN);
+        return {start: start, end: Math.max(start, end)};
+    }
+
+    function fetchJson(url) {
+        /**
+         * Request a URL and parse the JSON response. The browser revalidates cached responses with their ETag.
+         * @param {string} url - The URL to request.
+         * @return {Promise<Object>} The response, or an error with the HTTP status if the request failed.
+         */
+        return fetch(url).then(function(response) {
+            if (!response.ok) {
+                var error = new Error(response.statusText);
+                error.status = response.status;
+                throw error;
+            }
+            return response.json();
+        });
+    }
+
+    function createPageList(url, fetchJson) {
+        /**
+         * Create a list of page names that loads batches from the page list API as they are needed.
+         * @param {string} url - The page list endpoint.
+         * @param {function(string): Promise<Object>} fetchJson - Requests a URL and parses the JSON response.
+         * @return {Object} The list.
+         */
+        var state = {prefix: "", names: [], total: 0, next: null};
+        // Changes whenever the list is filtered, so batches of an older filter are dropped
+        var generation = 0;
+        var request = null;
+
+        function seed(names, total, next) {
+            /**
+             * Start from the first batch, as rendered by the server.
+             */
+            state = {prefix: "", names: names.slice(), total: total, next: next || null};
+        }
+
+        function loadBatch(cursor) {
+            var batchGeneration = generation;
+            request = fetchJson(pageListUrl(url, state.prefix, cursor, PAGE_LIST_BATCH))
+                .then(function(data) {
+                    if (batchGeneration !== generation) {
+                        return;
+                    }
+                    state.names = state.names.concat(data.pages);
+                    state.total = data.total;
+                    state.next = data.next;
+                })
+                .finally(function() {
+                    if (batchGeneration === generation) {
+                        request = null;
+                    }
+                });
+            return request;
+        }
+
+        function filter(prefix) {
+            /**
+             * Start over with the pages starting with a prefix, and load their first batch.
+             * @return {Promise} Resolves once the first batch is loaded.
+             */
+            generation += 1;
+            state = {prefix: prefix, names: [], total: 0, next: null};
+            return loadBatch(null);
+        }
+
+        function ensure(count) {
+            /**
+             * Load batches until at least count names are loaded, or every name is.
+             * @return {Promise} Resolves once the names are loaded.
+             */
+            if (state.names.length >= count || state.next === null) {
+                return Promise.resolve();
+            }
+            var batchGeneration = generation;
+            var loading = request || loadBatch(state.next);
+            return loading.then(function() {
+                if (batchGeneration === generation) {
+                    return ensure(count);
+                }
+            });
+        }
+
+        return {
+            seed: seed,
+            filter: filter,
+            ensure: ensure,
+            state: function() {
+                return state;
+            }
+        };
+    }
+
+    function renderPageRows(list, names, total, rows) {
+        /**
+         * Draw only the given rows of the page drawer, each at its place in a list as tall as every row.
+         * @param {HTMLElement} list - The list to draw the rows in.
+         * @param {Array<string>} names - The page names loaded so far.
+         * @param {number} total - The number of pages in the list.
+         * @param {Object} rows - The first row to draw and the row after the last, from visibleRows().
+         */
+        var fragment = document.createDocumentFragment();
+        var end = Math.min(rows.end, names.length);
+
+        for (var i = rows.start; i < end; i++) {
+            var item = document.createElement("li");
+            var link = document.createElement("a");
+            item.style.position = "absolute";
+            item.style.top = (i * PAGE_ROW_HEIGHT) + "px";
+            item.style.width = "100%";
+            link.href = "/pages/" + encodeURIComponent(names[i]);
+            link.textContent = " " + names[i] + " ";
+            item.appendChild(link);
+            fragment.appendChild(item);
+        }
+        list.style.height = (total * PAGE_ROW_HEIGHT) + "px";
+        list.replaceChildren(fragment);
+    }
+
+    function initPageDrawer(container, filterInput, fetchJson) {
+        /**
+         * Draw the page drawer's rows as they scroll into view, loading more pages and filtering them on demand.
+         * @param {HTMLElement} container - The scrolling element around the list, with the page list endpoint,
+         *     the number of pages and the cursor after the first batch in data-pages-url, data-total and data-next.
+         * @param {HTMLInputElement} filterInput - The field to filter the pages by.
+         * @param {function(string): Promise<Object>} fetchJson - Requests a URL and parses the JSON response.
+         * @return {Object} The page list, or null if there is no drawer.
+         */
+        if (!container) {
+            return null;
+        }
+        var list = container.querySelector("ul");
+        var pageList = createPageList(container.dataset.pagesUrl, fetchJson);
+        var names = Array.prototype.map.call(list.querySelectorAll("a"), function(link) {
+            return link.textContent.trim();
+        });
+        pageList.seed(names, Number(container.dataset.total), container.dataset.next);
+
+        var frame = null;
+        var timer = null;
+
+        function refresh() {
+            // A hidden drawer has no height, so the rows the server rendered are kept until it is shown
+            if (container.clientHeight === 0) {
+                return;
+            }
+            var state = pageList.state();
+            var rows = visibleRows(container.scrollTop, container.clientHeight, state.total);
+            renderPageRows(list, state.names, state.total, rows);
+            if (rows.end > state.names.length && state.next !== null) {
+                // Failed batches are requested again on the next scroll
+                pageList.ensure(rows.end).then(refresh, function() {});
+            }
+        }
+
+        container.addEventListener("scroll", function() {
+            if (frame === null) {
+                frame = window.requestAnimationFrame(function() {
+                    frame = null;
+                    refresh();
+                });
+            }
+        });
+        if (filterInput) {
+            filterInput.addEventListener("input", function() {
+                clearTimeout(timer);
+                timer = setTimeout(function() {
+                    container.scrollTop = 0;
+                    pageList.filter(filterInput.value.trim()).then(refresh, function() {});
+                }, PAGE_FILTER_DELAY);
+            });
+        }
+        // Draw the rows in view whenever the drawer is shown or resized
+        if (typeof ResizeObserver !== "undefined") {
+            new ResizeObserver(refresh).observe(container);
+        }
+        refresh();
+        return pageList;
+    }
+
     // Event listeners
 
+    document.addEventListener("DOMContentLoaded", function() {
+        /**
+         * Draw the page drawer's list lazily; only the first batch of pages comes with the page.
+         */
+        initPageDrawer(document.getElementById("pageList"), document.getElementById("pageFilter"), fetchJson);
+    });
+
+
     document.addEventListener("DOMContentLoaded", function() {
         /**
          * Set the drawer's display state based on the unique-element attribute and sessionStorage value.
@@ -232,4 +505,9 @@
     window.uploadPageFromEditor = uploadPageFromEditor;
     window.toggleDrawer = toggleDrawer;
     window.toggleWikiPageMargin = toggleWikiPageMargin;
+    window.pageListUrl = pageListUrl;
+    window.visibleRows = visibleRows;
+    window.createPageList = createPageList;
+    window.renderPageRows = renderPageRows;
+    window.initPageDrawer = initPageDrawer;
 })();
@@ -1,6 +1,8 @@
 /**
  * @fileoverview This script provides functionality for displaying a tree distribution map on a web page.
- * It includes a loader and a function to show the map after a specified delay.
+ * It includes a loader and a function to show the map after a specified delay, and draws the map with
+ * Leaflet. The species and legend come from a small JSON feed, and trees are requested from the server
+ * as clusters, one map tile at a time, so only the tiles the user pans or zooms to are ever downloaded.
  */
 
 (function() {
@@ -10,6 +12,18 @@
      */
     let myVar;
 
+    /**
+     * Where the map starts and how far it is zoomed in.
+     */
+    const MAP_CENTER = [39.8283, -98.5795];
+    const MAP_ZOOM = 5;
+    const MAX_ZOOM = 18;
+
+    /**
+     * The color of clusters holding trees of several species.
+     */
+    const MIXED_CLUSTER_COLOR = "#43483e";
+
     /**
      * Set a timeout to delay showing the map.
      */
@@ -28,8 +42,325 @@
 
             // Show the map container (myDiv) element
             document.getElementById('myDiv').style.display = 'block';
+
+            // Leaflet measures the map while it is hidden, so measure it again
+            if (window.treeMap) {
+                window.treeMap.invalidateSize();
+            }
+        }
+    }
+
+    /**
+     * Get the width in degrees of a map tile. The server clusters trees on a grid aligned with these tiles.
+     * @param {number} zoom - The map zoom level.
+     * @returns {number} The width and height of a tile in degrees.
+     */
+    function tileSize(zoom) {
+        return 360 / Math.pow(2, zoom);
+    }
+
+    /**
+     * Get the tiles that cover the given bounds.
+     * @param {Object} bounds - The west, south, east and north edges in degrees.
+     * @param {number} zoom - The map zoom level.
+     * @returns {Array<Object>} The x (west to east) and y (south to north) index of every tile.
+     */
+    function tilesForBounds(bounds, zoom) {
+        const size = tileSize(zoom);
+        const columns = Math.pow(2, zoom);
+        const rows = Math.max(1, columns / 2);
+        const firstRow = Math.max(0, Math.floor((bounds.south + 90) / size));
+        const lastRow = Math.min(rows - 1, Math.floor((bounds.north + 90) / size));
+        let firstColumn = Math.floor((bounds.west + 180) / size);
+        let lastColumn = Math.floor((bounds.east + 180) / size);
+        if (lastColumn - firstColumn >= columns) {
+            // The view shows the whole world, so every column is needed once
+            firstColumn = 0;
+            lastColumn = columns - 1;
+        }
+
+        const tiles = [];
+        for (let y = firstRow; y <= lastRow; y++) {
+            for (let x = firstColumn; x <= lastColumn; x++) {
+                // Views panned past the antimeridian wrap around
+                tiles.push({x: ((x % columns) + columns) % columns, y: y});
+            }
         }
+        return tiles;
+    }
+
+    /**
+     * Get the edges of a tile.
+     * @param {Object} tile - The x and y index of the tile.
+     * @param {number} zoom - The map zoom level.
+     * @returns {Array<number>} The west, south, east and north edges in degrees.
+     */
+    function tileBbox(tile, zoom) {
+        const size = tileSize(zoom);
+        const west = tile.x * size - 180;
+        const south = tile.y * size - 90;
+        return [west, south, west + size, Math.min(90, south + size)];
+    }
+
+    /**
+     * Build the URL of the clusters in a bounding box.
+     * @param {string} url - The clusters endpoint.
+     * @param {Array<number>} bbox - The west, south, east and north edges in degrees.
+     * @param {number} zoom - The map zoom level.
+     * @param {string} version - The version of the tree dataset the species were read from.
+     * @returns {string} The URL to request.
+     */
+    function clustersUrl(url, bbox, zoom, version) {
+        return url + "?bbox=" + bbox.join(",") + "&zoom=" + zoom + "&v=" + encodeURIComponent(version);
+    }
+
+    /**
+     * Expand a cluster from the compact clusters feed.
+     * @param {Array} row - The latitude, longitude, tree count and species index of the cluster.
+     * @returns {Object} The cluster, with a species index of null if it holds several species.
+     */
+    function parseCluster(row) {
+        return {lat: row[0], lng: row[1], count: row[2], species: row[3]};
     }
+
+    /**
+     * Expand the species from the compact species feed.
+     * @param {Object} data - The species feed, with each species as [name, distribution, color].
+     * @returns {Array<Object>} The species, in the order clusters refer to them.
+     */
+    function parseSpecies(data) {
+        return data.species.map(function(row) {
+            return {name: row[0], distribution: row[1], color: row[2]};
+        });
+    }
+
+    /**
+     * Fill the legend with a colored entry for every species.
+     * @param {HTMLElement} legend - The list to fill.
+     * @param {Array<Object>} species - The species from parseSpecies().
+     */
+    function renderLegend(legend, species) {
+        legend.replaceChildren();
+        species.forEach(function(tree) {
+            const item = document.createElement("li");
+            const swatch = document.createElement("i");
+            swatch.className = "tree-map-swatch";
+            swatch.style.backgroundColor = tree.color;
+            item.append(swatch, tree.name);
+            legend.appendChild(item);
+        });
+    }
+
+    /**
+     * Create a loader that requests the clusters of every tile at most once per zoom level.
+     * @param {string} url - The clusters endpoint.
+     * @param {string} version - The version of the tree dataset the species were read from.
+     * @param {function(string): Promise<Object>} fetchJson - Requests a URL and parses the JSON response.
+     *     Failed requests reject with an error whose status is the HTTP status.
+     * @param {function()} onStale - Called when the tree dataset no longer has the given version.
+     * @returns {Object} The loader.
+     */
+    function createClusterLoader(url, version, fetchJson, onStale) {
+        const loaded = new Set();
+        let stale = false;
+
+        /**
+         * Get the tiles in the bounds that have not been requested yet, and remember them as requested.
+         */
+        function missingTiles(bounds, zoom) {
+            return tilesForBounds(bounds, zoom).filter(function(tile) {
+                const key = zoom + "/" + tile.x + "/" + tile.y;
+                if (loaded.has(key)) {
+                    return false;
+                }
+                loaded.add(key);
+                return true;
+            });
+        }
+
+        /**
+         * Request the clusters of the tiles in the bounds that have not been requested yet.
+         */
+        function load(bounds, zoom, onClusters) {
+            missingTiles(bounds, zoom).forEach(function(tile) {
+                fetchJson(clustersUrl(url, tileBbox(tile, zoom), zoom, version))
+                    .then(function(data) {
+                        onClusters(data.clusters.map(parseCluster), zoom);
+                    })
+                    .catch(function(error) {
+                        if (error.status === 409) {
+                            // Every tile in flight fails the same way, so only report it once
+                            if (!stale && onStale) {
+                                stale = true;
+                                onStale();
+                            }
+                            return;
+                        }
+                        // Try the tile again the next time it is in view
+                        loaded.delete(zoom + "/" + tile.x + "/" + tile.y);
+                    });
+            });
+        }
+
+        return {missingTiles: missingTiles, load: load};
+    }
+
+    /**
+     * Get the radius of a cluster's circle, which grows slowly with the number of trees in it.
+     * @param {number} count - The number of trees in the cluster.
+     * @returns {number} The radius in pixels.
+     */
+    function clusterRadius(count) {
+        return Math.min(30, 6 + 6 * Math.log10(count));
+    }
+
+    /**
+     * Build the popup of a single tree, linking to the tree's page.
+     * @param {Object} tree - The species' name and distribution.
+     * @returns {HTMLElement} The popup content.
+     */
+    function treePopup(tree) {
+        const popup = document.createElement("div");
+        const title = document.createElement("b");
+        title.textContent = tree.name;
+        const distribution = document.createElement("p");
+        distribution.textContent = "Distribution: " + tree.distribution;
+        const link = document.createElement("a");
+        link.href = "/pages/" + encodeURIComponent(tree.name);
+        link.textContent = "Learn More";
+        popup.append(title, distribution, link);
+        return popup;
+    }
+
+    /**
+     * Create the circle marker of a cluster.
+     * @param {Object} cluster - The cluster from parseCluster().
+     * @param {Array<Object>} species - The species from parseSpecies().
+     * @returns {Object} A Leaflet circle marker.
+     */
+    function clusterMarker(cluster, species) {
+        const tree = cluster.species === null ? null : species[cluster.species];
+        const color = tree ? tree.color : MIXED_CLUSTER_COLOR;
+        const marker = L.circleMarker([cluster.lat, cluster.lng], {
+            radius: clusterRadius(cluster.count),
+            color: color,
+            fillColor: color,
+            fillOpacity: 0.7
+        });
+        if (cluster.count === 1 && tree) {
+            marker.bindTooltip(tree.name);
+            marker.bindPopup(treePopup(tree));
+        } else {
+            marker.bindTooltip(cluster.count + " trees");
+        }
+        return marker;
+    }
+
+    /**
+     * Request a URL and parse the JSON response.
+     * @param {string} url - The URL to request.
+     * @returns {Promise<Object>} The response, or an error with the HTTP status if the request failed.
+     */
+    function fetchJson(url) {
+        return fetch(url).then(function(response) {
+            if (!response.ok) {
+                const error = new Error(response.statusText);
+                error.status = response.status;
+                throw error;
+            }
+            return response.json();
+        });
+    }
+
+    /**
+     * Draw the tree map in an element and load the clusters in view whenever the map moves.
+     * @param {HTMLElement} element - The map element, with the species and clusters feeds in
+     *     data-species-url and data-clusters-url.
+     * @returns {Object} The Leaflet map, or null if there is nothing to draw.
+     */
+    function initTreeMap(element) {
+        if (!element || typeof L === "undefined") {
+            return null;
+        }
+        const map = L.map(element, {worldCopyJump: true, maxZoom: MAX_ZOOM}).setView(MAP_CENTER, MAP_ZOOM);
+        L.tileLayer("https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png", {
+            attribution: "&copy; OpenStreetMap contributors",
+            maxZoom: MAX_ZOOM
+        }).addTo(map);
+
+        // Every zoom level has its own layer, so zooming back shows the clusters already loaded for it
+        let species = [];
+        let loader = null;
+        let layers = {};
+        let currentLayer = null;
+
+        function layerFor(zoom) {
+            if (!layers[zoom]) {
+                layers[zoom] = L.layerGroup();
+            }
+            return layers[zoom];
+        }
+
+        function refresh() {
+            if (!loader) {
+                return;
+            }
+            const zoom = map.getZoom();
+            const layer = layerFor(zoom);
+            if (layer !== currentLayer) {
+                if (currentLayer) {
+                    map.removeLayer(currentLayer);
+                }
+                layer.addTo(map);
+                currentLayer = layer;
+            }
+            const bounds = map.getBounds();
+            loader.load({
+                west: bounds.getWest(),
+                south: bounds.getSouth(),
+                east: bounds.getEast(),
+                north: bounds.getNorth()
+            }, zoom, function(clusters, clustersZoom) {
+                clusters.forEach(function(cluster) {
+                    clusterMarker(cluster, species).addTo(layerFor(clustersZoom));
+                });
+            });
+        }
+
+        // Read the species, then start over with an empty map whenever the tree dataset changes
+        function start() {
+            loader = null;
+            fetchJson(element.dataset.speciesUrl).then(function(data) {
+                species = parseSpecies(data);
+                renderLegend(document.getElementById("tree-map-legend"), species);
+                if (currentLayer) {
+                    map.removeLayer(currentLayer);
+                    currentLayer = null;
+                }
+                layers = {};
+                loader = createClusterLoader(element.dataset.clustersUrl, data.version, fetchJson, start);
+                refresh();
+            });
+        }
+
+        map.on("moveend", refresh);
+        start();
+        return map;
+    }
+
+    document.addEventListener("DOMContentLoaded", function() {
+        window.treeMap = initTreeMap(document.getElementById("tree-map"));
+    });
+
     window.myFunction = myFunction;
     window.showPage = showPage;
+    window.tileSize = tileSize;
+    window.tilesForBounds = tilesForBounds;
+    window.tileBbox = tileBbox;
+    window.clustersUrl = clustersUrl;
+    window.parseCluster = parseCluster;
+    window.parseSpecies = parseSpecies;
+    window.renderLegend = renderLegend;
+    window.createClusterLoader = createClusterLoader;
+    window.clusterRadius = clusterRadius;
 })();